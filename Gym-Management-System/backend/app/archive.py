@@ -0,0 +1,305 @@
+"""Archive tier for attendance and subscription history.
+
+Attendance and member_subscriptions only grow, so with ARCHIVE_ENABLED=True
+records older than a retention window are moved to archive collections once
+a day (ARCHIVE_INTERVAL_HOURS), keeping the hot collections and their
+indexes small enough to stay in memory:
+
+- attendance: visits checked in before the first day of the month
+  ARCHIVE_ATTENDANCE_MONTHS ago (whole buckets for the buckets layout)
+- member_subscriptions: expired subscriptions paid before the first day of
+  the month ARCHIVE_SUBSCRIPTIONS_MONTHS ago
+
+Archive collections are created with zstd block compression. Records move
+in batches (ARCHIVE_BATCH_SIZE) per branch: copied first, then deleted, so an
+interrupted run is simply repeated. Every worker starts a scheduler, but only
+the one holding the "archive" lease (app/leases.py) runs the archive.
+
+Reads go through find_attendance() / find_subscriptions(), which include the
+archive only when the query's range starts before the boundary stored in
+archive_state (unbounded queries always do). Each boundary is published
+BOUNDARY_TTL_SECONDS before records move past it, because workers cache it
+that long. Revenue totals of archived subscriptions are kept in
+archive_totals, so all-time dashboard figures never read the archive.
+"""
+import logging
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import List, Optional, Union
+from pymongo import ASCENDING
+from pymongo.errors import BulkWriteError, CollectionInvalid, PyMongoError
+from app.config import settings
+from app import database, http_cache, metrics
+from app.database import (
+    archive_state_collection,
+    archive_totals_collection,
+    member_subscriptions_collection,
+    member_subscriptions_archive_collection
+)
+from app.branches import all_branches, branch_scope
+from app.leases import Lease
+from app.attendance_store import attendance_store
+
+logger = logging.getLogger(__name__)
+
+# WiredTiger compresses with snappy by default; zstd trades CPU for space
+STORAGE_ENGINE = {"wiredTiger": {"configString": "block_compressor=zstd"}}
+ARCHIVE_INDEXES = {
+    "attendance_archive": [
+        [("branch_id", ASCENDING), ("check_in_time", ASCENDING)],
+        [("branch_id", ASCENDING), ("date", ASCENDING)],
+        [("branch_id", ASCENDING), ("member_id", ASCENDING), ("check_in_time", ASCENDING)]
+    ],
+    "attendance_buckets_archive": [
+        [("branch_id", ASCENDING), ("member_id", ASCENDING), ("month", ASCENDING)],
+        [("branch_id", ASCENDING), ("month", ASCENDING)]
+    ],
+    "member_subscriptions_archive": [
+        [("branch_id", ASCENDING), ("member_id", ASCENDING)],
+        [("branch_id", ASCENDING), ("payment_date", ASCENDING)]
+    ]
+}
+# How long workers cache a boundary
+BOUNDARY_TTL_SECONDS = 60
+DUPLICATE_KEY = 11000
+
+def months_ago(months: int, now: Optional[datetime] = None) -> datetime:
+    """First day of the month `months` before the current one"""
+    now = now or datetime.now()
+    index = now.year * 12 + now.month - 1 - months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+def ensure_collections():
+    """Create the compressed archive collections and their indexes"""
+    db = database.get_database()
+    for name, indexes in ARCHIVE_INDEXES.items():
+        try:
+            db.create_collection(name, storageEngine=STORAGE_ENGINE)
+        except CollectionInvalid:
+            pass
+        for keys in indexes:
+            db[name].create_index(keys)
+
+# ============ READ-THROUGH ============
+
+_boundaries = {}
+
+def archived_before(name: str) -> Optional[datetime]:
+    """Records of `name` before this may be archived (None: nothing is)"""
+    cached = _boundaries.get(name)
+    if cached and time.monotonic() - cached[1] < BOUNDARY_TTL_SECONDS:
+        return cached[0]
+    state = archive_state_collection.find_one({"_id": name})
+    boundary = state["archived_before"] if state else None
+    _boundaries[name] = (boundary, time.monotonic())
+    return boundary
+
+def reaches(name: str, start: Union[datetime, str, None] = None) -> bool:
+    """Whether a query from `start` (a datetime or YYYY-MM-DD date, None for
+    unbounded) reaches into the archive"""
+    boundary = archived_before(name)
+    if boundary is None:
+        return False
+    if start is None:
+        return True
+    if isinstance(start, str):
+        return start < boundary.strftime("%Y-%m-%d")
+    return start < boundary
+
+def _merge(hot: List[dict], archived: List[dict], sort: Optional[list]) -> List[dict]:
+    # A record being moved can briefly be in both tiers
+    seen = {record["_id"] for record in hot}
+    records = hot + [record for record in archived if record["_id"] not in seen]
+    for field, direction in reversed(sort or []):
+        records.sort(key=lambda record: record[field], reverse=direction < 0)
+    return records
+
+def find_attendance(query: dict, start: Union[datetime, str, None] = None,
+                    sort: Optional[list] = None, projection: Optional[dict] = None) -> List[dict]:
+    """Visits matching the query, from the archive too if `start` reaches it"""
+    records = attendance_store.find(query, sort=sort, projection=projection)
+    if not reaches("attendance", start):
+        return records
+    archived = attendance_store.find_archived(query, sort=sort, projection=projection)
+    return _merge(records, archived, sort)
+
+def find_subscriptions(query: dict, start: Optional[datetime] = None, sort: Optional[list] = None,
+                       projection: Optional[dict] = None) -> List[dict]:
+    """Member subscriptions matching the query, from the archive too if
+    `start` (a payment date) reaches it"""
+    def find(collection):
+        cursor = collection.find(query, projection)
+        if sort:
+            cursor = cursor.sort(sort)
+        return list(cursor)
+
+    records = find(member_subscriptions_collection)
+    # Active subscriptions are never archived
+    if query.get("status") == "active" or not reaches("member_subscriptions", start):
+        return records
+    return _merge(records, find(member_subscriptions_archive_collection), sort)
+
+def revenue_totals() -> List[dict]:
+    """Archived subscription totals, one document per branch in scope:
+    {branch_id, revenue, subscriptions, by_plan: {plan_id: {revenue, subscriptions}}}"""
+    return list(archive_totals_collection.find({"collection": "member_subscriptions"}))
+
+def archived_revenue() -> dict:
+    """Archived subscription totals of the current branch (or all branches)"""
+    totals = {"revenue": 0, "subscriptions": 0, "by_plan": defaultdict(lambda: {"revenue": 0, "subscriptions": 0})}
+    for branch in revenue_totals():
+        totals["revenue"] += branch["revenue"]
+        totals["subscriptions"] += branch["subscriptions"]
+        for plan_id, plan in branch["by_plan"].items():
+            totals["by_plan"][plan_id]["revenue"] += plan["revenue"]
+            totals["by_plan"][plan_id]["subscriptions"] += plan["subscriptions"]
+    return totals
+
+# ============ ARCHIVING ============
+
+def _publish(name: str, before: datetime, stop_event: threading.Event, settle_seconds: float) -> bool:
+    """Move the read-through boundary ahead of the records.
+
+    Returns False if stopped while workers pick up the new boundary.
+    """
+    state = archive_state_collection.find_one({"_id": name})
+    if state and state["archived_before"] >= before:
+        return True
+    archive_state_collection.update_one({"_id": name}, {"$max": {"archived_before": before}}, upsert=True)
+    _boundaries.pop(name, None)
+    logger.info("Archive boundary of %s moved to %s", name, before.date())
+    return not stop_event.wait(settle_seconds)
+
+def _move_batch(source, target, filter: dict) -> int:
+    batch = list(source.find(filter, limit=settings.archive_batch_size))
+    if not batch:
+        return 0
+    try:
+        target.insert_many(batch, ordered=False)
+    except BulkWriteError as e:
+        # Copied by an earlier run that stopped before deleting
+        if any(error["code"] != DUPLICATE_KEY for error in e.details["writeErrors"]):
+            raise
+    # Records changed meanwhile so they no longer qualify stay hot (and win on reads)
+    source.delete_many({**filter, "_id": {"$in": [record["_id"] for record in batch]}})
+    return len(batch)
+
+def _move(source, target, filter: dict, stop_event: threading.Event) -> int:
+    """Move matching records branch by branch, so each batch uses a branch index"""
+    with all_branches():
+        branches = source.distinct("branch_id")
+    moved = 0
+    for branch in branches:
+        # Records from before branches have none
+        scoped_filter = filter if branch is not None else {**filter, "branch_id": None}
+        with branch_scope(branch):
+            while not stop_event.is_set():
+                count = _move_batch(source, target, scoped_filter)
+                moved += count
+                if count < settings.archive_batch_size:
+                    break
+    return moved
+
+def _refresh_revenue_totals():
+    """Recompute archive_totals from the subscription archive"""
+    with all_branches():
+        rows = member_subscriptions_archive_collection.aggregate([
+            {"$group": {
+                "_id": {"branch_id": "$branch_id", "plan_id": "$plan_id"},
+                "revenue": {"$sum": "$payment_amount"},
+                "subscriptions": {"$sum": 1}
+            }}
+        ])
+        branches = defaultdict(lambda: {"revenue": 0, "subscriptions": 0, "by_plan": {}})
+        for row in rows:
+            branch = branches[row["_id"].get("branch_id")]
+            branch["revenue"] += row["revenue"]
+            branch["subscriptions"] += row["subscriptions"]
+            branch["by_plan"][str(row["_id"].get("plan_id"))] = {
+                "revenue": row["revenue"],
+                "subscriptions": row["subscriptions"]
+            }
+        for branch_id, totals in branches.items():
+            archive_totals_collection.replace_one(
+                {"_id": f"member_subscriptions:{branch_id}"},
+                {"collection": "member_subscriptions", "branch_id": branch_id, **totals},
+                upsert=True
+            )
+
+def run_archive(stop_event: Optional[threading.Event] = None,
+                settle_seconds: float = BOUNDARY_TTL_SECONDS) -> dict:
+    """Move history past the retention windows; returns the records moved"""
+    stop_event = stop_event or threading.Event()
+    ensure_collections()
+    moved = {}
+
+    before = months_ago(settings.archive_attendance_months)
+    if _publish("attendance", before, stop_event, settle_seconds):
+        moved["attendance"] = _move(
+            attendance_store.archive_source,
+            attendance_store.archive_target,
+            attendance_store.archive_filter(before),
+            stop_event
+        )
+
+    before = months_ago(settings.archive_subscriptions_months)
+    if _publish("member_subscriptions", before, stop_event, settle_seconds):
+        moved["member_subscriptions"] = _move(
+            member_subscriptions_collection,
+            member_subscriptions_archive_collection,
+            {"payment_date": {"$lt": before}, "status": {"$ne": "active"}},
+            stop_event
+        )
+        _refresh_revenue_totals()
+
+    for name, count in moved.items():
+        if count:
+            http_cache.bump(name)
+            metrics.inc("archive_records_moved_total", count, collection=name)
+    logger.info("Archived %s", moved)
+    return moved
+
+class ArchiveScheduler:
+    def __init__(self):
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.lease = Lease("archive")
+
+    def start(self):
+        self.lease.start()
+        self.thread = threading.Thread(target=self._run, name="archive", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+        self.lease.stop()
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            if not self.lease.held:
+                self.stop_event.wait(self.lease.renew_seconds)
+                continue
+            try:
+                run_archive(self.stop_event)
+            except PyMongoError:
+                logger.exception("Archive run failed")
+                metrics.inc("archive_errors_total")
+            self.stop_event.wait(settings.archive_interval_hours * 3600)
+
+# One scheduler per worker process, started by the lifespan; one of them archives
+scheduler: Optional[ArchiveScheduler] = None
+
+def start_scheduler():
+    global scheduler
+    if settings.archive_enabled and scheduler is None:
+        scheduler = ArchiveScheduler()
+        scheduler.start()
+
+def stop_scheduler():
+    global scheduler
+    if scheduler is not None:
+        scheduler.stop()
+        scheduler = None
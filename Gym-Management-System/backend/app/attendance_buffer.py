@@ -0,0 +1,356 @@
+"""Write-behind buffer for check-ins and check-outs.
+
+With ATTENDANCE_WRITE_BEHIND=True a turnstile scan is validated against the
+open sessions held in memory, appended to a local spill file and answered
+right away. A flusher thread writes the queued events to MongoDB with one
+unordered bulk_write per collection every ATTENDANCE_FLUSH_INTERVAL_MS, or as
+soon as ATTENDANCE_FLUSH_BATCH_SIZE events are waiting (group commit).
+Unordered bulk writes run all inserts before any update or delete, so a
+batch is cut before a member's check-in that follows their check-out; the
+new session's insert would otherwise hit the open one.
+
+Crash safety: every event reaches the spill file (ATTENDANCE_SPILL_PATH)
+before the scan is acknowledged, and the flusher fsyncs it each interval.
+A batch being written moves to "<spill>.flushing" and that file is removed
+once the writes succeed. On startup both files are replayed, skipping events
+that are already in the database. (A batch that failed half-way may miss
+counter updates; scripts/rebuild_attendance_stats.py repairs them.)
+
+The open-session state belongs to this process, so the buffer only runs on
+a single worker: startup fails when WEB_CONCURRENCY (set by gunicorn.conf.py
+to the worker count) is above 1. A scan that conflicts with a session
+opened elsewhere (another instance, the kiosk sync) is still rejected by the
+open-session unique index when flushed, but it has already been
+acknowledged: it is logged and counted in attendance_buffer_conflicts_total.
+"""
+import logging
+import os
+import threading
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import List, Optional
+from bson import ObjectId, json_util
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+from app.config import settings
+from app import database, http_cache, metrics
+from app.database import current_branch, scope_filter
+from app.attendance_store import attendance_store, check_out_fields
+from app.attendance_stats import check_in_update, check_out_update
+
+logger = logging.getLogger(__name__)
+
+# Naive datetimes in, naive datetimes out (the API stores local naive times)
+JSON_OPTIONS = json_util.DEFAULT_JSON_OPTIONS.with_options(tz_aware=False)
+DUPLICATE_KEY = 11000
+
+# ============ WRITING EVENTS ============
+
+def _unapplied(store, batch: List[dict]) -> List[dict]:
+    """Events of a replayed or retried batch that are not in the database"""
+    unapplied = []
+    for event in batch:
+        stored = store.get(event["visit"]["_id"])
+        if event["type"] == "check_in" and stored:
+            continue
+        if event["type"] == "check_out" and stored and stored.get("check_out_time"):
+            continue
+        unapplied.append(event)
+    return unapplied
+
+def _stats_op(event: dict) -> UpdateOne:
+    visit = event["visit"]
+    filter = {"_id": visit["member_id"]}
+    if visit.get("branch_id") is not None:
+        filter = scope_filter(filter, visit["branch_id"])
+    if event["type"] == "check_in":
+        return UpdateOne(filter, check_in_update(visit, event.get("join_date")), upsert=True)
+    return UpdateOne(filter, check_out_update(visit))
+
+def _rounds(batch: List[dict]) -> List[List[dict]]:
+    """Split a batch so no member checks in after checking out within a round"""
+    rounds, current, checked_out = [], [], set()
+    for event in batch:
+        member_id = event["visit"]["member_id"]
+        if event["type"] == "check_in":
+            if member_id in checked_out:
+                rounds.append(current)
+                current, checked_out = [], set()
+        else:
+            checked_out.add(member_id)
+        current.append(event)
+    if current:
+        rounds.append(current)
+    return rounds
+
+def write_events(store, batch: List[dict], verify: bool = False) -> set:
+    """Bulk write check-in/check-out events ({type, visit, join_date}) in
+    rounds of one unordered bulk_write per collection; returns the ids of
+    visits rejected because the member has an open session elsewhere.
+
+    With verify, events already in the database are skipped (replays).
+    """
+    if verify:
+        batch = _unapplied(store, batch)
+    if not batch:
+        return set()
+
+    rejected = set()
+    for events in _rounds(batch):
+        _write_round(store, events, rejected)
+    http_cache.bump("attendance")
+    return rejected
+
+def _write_round(store, batch: List[dict], rejected: set):
+    """Write one round, adding the visits rejected by the open-session key"""
+    ops = defaultdict(list)
+    for event in batch:
+        visit = event["visit"]
+        if event["type"] == "check_in":
+            pairs = store.check_in_ops(visit)
+        else:
+            pairs = store.check_out_ops(
+                visit, visit["check_out_time"], visit.get("auto_closed_at"), visit.get("sweep_id")
+            )
+        for name, op in pairs:
+            ops[name].append((visit["_id"], op))
+        ops["member_attendance_stats"].append((visit["_id"], _stats_op(event)))
+
+    db = database.get_database()
+    for name in store.bulk_order + ["member_attendance_stats"]:
+        entries = [(visit_id, op) for visit_id, op in ops[name] if visit_id not in rejected]
+        if not entries:
+            continue
+        try:
+            db[name].bulk_write([op for _, op in entries], ordered=False)
+        except BulkWriteError as e:
+            errors = e.details["writeErrors"]
+            if any(error["code"] != DUPLICATE_KEY for error in errors):
+                raise
+            rejected.update(entries[error["index"]][0] for error in errors)
+
+class AttendanceBuffer:
+    def __init__(self, store, spill_path: str):
+        self.store = store
+        self.spill_path = spill_path
+        self.flushing_path = spill_path + ".flushing"
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.spill = None
+        self.dirty = False
+        # Events acknowledged but not written yet, and the batch being written
+        self.pending = []
+        self.in_flight = None
+        # Open sessions by member, and every visit that is open or has unwritten events
+        self.open_by_member = {}
+        self.visits = {}
+        self.unwritten = Counter()
+
+    @property
+    def active(self) -> bool:
+        return self.thread is not None
+
+    # ============ LIFECYCLE ============
+
+    def start(self):
+        self._replay()
+        for visit in self.store.find({"check_out_time": None}):
+            self.open_by_member[visit["member_id"]] = visit
+            self.visits[visit["_id"]] = visit
+        self.spill = open(self.spill_path, "a")
+        self.thread = threading.Thread(target=self._run, name="attendance-buffer", daemon=True)
+        self.thread.start()
+        logger.info("Attendance write-behind enabled, %d open sessions", len(self.open_by_member))
+
+    def stop(self):
+        if not self.active:
+            return
+        self.stop_event.set()
+        self.wakeup.set()
+        self.thread.join()
+        self.thread = None
+        self.spill.close()
+        if not self.pending and self.in_flight is None:
+            os.remove(self.spill_path)
+
+    def _run(self):
+        interval = settings.attendance_flush_interval_ms / 1000
+        while not self.stop_event.is_set():
+            self.wakeup.wait(interval)
+            self.wakeup.clear()
+            self._flush_safely()
+        # Drain on shutdown
+        while (self.pending or self.in_flight) and self._flush_safely():
+            pass
+
+    def _flush_safely(self) -> bool:
+        try:
+            self.flush()
+            return True
+        except PyMongoError:
+            # Events stay in the spill files and are retried next interval
+            logger.exception("Attendance flush failed, retrying")
+            metrics.inc("attendance_buffer_flush_errors_total")
+            self.stop_event.wait(1)
+            return not self.stop_event.is_set()
+
+    # ============ EVENTS ============
+
+    def _append(self, event: dict):
+        # Written through to the OS before the scan is acknowledged
+        self.spill.write(json_util.dumps(event, json_options=JSON_OPTIONS) + "\n")
+        self.spill.flush()
+        self.dirty = True
+        self.pending.append(event)
+        self.unwritten[event["visit"]["_id"]] += 1
+        if len(self.pending) >= settings.attendance_flush_batch_size:
+            self.wakeup.set()
+
+    def check_in(self, visit: dict, join_date: Optional[datetime] = None) -> bool:
+        """Queue a check-in; False if the member already has an open session"""
+        branch = current_branch.get()
+        if branch is not None:
+            visit.setdefault("branch_id", branch)
+        with self.lock:
+            if visit["member_id"] in self.open_by_member:
+                return False
+            self.open_by_member[visit["member_id"]] = visit
+            self.visits[visit["_id"]] = visit
+            self._append({"type": "check_in", "visit": visit, "join_date": join_date})
+        return True
+
+    def holds(self, obj_id: ObjectId) -> bool:
+        return obj_id in self.visits
+
+    def get(self, obj_id: ObjectId) -> Optional[dict]:
+        visit = self.visits.get(obj_id)
+        return dict(visit) if visit else None
+
+    def check_out(self, obj_id: ObjectId, checkout_time: datetime,
+                  auto_closed_at: Optional[datetime] = None, sweep_id: Optional[str] = None) -> Optional[dict]:
+        """Queue a check-out; None if the session is not open here"""
+        with self.lock:
+            visit = self.visits.get(obj_id)
+            if not visit or visit.get("check_out_time"):
+                return None
+            if self.open_by_member.get(visit["member_id"]) is visit:
+                del self.open_by_member[visit["member_id"]]
+            visit = {**visit, **check_out_fields(checkout_time, auto_closed_at, sweep_id)}
+            self.visits[obj_id] = visit
+            self._append({"type": "check_out", "visit": visit})
+        return dict(visit)
+
+    def forget_visit(self, obj_id: ObjectId):
+        """Write queued events, then drop the visit (before deleting it)"""
+        if not self.active:
+            return
+        self.flush()
+        with self.lock:
+            visit = self.visits.pop(obj_id, None)
+            if visit and self.open_by_member.get(visit["member_id"]) is visit:
+                del self.open_by_member[visit["member_id"]]
+
+    def forget_member(self, member_id: str):
+        """Write queued events, then drop the member's open session"""
+        if not self.active:
+            return
+        self.flush()
+        with self.lock:
+            visit = self.open_by_member.pop(member_id, None)
+            if visit:
+                self.visits.pop(visit["_id"], None)
+
+    # ============ FLUSHING ============
+
+    def flush(self):
+        """Write queued events to the database"""
+        with self.flush_lock:
+            retry = self.in_flight is not None
+            rotated = None
+            with self.lock:
+                dirty, self.dirty = self.dirty, False
+                if not retry and self.pending:
+                    self.in_flight, self.pending = self.pending, []
+                    os.replace(self.spill_path, self.flushing_path)
+                    rotated, self.spill = self.spill, open(self.spill_path, "a")
+                spill = self.spill
+
+            # Synced outside the lock so scans are not held up
+            if rotated:
+                os.fsync(rotated.fileno())
+                rotated.close()
+            elif dirty:
+                os.fsync(spill.fileno())
+            if self.in_flight is None:
+                return
+
+            # A retried batch may have been partly written
+            rejected = self._write(self.in_flight, verify=retry)
+            os.remove(self.flushing_path)
+            self._written(self.in_flight, rejected)
+            self.in_flight = None
+            metrics.set_gauge("attendance_buffer_pending", len(self.pending))
+
+    def _write(self, batch: List[dict], verify: bool = False) -> set:
+        rejected = write_events(self.store, batch, verify)
+        metrics.inc("attendance_buffer_events_total", len(batch))
+        if rejected:
+            # Another worker holds an open session for these members
+            logger.warning("Attendance flush rejected %d conflicting check-ins: %s", len(rejected), rejected)
+            metrics.inc("attendance_buffer_conflicts_total", len(rejected))
+        return rejected
+
+    def _written(self, batch: List[dict], rejected: set):
+        with self.lock:
+            for event in batch:
+                visit_id = event["visit"]["_id"]
+                self.unwritten[visit_id] -= 1
+                if self.unwritten[visit_id] > 0:
+                    continue
+                del self.unwritten[visit_id]
+                visit = self.visits.get(visit_id)
+                if visit and (visit.get("check_out_time") or visit_id in rejected):
+                    del self.visits[visit_id]
+                    if self.open_by_member.get(visit["member_id"]) is visit:
+                        del self.open_by_member[visit["member_id"]]
+
+    def _replay(self):
+        """Write events left by a previous process"""
+        events = []
+        for path in (self.flushing_path, self.spill_path):
+            if not os.path.exists(path):
+                continue
+            with open(path) as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        events.append(json_util.loads(line, json_options=JSON_OPTIONS))
+                    except ValueError:
+                        # A line torn by the crash was never acknowledged
+                        logger.warning("Skipping unreadable attendance spill line in %s", path)
+        if events:
+            rejected = self._write(events, verify=True)
+            logger.info("Replayed %d buffered attendance events (%d rejected)", len(events), len(rejected))
+        for path in (self.flushing_path, self.spill_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+# One buffer per worker process, started by the lifespan
+attendance_buffer = AttendanceBuffer(attendance_store, settings.attendance_spill_path)
+
+def start_buffer():
+    if settings.attendance_write_behind and not attendance_buffer.active:
+        # Another worker's scans would miss this worker's open sessions
+        workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+        if workers > 1:
+            raise RuntimeError(
+                f"ATTENDANCE_WRITE_BEHIND needs a single worker, got WEB_CONCURRENCY={workers}"
+            )
+        attendance_buffer.start()
+
+def stop_buffer():
+    attendance_buffer.stop()
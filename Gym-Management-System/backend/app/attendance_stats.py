@@ -0,0 +1,134 @@
+"""Per-member attendance counters (member_attendance_stats collection).
+
+One document per member, keyed by member id:
+
+    {_id, join_month, total_visits, first_visit, last_visit, total_minutes,
+     monthly: {"YYYY-MM": visits}}
+
+Counters are updated with single atomic updates on check-in and check-out,
+so reading a member's stats never scans their attendance history. The
+rebuild functions recompute them from attendance, archived visits included
+(backfill, deletes).
+"""
+from datetime import datetime
+from typing import Optional
+from app.database import member_attendance_stats_collection
+from app.attendance_store import attendance_store
+
+def visit_minutes(visit: dict) -> float:
+    if not visit.get("check_out_time"):
+        return 0
+    return round((visit["check_out_time"] - visit["check_in_time"]).total_seconds() / 60, 2)
+
+def check_in_update(visit: dict, join_date: Optional[datetime] = None) -> dict:
+    check_in_time = visit["check_in_time"]
+    return {
+        "$inc": {"total_visits": 1, f"monthly.{check_in_time.strftime('%Y-%m')}": 1},
+        "$min": {"first_visit": check_in_time},
+        "$max": {"last_visit": check_in_time},
+        "$setOnInsert": {
+            "total_minutes": 0,
+            # Cohort key for retention analytics
+            "join_month": join_date.strftime("%Y-%m") if join_date else None
+        }
+    }
+
+def check_out_update(visit: dict) -> dict:
+    return {"$inc": {"total_minutes": visit_minutes(visit)}}
+
+def record_check_in(visit: dict, join_date: Optional[datetime] = None, session=None):
+    member_attendance_stats_collection.update_one(
+        {"_id": visit["member_id"]},
+        check_in_update(visit, join_date),
+        upsert=True,
+        session=session
+    )
+
+def record_check_out(visit: dict, session=None):
+    member_attendance_stats_collection.update_one(
+        {"_id": visit["member_id"]},
+        check_out_update(visit),
+        session=session
+    )
+
+def get_member_stats(member_id: str) -> Optional[dict]:
+    return member_attendance_stats_collection.find_one({"_id": member_id})
+
+def delete_member_stats(member_id: str, session=None):
+    member_attendance_stats_collection.delete_one({"_id": member_id}, session=session)
+
+def _stats_pipeline(match: dict) -> list:
+    return [
+        {"$match": match},
+        {"$group": {
+            "_id": {"member_id": "$member_id", "month": {"$substrBytes": ["$date", 0, 7]}},
+            "branch_id": {"$first": "$branch_id"},
+            "visits": {"$sum": 1},
+            "first_visit": {"$min": "$check_in_time"},
+            "last_visit": {"$max": "$check_in_time"},
+            "minutes": {"$sum": {"$divide": [
+                {"$subtract": [{"$ifNull": ["$check_out_time", "$check_in_time"]}, "$check_in_time"]},
+                60000
+            ]}}
+        }},
+        {"$group": {
+            "_id": "$_id.member_id",
+            "branch_id": {"$first": "$branch_id"},
+            "total_visits": {"$sum": "$visits"},
+            "first_visit": {"$min": "$first_visit"},
+            "last_visit": {"$max": "$last_visit"},
+            "total_minutes": {"$sum": "$minutes"},
+            "monthly": {"$push": {"k": "$_id.month", "v": "$visits"}}
+        }},
+        {"$set": {
+            "monthly": {"$arrayToObject": "$monthly"},
+            "total_minutes": {"$round": ["$total_minutes", 2]},
+            "member_oid": {"$convert": {"input": "$_id", "to": "objectId", "onError": None}}
+        }},
+        {"$lookup": {
+            "from": "members",
+            "localField": "member_oid",
+            "foreignField": "_id",
+            "as": "member"
+        }},
+        {"$set": {"join_month": {"$dateToString": {
+            "format": "%Y-%m",
+            "date": {"$arrayElemAt": ["$member.join_date", 0]}
+        }}}},
+        {"$unset": ["member_oid", "member"]}
+    ]
+
+def rebuild_member_stats(member_id: str):
+    """Recompute one member's counters from their attendance history"""
+    results = attendance_store.aggregate(_stats_pipeline({"member_id": member_id}), archived=True)
+    if results:
+        member_attendance_stats_collection.replace_one({"_id": member_id}, results[0], upsert=True)
+    else:
+        delete_member_stats(member_id)
+
+def rebuild_all_stats() -> int:
+    """Recompute every member's counters (server-side). Returns the member count.
+
+    Counters are replaced in place, so they stay readable during the
+    rebuild. Counters of members left without visits are removed afterwards,
+    except the ones a check-in touched meanwhile.
+    """
+    started = datetime.now().replace(microsecond=0)
+    attendance_store.aggregate(_stats_pipeline({}) + [
+        {"$set": {"rebuilt_at": started}},
+        {"$merge": {"into": "member_attendance_stats", "whenMatched": "replace"}}
+    ], archived=True)
+    member_attendance_stats_collection.delete_many({
+        "rebuilt_at": {"$ne": started},
+        "last_visit": {"$not": {"$gte": started}}
+    })
+    return member_attendance_stats_collection.count_documents({})
+
+def average_per_week(stats: dict) -> float:
+    first_date = stats["first_visit"].date()
+    last_date = stats["last_visit"].date()
+    weeks = max((last_date - first_date).days / 7, 1)
+    return stats["total_visits"] / weeks
+
+def current_month_visits(stats: dict) -> int:
+    return stats.get("monthly", {}).get(datetime.now().strftime("%Y-%m"), 0)
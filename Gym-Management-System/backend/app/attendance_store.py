@@ -0,0 +1,373 @@
+"""Attendance storage adapter.
+
+Routes read and write attendance through `attendance_store` so the same
+handlers work with either layout (settings.attendance_storage):
+
+- "documents": one document per visit in the attendance collection (default)
+- "buckets": one document per member and month in attendance_buckets, with
+  the visits embedded. Open sessions are guarded by attendance_open, which
+  holds one document per member that is currently checked in.
+
+Queries are always written against the flat visit fields (member_id, date,
+check_in_time, check_out_time) and return flat visit dicts.
+
+Visits written by the API carry `counted` (and `minutes_counted` once
+checked out): the member counters were updated along with the write, so the
+change stream consumer only applies counter deltas for visits written
+elsewhere (app/change_streams.py).
+"""
+from datetime import datetime
+from typing import List, Optional
+from bson import ObjectId
+from pymongo import DeleteOne, InsertOne, ReturnDocument, UpdateOne
+from app.config import settings
+from app.database import (
+    attendance_collection,
+    attendance_buckets_collection,
+    attendance_open_collection,
+    attendance_archive_collection,
+    attendance_buckets_archive_collection
+)
+
+def check_out_fields(checkout_time: datetime, auto_closed_at: Optional[datetime] = None,
+                     sweep_id: Optional[str] = None) -> dict:
+    """Fields set on check-out; sessions closed by the sweeper are marked with its run"""
+    fields = {"check_out_time": checkout_time, "minutes_counted": True}
+    if auto_closed_at is not None:
+        fields.update({"auto_closed": True, "auto_closed_at": auto_closed_at, "sweep_id": sweep_id})
+    return fields
+
+def _union_archive(archive: str, stages: list) -> dict:
+    """$unionWith stage adding the same visits from an archive collection
+    (scoped to the branch with the outer pipeline)"""
+    return {"$unionWith": {"coll": archive, "pipeline": stages}}
+
+def _split_match(pipeline: list):
+    """(leading $match, remaining stages) of a pipeline"""
+    if pipeline and "$match" in pipeline[0]:
+        return pipeline[0]["$match"], pipeline[1:]
+    return {}, pipeline
+
+def new_visit(member_id: str, check_in_time: datetime) -> dict:
+    """Build an open attendance record"""
+    return {
+        "_id": ObjectId(),
+        "member_id": member_id,
+        "check_in_time": check_in_time,
+        "check_out_time": None,
+        "date": check_in_time.strftime("%Y-%m-%d"),
+        "counted": True
+    }
+
+class DocumentAttendanceStore:
+    """One document per visit (the original layout)"""
+    layout = "documents"
+
+    def check_in(self, visit: dict, session=None) -> dict:
+        # Raises DuplicateKeyError if the member already has an open session
+        attendance_collection.insert_one(visit, session=session)
+        return visit
+
+    def check_out(self, obj_id: ObjectId, checkout_time: datetime, session=None) -> Optional[dict]:
+        """Close the session if it is still open, return the updated record"""
+        return attendance_collection.find_one_and_update(
+            {"_id": obj_id, "check_out_time": None},
+            {"$set": check_out_fields(checkout_time)},
+            return_document=ReturnDocument.AFTER,
+            session=session
+        )
+
+    # Bulk operations for buffered writes, as (collection, operation) pairs.
+    # The first collection in bulk_order holds the open-session guard.
+    bulk_order = ["attendance"]
+
+    def check_in_ops(self, visit: dict) -> list:
+        return [("attendance", InsertOne(visit))]
+
+    def check_out_ops(self, visit: dict, checkout_time: datetime,
+                      auto_closed_at: Optional[datetime] = None, sweep_id: Optional[str] = None) -> list:
+        return [("attendance", UpdateOne(
+            {"_id": visit["_id"], "check_out_time": None},
+            {"$set": check_out_fields(checkout_time, auto_closed_at, sweep_id)}
+        ))]
+
+    def find_open(self, started_before: datetime) -> List[dict]:
+        """Open sessions that started before the given time"""
+        # $type matches the partial open_sessions_by_check_in index
+        return list(attendance_collection.find({
+            "check_out_time": {"$type": "null"},
+            "check_in_time": {"$lt": started_before}
+        }))
+
+    def get(self, obj_id: ObjectId) -> Optional[dict]:
+        return attendance_collection.find_one({"_id": obj_id})
+
+    def find(self, query: dict, sort: Optional[list] = None, limit: int = 0,
+             projection: Optional[dict] = None) -> List[dict]:
+        cursor = attendance_collection.find(query, projection)
+        if sort:
+            cursor = cursor.sort(sort)
+        if limit:
+            cursor = cursor.limit(limit)
+        return list(cursor)
+
+    def find_one(self, query: dict, sort: Optional[list] = None) -> Optional[dict]:
+        return attendance_collection.find_one(query, sort=sort)
+
+    def count(self, query: dict) -> int:
+        return attendance_collection.count_documents(query)
+
+    def aggregate(self, pipeline: list, archived: bool = False) -> List[dict]:
+        """With archived=True the archive tier is included (stats rebuilds)"""
+        if archived:
+            match, rest = _split_match(pipeline)
+            pipeline = [{"$match": match}, _union_archive("attendance_archive", [{"$match": match}])] + rest
+        return list(attendance_collection.aggregate(pipeline))
+
+    # Archive tier (app/archive.py): visits are moved whole, once checked out
+    archive_source = attendance_collection
+    archive_target = attendance_archive_collection
+
+    def archive_filter(self, before: datetime) -> dict:
+        return {"check_in_time": {"$lt": before}, "check_out_time": {"$ne": None}}
+
+    def find_archived(self, query: dict, sort: Optional[list] = None,
+                      projection: Optional[dict] = None) -> List[dict]:
+        cursor = attendance_archive_collection.find(query, projection)
+        if sort:
+            cursor = cursor.sort(sort)
+        return list(cursor)
+
+    def delete(self, obj_id: ObjectId, session=None):
+        attendance_collection.delete_one({"_id": obj_id}, session=session)
+
+    def delete_member(self, member_id: str, session=None):
+        attendance_collection.delete_many({"member_id": member_id}, session=session)
+        attendance_archive_collection.delete_many({"member_id": member_id}, session=session)
+
+def bucket_id(member_id: str, month: str) -> str:
+    return f"{member_id}:{month}"
+
+def _month_condition(condition):
+    """Translate a condition on a visit date (YYYY-MM-DD or datetime) into one
+    on the bucket month (YYYY-MM). Returns None if it can't narrow the scan."""
+    def month(value):
+        if isinstance(value, datetime):
+            return value.strftime("%Y-%m")
+        return value[:7]
+
+    if isinstance(condition, (str, datetime)):
+        return month(condition)
+    if not isinstance(condition, dict):
+        return None
+
+    result = {}
+    for op, value in condition.items():
+        if op in ("$gte", "$gt"):
+            result["$gte"] = month(value)
+        elif op in ("$lte", "$lt"):
+            result["$lte"] = month(value)
+        elif op == "$in":
+            result["$in"] = sorted({month(v) for v in value})
+    return result or None
+
+def _bucket_prefilter(query: dict) -> dict:
+    """Bucket-level filter that selects every bucket the visit query can match"""
+    prefilter = {}
+    if "member_id" in query:
+        prefilter["member_id"] = query["member_id"]
+    for field in ("date", "check_in_time"):
+        if field in query:
+            month = _month_condition(query[field])
+            if month is not None:
+                prefilter["month"] = month
+                break
+    return prefilter
+
+class BucketAttendanceStore:
+    """Member-month buckets with embedded visits"""
+    layout = "buckets"
+
+    def _unwind(self, query: dict) -> list:
+        """Pipeline stages that expand matching buckets into flat visits"""
+        return [
+            {"$match": _bucket_prefilter(query)},
+            {"$unwind": "$visits"},
+            {"$replaceRoot": {"newRoot": {
+                "$mergeObjects": ["$visits", {"member_id": "$member_id", "branch_id": "$branch_id"}]
+            }}},
+            {"$match": query}
+        ]
+
+    def check_in(self, visit: dict, session=None) -> dict:
+        month = visit["date"][:7]
+        # Raises DuplicateKeyError if the member already has an open session
+        attendance_open_collection.insert_one({
+            "_id": visit["member_id"],
+            "attendance_id": visit["_id"],
+            "month": month
+        }, session=session)
+
+        # member_id and branch_id live on the bucket
+        embedded = {k: v for k, v in visit.items() if k not in ("member_id", "branch_id")}
+        try:
+            attendance_buckets_collection.update_one(
+                {"_id": bucket_id(visit["member_id"], month)},
+                {
+                    "$setOnInsert": {"member_id": visit["member_id"], "month": month},
+                    "$push": {"visits": embedded},
+                    "$inc": {"count": 1}
+                },
+                upsert=True,
+                session=session
+            )
+        except Exception:
+            attendance_open_collection.delete_one({"_id": visit["member_id"]}, session=session)
+            raise
+        return visit
+
+    def check_out(self, obj_id: ObjectId, checkout_time: datetime, session=None) -> Optional[dict]:
+        bucket = attendance_buckets_collection.find_one_and_update(
+            {"visits": {"$elemMatch": {"_id": obj_id, "check_out_time": None}}},
+            {"$set": {f"visits.$.{field}": value for field, value in check_out_fields(checkout_time).items()}},
+            projection={"member_id": 1, "visits": {"$elemMatch": {"_id": obj_id}}},
+            return_document=ReturnDocument.AFTER,
+            session=session
+        )
+        if not bucket:
+            return None
+
+        attendance_open_collection.delete_one(
+            {"_id": bucket["member_id"], "attendance_id": obj_id},
+            session=session
+        )
+        return {**bucket["visits"][0], "member_id": bucket["member_id"]}
+
+    bulk_order = ["attendance_open", "attendance_buckets"]
+
+    def check_in_ops(self, visit: dict) -> list:
+        month = visit["date"][:7]
+        embedded = {k: v for k, v in visit.items() if k not in ("member_id", "branch_id")}
+        return [
+            ("attendance_open", InsertOne({
+                "_id": visit["member_id"],
+                "branch_id": visit.get("branch_id"),
+                "attendance_id": visit["_id"],
+                "month": month
+            })),
+            ("attendance_buckets", UpdateOne(
+                {"_id": bucket_id(visit["member_id"], month)},
+                {
+                    "$setOnInsert": {"member_id": visit["member_id"], "month": month, "branch_id": visit.get("branch_id")},
+                    "$push": {"visits": embedded},
+                    "$inc": {"count": 1}
+                },
+                upsert=True
+            ))
+        ]
+
+    def check_out_ops(self, visit: dict, checkout_time: datetime,
+                      auto_closed_at: Optional[datetime] = None, sweep_id: Optional[str] = None) -> list:
+        fields = check_out_fields(checkout_time, auto_closed_at, sweep_id)
+        return [
+            ("attendance_buckets", UpdateOne(
+                {
+                    "_id": bucket_id(visit["member_id"], visit["date"][:7]),
+                    "visits": {"$elemMatch": {"_id": visit["_id"], "check_out_time": None}}
+                },
+                {"$set": {f"visits.$.{field}": value for field, value in fields.items()}}
+            )),
+            ("attendance_open", DeleteOne({"_id": visit["member_id"], "attendance_id": visit["_id"]}))
+        ]
+
+    def find_open(self, started_before: datetime) -> List[dict]:
+        # attendance_open is the index of open sessions
+        open_sessions = list(attendance_open_collection.find(
+            {"month": {"$lte": started_before.strftime("%Y-%m")}}
+        ))
+        if not open_sessions:
+            return []
+        return self.find({
+            "member_id": {"$in": [session["_id"] for session in open_sessions]},
+            "_id": {"$in": [session["attendance_id"] for session in open_sessions]},
+            "check_in_time": {"$lt": started_before}
+        })
+
+    def get(self, obj_id: ObjectId) -> Optional[dict]:
+        bucket = attendance_buckets_collection.find_one(
+            {"visits._id": obj_id},
+            {"member_id": 1, "visits": {"$elemMatch": {"_id": obj_id}}}
+        )
+        if not bucket:
+            return None
+        return {**bucket["visits"][0], "member_id": bucket["member_id"]}
+
+    def find(self, query: dict, sort: Optional[list] = None, limit: int = 0,
+             projection: Optional[dict] = None) -> List[dict]:
+        pipeline = self._unwind(query)
+        if sort:
+            pipeline.append({"$sort": dict(sort)})
+        if limit:
+            pipeline.append({"$limit": limit})
+        if projection:
+            pipeline.append({"$project": projection})
+        return list(attendance_buckets_collection.aggregate(pipeline))
+
+    def find_one(self, query: dict, sort: Optional[list] = None) -> Optional[dict]:
+        records = self.find(query, sort=sort, limit=1)
+        return records[0] if records else None
+
+    def count(self, query: dict) -> int:
+        pipeline = self._unwind(query) + [{"$count": "count"}]
+        result = list(attendance_buckets_collection.aggregate(pipeline))
+        return result[0]["count"] if result else 0
+
+    def aggregate(self, pipeline: list, archived: bool = False) -> List[dict]:
+        # A leading $match is applied to the flat visits (and narrows the buckets)
+        match, rest = _split_match(pipeline)
+        stages = self._unwind(match)
+        if archived:
+            stages.append(_union_archive("attendance_buckets_archive", self._unwind(match)))
+        return list(attendance_buckets_collection.aggregate(stages + rest))
+
+    # Archive tier: whole months, once none of their visits is open
+    archive_source = attendance_buckets_collection
+    archive_target = attendance_buckets_archive_collection
+
+    def archive_filter(self, before: datetime) -> dict:
+        return {"month": {"$lt": before.strftime("%Y-%m")}, "visits.check_out_time": {"$ne": None}}
+
+    def find_archived(self, query: dict, sort: Optional[list] = None,
+                      projection: Optional[dict] = None) -> List[dict]:
+        pipeline = self._unwind(query)
+        if sort:
+            pipeline.append({"$sort": dict(sort)})
+        if projection:
+            pipeline.append({"$project": projection})
+        return list(attendance_buckets_archive_collection.aggregate(pipeline))
+
+    def delete(self, obj_id: ObjectId, session=None):
+        bucket = attendance_buckets_collection.find_one_and_update(
+            {"visits._id": obj_id},
+            {"$pull": {"visits": {"_id": obj_id}}, "$inc": {"count": -1}},
+            projection={"member_id": 1},
+            session=session
+        )
+        if bucket:
+            attendance_open_collection.delete_one(
+                {"_id": bucket["member_id"], "attendance_id": obj_id},
+                session=session
+            )
+
+    def delete_member(self, member_id: str, session=None):
+        attendance_buckets_collection.delete_many({"member_id": member_id}, session=session)
+        attendance_buckets_archive_collection.delete_many({"member_id": member_id}, session=session)
+        attendance_open_collection.delete_one({"_id": member_id}, session=session)
+
+def create_store(layout: str):
+    if layout == "buckets":
+        return BucketAttendanceStore()
+    return DocumentAttendanceStore()
+
+# Store for the configured layout, shared by all routes
+attendance_store = create_store(settings.attendance_storage)
@@ -6,7 +6,7 @@ from argon2.exceptions import VerifyMismatchError
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from app.config import settings
-from app.database import database
+from app.database import users_collection
 
 # Password hashing with Argon2
 ph = PasswordHasher()
@@ -14,9 +14,6 @@ ph = PasswordHasher()
 # OAuth2 scheme
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
-# Collections
-users_collection = database["users"]
-
 # Password functions
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     try:
@@ -60,6 +57,15 @@ def verify_token(token: str):
             detail="Could not validate credentials"
         )
 
+# Claims of a bearer token (no database lookup), None if missing or invalid
+def token_claims(authorization: Optional[str]) -> Optional[dict]:
+    if not authorization or not authorization.lower().startswith("bearer "):
+        return None
+    try:
+        return jwt.decode(authorization[7:], settings.secret_key, algorithms=[settings.algorithm])
+    except JWTError:
+        return None
+
 # Get current user
 async def get_current_user(token: str = Depends(oauth2_scheme)):
     token_data = verify_token(token)
@@ -0,0 +1,62 @@
+"""Branch (gym location) resolution.
+
+Every request runs in the scope of one branch: the `branch_id` claim of its
+bearer token, the default branch for anonymous requests, or the branch an
+admin selects with the X-Branch-ID header. The branch-scoped collections in
+app/database.py read it from `current_branch`, so route code stays unaware
+of branches.
+
+Code outside a request (jobs, scripts) can enter a branch explicitly:
+
+    with branch_scope(job["branch_id"]):
+        reports.yearly_revenue(2024)
+"""
+from contextlib import contextmanager
+from typing import Optional
+from starlette.datastructures import Headers
+from app.config import settings
+from app.database import current_branch
+from app.auth import token_claims
+
+BRANCH_HEADER = "x-branch-id"
+
+def get_branch() -> Optional[str]:
+    """Branch of the current request, None outside a branch scope"""
+    return current_branch.get()
+
+@contextmanager
+def branch_scope(branch: Optional[str]):
+    """Run a block in a branch (None: every branch, unscoped)"""
+    token = current_branch.set(branch)
+    try:
+        yield branch
+    finally:
+        current_branch.reset(token)
+
+def all_branches():
+    """Run a block across every branch (cross-branch rollups)"""
+    return branch_scope(None)
+
+def resolve_branch(headers: Headers) -> str:
+    claims = token_claims(headers.get("authorization"))
+    if not claims:
+        return settings.default_branch
+
+    branch = claims.get("branch_id") or settings.default_branch
+    # Admins can work on any branch
+    if claims.get("role") == "admin" and headers.get(BRANCH_HEADER):
+        branch = headers[BRANCH_HEADER]
+    return branch
+
+class BranchMiddleware:
+    """Sets the branch scope for each HTTP request"""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        with branch_scope(resolve_branch(Headers(scope=scope))):
+            await self.app(scope, receive, send)
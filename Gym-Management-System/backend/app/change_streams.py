@@ -0,0 +1,356 @@
+"""Change stream consumer keeping caches and rollups in sync with the database.
+
+Writes can come from any worker, admin scripts or the mongo shell, so caches
+and precomputed rollups are refreshed from MongoDB change streams instead of
+relying on the API call sites. Needs a replica set (a single node is enough)
+and CHANGE_STREAMS_ENABLED=True.
+
+Handlers are registered per collection and receive batches of change events:
+
+    subscribe("subscription_plans", invalidate_plans)              # every worker
+    subscribe("attendance", refresh_rollup, rollup=True)           # one worker
+
+Local handlers (in-process caches) run in every worker. Rollup handlers write
+shared collections, so only the worker holding the lease in
+`change_stream_state` runs them; it stores the resume token there after each
+batch and a worker taking over the lease resumes from it. If the token has
+fallen off the oplog the rollups are rebuilt from scratch.
+
+Attendance counters get $inc/$min/$max deltas taken from the change events,
+only for visits written outside the API (the API updates them with the
+write). Events after the last stored token are delivered again to a worker
+taking over the lease, so such writes may be counted twice then;
+scripts/rebuild_attendance_stats.py repairs the counters.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional
+from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError, OperationFailure, PyMongoError
+from app.config import settings
+from app import database, http_cache, metrics
+from app.database import (
+    scope_filter,
+    change_stream_state_collection,
+    members_collection,
+    member_attendance_stats_collection
+)
+from app.attendance_stats import (
+    check_in_update,
+    check_out_update,
+    rebuild_member_stats,
+    rebuild_all_stats,
+    delete_member_stats
+)
+from app.branches import branch_scope
+
+logger = logging.getLogger(__name__)
+
+# Collections whose changes are consumed
+WATCHED = ["members", "member_subscriptions", "attendance", "attendance_buckets", "subscription_plans"]
+
+CONSUMER_ID = "rollups"
+CHANGE_STREAM_HISTORY_LOST = 286
+MAX_BATCH = 500
+
+_local_handlers = defaultdict(list)
+_rollup_handlers = defaultdict(list)
+
+def subscribe(collection: str, callback: Callable[[List[dict]], None], rollup: bool = False):
+    """Call callback(changes) with each batch of change events on collection"""
+    if rollup:
+        _rollup_handlers[collection].append(callback)
+    else:
+        _local_handlers[collection].append(callback)
+
+class ChangeStreamConsumer:
+    def __init__(self):
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.leader = False
+        # Resume point of this worker's stream (local handlers)
+        self.token = None
+
+    def start(self):
+        # pymongo is blocking, so the stream is consumed on its own thread
+        self.thread = threading.Thread(target=self._run, name="change-streams", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+        if self.leader:
+            # Let another worker take over right away
+            change_stream_state_collection.update_one(
+                {"_id": CONSUMER_ID, "owner": self.owner},
+                {"$set": {"lease_until": datetime.now()}}
+            )
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            try:
+                self._consume()
+            except OperationFailure as e:
+                if e.code != CHANGE_STREAM_HISTORY_LOST:
+                    logger.exception("Change stream failed, restarting")
+                    self.stop_event.wait(5)
+                    continue
+                logger.warning("Change stream resume token is no longer in the oplog")
+                self.token = None
+                if self.leader:
+                    self._resync()
+            except PyMongoError:
+                logger.exception("Change stream failed, restarting")
+                self.stop_event.wait(5)
+
+    def _consume(self):
+        self.leader = self._renew_lease()
+        resume_after = self._stored_token() if self.leader else self.token
+
+        with database.get_database().watch(
+            [{"$match": {"ns.coll": {"$in": WATCHED}}}],
+            full_document="updateLookup",
+            resume_after=resume_after,
+            max_await_time_ms=1000
+        ) as stream:
+            lease_checked = time.monotonic()
+            while stream.alive and not self.stop_event.is_set():
+                batch = self._next_batch(stream)
+                if batch:
+                    self._dispatch(batch)
+                self.token = stream.resume_token
+
+                lease_due = time.monotonic() - lease_checked > settings.change_streams_lease_seconds / 3
+                # Idle streams still advance the token; store it with the lease renewal
+                if self.leader and (batch or lease_due):
+                    self._save_token(self.token)
+
+                if lease_due:
+                    lease_checked = time.monotonic()
+                    if self._renew_lease() != self.leader:
+                        # Reopen from the right resume point
+                        return
+
+    def _next_batch(self, stream) -> List[dict]:
+        """Changes available now (waits up to a second for the first one)"""
+        batch = []
+        deadline = time.monotonic() + 1
+        while len(batch) < MAX_BATCH and time.monotonic() < deadline:
+            change = stream.try_next()
+            if change is None:
+                break
+            batch.append(change)
+        return batch
+
+    def _dispatch(self, batch: List[dict]):
+        by_collection = defaultdict(list)
+        for change in batch:
+            if "ns" in change:
+                by_collection[change["ns"]["coll"]].append(change)
+
+        for collection, changes in by_collection.items():
+            handlers = list(_local_handlers[collection])
+            if self.leader:
+                handlers += _rollup_handlers[collection]
+            for handler in handlers:
+                try:
+                    handler(changes)
+                except Exception:
+                    logger.exception("Change handler %s failed for %s", handler.__name__, collection)
+
+    def _renew_lease(self) -> bool:
+        """Take or extend the rollup lease; False if another worker holds it"""
+        now = datetime.now()
+        try:
+            change_stream_state_collection.find_one_and_update(
+                {"_id": CONSUMER_ID, "$or": [{"owner": self.owner}, {"lease_until": {"$lte": now}}]},
+                {"$set": {
+                    "owner": self.owner,
+                    "lease_until": now + timedelta(seconds=settings.change_streams_lease_seconds)
+                }},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            return False
+        return True
+
+    def _stored_token(self):
+        state = change_stream_state_collection.find_one({"_id": CONSUMER_ID})
+        return state.get("token") if state else None
+
+    def _save_token(self, token):
+        change_stream_state_collection.update_one(
+            {"_id": CONSUMER_ID, "owner": self.owner},
+            {"$set": {"token": token, "saved_at": datetime.now()}}
+        )
+
+    def _resync(self):
+        """Rebuild every rollup after missing changes"""
+        rebuild_all_stats()
+        http_cache.bump(*{version_name(collection) for collection in WATCHED})
+        change_stream_state_collection.update_one(
+            {"_id": CONSUMER_ID, "owner": self.owner},
+            {"$unset": {"token": ""}}
+        )
+
+# ============ ROLLUP HANDLERS ============
+
+def version_name(collection: str) -> str:
+    # Both attendance layouts back the same list endpoints
+    return "attendance" if collection == "attendance_buckets" else collection
+
+def _bump_versions(changes: List[dict]):
+    http_cache.bump(version_name(changes[0]["ns"]["coll"]))
+
+def _owned(bucket: dict, visit: dict) -> dict:
+    # member_id and branch_id live on the bucket
+    return {**visit, "member_id": bucket.get("member_id"), "branch_id": bucket.get("branch_id")}
+
+def _written_delta(visit: dict) -> Optional[dict]:
+    """Delta of a visit written whole (inserted or pushed)"""
+    counted = bool(visit.get("counted"))
+    minutes = bool(visit.get("check_out_time")) and not (counted and visit.get("minutes_counted"))
+    if counted and not minutes:
+        return None
+    return {"visit": visit, "check_in": not counted, "minutes": minutes}
+
+def _uncounted(change: dict) -> Optional[List[dict]]:
+    """Counter deltas of a visit change, as {visit, check_in, minutes}.
+
+    Visits written by the API are marked counted / minutes_counted (their
+    counters were updated with the write), so only writes made elsewhere
+    produce deltas. None when the change can't be turned into deltas and the
+    member's counters must be rebuilt.
+    """
+    document = change.get("fullDocument")
+    if not document or change["operationType"] not in ("insert", "update"):
+        # Deleted visits carry no member id (no pre-images) and are moved to
+        # the archive, which the counters include; replacements are rare
+        return None if change["operationType"] == "replace" else []
+    buckets = change["ns"]["coll"] == "attendance_buckets"
+
+    if change["operationType"] == "insert":
+        visits = [_owned(document, visit) for visit in document.get("visits", [])] if buckets else [document]
+        return [delta for delta in map(_written_delta, visits) if delta]
+
+    fields = change["updateDescription"]["updatedFields"]
+    if not buckets:
+        if fields.get("check_out_time") and "minutes_counted" not in fields:
+            return [{"visit": document, "check_in": False, "minutes": True}]
+        return []
+
+    deltas = []
+    for key, value in fields.items():
+        path = key.split(".")
+        if path[0] != "visits":
+            continue
+        if len(path) == 1 or not path[1].isdigit():
+            return None
+        if len(path) == 2:
+            # A pushed visit
+            delta = _written_delta(_owned(document, value))
+            if delta:
+                deltas.append(delta)
+        elif path[2] == "check_out_time" and value and f"visits.{path[1]}.minutes_counted" not in fields:
+            visits = document.get("visits", [])
+            if int(path[1]) >= len(visits):
+                return None
+            deltas.append({"visit": _owned(document, visits[int(path[1])]), "check_in": False, "minutes": True})
+    return deltas
+
+def _member_key(change: dict):
+    """(branch_id, member_id) of a changed visit or bucket"""
+    document = change.get("fullDocument") or {}
+    if change["ns"]["coll"] == "attendance_buckets":
+        # Bucket _id is "<member_id>:<YYYY-MM>"
+        return document.get("branch_id"), str(change["documentKey"]["_id"]).split(":")[0]
+    return document.get("branch_id"), document.get("member_id")
+
+def _join_dates(member_ids: set) -> dict:
+    ids = [ObjectId(member_id) for member_id in member_ids if ObjectId.is_valid(member_id)]
+    if not ids:
+        return {}
+    return {
+        str(member["_id"]): member.get("join_date")
+        for member in members_collection.find({"_id": {"$in": ids}}, {"join_date": 1})
+    }
+
+def _refresh_attendance_stats(changes: List[dict]):
+    """Apply counter deltas for visits written outside the API"""
+    deltas, rebuild = [], set()
+    for change in changes:
+        changed = _uncounted(change)
+        if changed is None:
+            rebuild.add(_member_key(change))
+        else:
+            deltas += changed
+
+    if deltas:
+        join_dates = _join_dates({delta["visit"]["member_id"] for delta in deltas if delta["check_in"]})
+        ops = []
+        for delta in deltas:
+            visit = delta["visit"]
+            filter = {"_id": visit["member_id"]}
+            if visit.get("branch_id") is not None:
+                filter = scope_filter(filter, visit["branch_id"])
+            if delta["check_in"]:
+                ops.append(UpdateOne(filter, check_in_update(visit, join_dates.get(visit["member_id"])), upsert=True))
+            if delta["minutes"]:
+                ops.append(UpdateOne(filter, check_out_update(visit)))
+        # Ordered: a visit's check-in creates the counters its minutes go to
+        database.get_database()["member_attendance_stats"].bulk_write(ops)
+        metrics.inc("change_stream_counter_deltas_total", len(deltas))
+
+    for branch, member_id in rebuild:
+        if member_id is None:
+            continue
+        # The branch lets the rebuild use the branch-leading indexes
+        with branch_scope(branch):
+            rebuild_member_stats(member_id)
+
+def _refresh_member_rollups(changes: List[dict]):
+    for change in changes:
+        member_id = str(change["documentKey"]["_id"])
+        if change["operationType"] == "delete":
+            delete_member_stats(member_id)
+            continue
+
+        if change["operationType"] == "update" and "join_date" not in change["updateDescription"]["updatedFields"]:
+            continue
+        member = change.get("fullDocument")
+        if member and member.get("join_date"):
+            member_attendance_stats_collection.update_one(
+                {"_id": member_id},
+                {"$set": {"join_month": member["join_date"].strftime("%Y-%m")}}
+            )
+
+for _collection in WATCHED:
+    subscribe(_collection, _bump_versions, rollup=True)
+subscribe("attendance", _refresh_attendance_stats, rollup=True)
+subscribe("attendance_buckets", _refresh_attendance_stats, rollup=True)
+subscribe("members", _refresh_member_rollups, rollup=True)
+
+# One consumer per worker process, started by the lifespan
+consumer = None
+
+def start_consumer():
+    global consumer
+    if settings.change_streams_enabled and consumer is None:
+        consumer = ChangeStreamConsumer()
+        consumer.start()
+
+def stop_consumer():
+    global consumer
+    if consumer is not None:
+        consumer.stop()
+        consumer = None
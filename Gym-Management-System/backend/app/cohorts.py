@@ -0,0 +1,153 @@
+"""Cohort, renewal and churn analytics.
+
+Everything here runs as aggregation pipelines over the precomputed
+per-member counters (member_attendance_stats, which carry the member's join
+month and visits per month) plus members and member_subscriptions, so cost
+grows with members and months, never with the attendance history.
+"""
+from datetime import datetime
+from dateutil.relativedelta import relativedelta
+from app.database import (
+    members_collection,
+    member_subscriptions_collection,
+    member_attendance_stats_collection
+)
+from app.plan_catalog import plan_catalog
+
+def month_index(expr):
+    """Aggregation expression turning a "YYYY-MM" string into year * 12 + month"""
+    return {"$add": [
+        {"$multiply": [{"$toInt": {"$substrBytes": [expr, 0, 4]}}, 12]},
+        {"$toInt": {"$substrBytes": [expr, 5, 2]}}
+    ]}
+
+def _months_between(start: str, end: str) -> int:
+    start_year, start_month = map(int, start.split("-"))
+    end_year, end_month = map(int, end.split("-"))
+    return (end_year * 12 + end_month) - (start_year * 12 + start_month)
+
+def retention(start_month: str, months: int) -> list:
+    """Share of each join-month cohort that checked in 0..months months later"""
+    start_date = datetime.strptime(start_month, "%Y-%m")
+    current_month = datetime.now().strftime("%Y-%m")
+
+    sizes = members_collection.aggregate([
+        {"$match": {"join_date": {"$gte": start_date}}},
+        {"$group": {
+            "_id": {"$dateToString": {"format": "%Y-%m", "date": "$join_date"}},
+            "members": {"$sum": 1},
+            "active": {"$sum": {"$cond": [{"$eq": ["$status", "active"]}, 1, 0]}}
+        }}
+    ])
+
+    retained = member_attendance_stats_collection.aggregate([
+        {"$match": {"join_month": {"$gte": start_month}}},
+        {"$project": {"join_month": 1, "months": {"$objectToArray": "$monthly"}}},
+        {"$unwind": "$months"},
+        {"$project": {
+            "cohort": "$join_month",
+            "offset": {"$subtract": [month_index("$months.k"), month_index("$join_month")]}
+        }},
+        {"$match": {"offset": {"$gte": 0, "$lte": months}}},
+        {"$group": {"_id": {"cohort": "$cohort", "offset": "$offset"}, "members": {"$sum": 1}}}
+    ])
+
+    visited = {(row["_id"]["cohort"], row["_id"]["offset"]): row["members"] for row in retained}
+
+    cohorts = []
+    for row in sorted(sizes, key=lambda r: r["_id"]):
+        cohort, size = row["_id"], row["members"]
+        # Only months that have started so far
+        observed = min(months, _months_between(cohort, current_month))
+        cohorts.append({
+            "cohort": cohort,
+            "members": size,
+            "active_now": row["active"],
+            "active_share": round(row["active"] / size, 4),
+            "retention": [
+                round(visited.get((cohort, offset), 0) / size, 4)
+                for offset in range(observed + 1)
+            ]
+        })
+    return cohorts
+
+def renewal_rates() -> list:
+    """Renewal rate per plan: renewals / (renewals + subscriptions left expired)"""
+    plan_names = plan_catalog.plan_names()
+
+    rows = member_subscriptions_collection.aggregate([
+        {"$group": {
+            "_id": "$plan_id",
+            "subscriptions": {"$sum": 1},
+            "renewals": {"$sum": {"$ifNull": ["$renewal_count", 0]}},
+            "renewed_subscriptions": {"$sum": {"$cond": [{"$gt": [{"$ifNull": ["$renewal_count", 0]}, 0]}, 1, 0]}},
+            "expired": {"$sum": {"$cond": [{"$eq": ["$status", "expired"]}, 1, 0]}}
+        }}
+    ])
+
+    result = []
+    for row in rows:
+        ended_terms = row["renewals"] + row["expired"]
+        result.append({
+            "plan_id": row["_id"],
+            "plan_name": plan_names.get(row["_id"], "Unknown"),
+            "subscriptions": row["subscriptions"],
+            "renewals": row["renewals"],
+            "renewed_subscriptions": row["renewed_subscriptions"],
+            "expired": row["expired"],
+            "renewal_rate": round(row["renewals"] / ended_terms, 4) if ended_terms else 0
+        })
+    result.sort(key=lambda r: r["renewal_rate"], reverse=True)
+    return result
+
+def visit_decay(months_before: int, since_months: int) -> dict:
+    """Average visits per month in the months before a subscription expired.
+
+    Covers subscriptions that are expired and ended within the last
+    `since_months` months. Offset 0 is the month the subscription ended.
+    """
+    since = datetime.now() - relativedelta(months=since_months)
+
+    result = list(member_subscriptions_collection.aggregate([
+        {"$match": {"status": "expired", "end_date": {"$gte": since}}},
+        {"$project": {
+            "member_id": 1,
+            "end_month": {"$dateToString": {"format": "%Y-%m", "date": "$end_date"}}
+        }},
+        {"$facet": {
+            "subscriptions": [{"$count": "count"}],
+            "visits": [
+                {"$lookup": {
+                    "from": "member_attendance_stats",
+                    "localField": "member_id",
+                    "foreignField": "_id",
+                    "as": "stats"
+                }},
+                {"$project": {
+                    "end_month": 1,
+                    "months": {"$objectToArray": {"$ifNull": [{"$arrayElemAt": ["$stats.monthly", 0]}, {}]}}
+                }},
+                {"$unwind": "$months"},
+                {"$project": {
+                    "visits": "$months.v",
+                    "offset": {"$subtract": [month_index("$months.k"), month_index("$end_month")]}
+                }},
+                {"$match": {"offset": {"$gte": -months_before, "$lte": 0}}},
+                {"$group": {"_id": "$offset", "visits": {"$sum": "$visits"}}}
+            ]
+        }}
+    ]))[0]
+
+    subscriptions = result["subscriptions"][0]["count"] if result["subscriptions"] else 0
+    visits = {row["_id"]: row["visits"] for row in result["visits"]}
+
+    return {
+        "expired_subscriptions": subscriptions,
+        "months_before_expiry": [
+            {
+                "offset": offset,
+                "average_visits": round(visits.get(offset, 0) / subscriptions, 2) if subscriptions else 0
+            }
+            for offset in range(-months_before, 1)
+        ]
+    }
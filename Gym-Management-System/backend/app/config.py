@@ -1,7 +1,5 @@
 from pydantic_settings import BaseSettings
-from dotenv import load_dotenv
-
-load_dotenv()
+from typing import Optional
 
 class Settings(BaseSettings):
     app_name: str = "Gym Management System"
@@ -11,8 +9,91 @@ class Settings(BaseSettings):
     secret_key: str
     algorithm: str = "HS256"
     access_token_expire_minutes: str = "1440"
+    # Multi-document transactions need a replica set (a single node is enough)
+    mongodb_transactions: bool = False
+    # Attendance layout: "documents" (one per visit) or "buckets" (member-month)
+    attendance_storage: str = "documents"
+    # Write-behind check-ins/check-outs: acknowledged from memory, flushed in
+    # batches (run check-ins on a single worker when enabled)
+    attendance_write_behind: bool = False
+    attendance_flush_interval_ms: float = 10
+    attendance_flush_batch_size: int = 500
+    attendance_spill_path: str = "attendance_spill.jsonl"
+    # Stale session sweeper: open sessions are closed once they are older than
+    # the maximum, or at the end of their day once that day has passed
+    attendance_sweep_enabled: bool = True
+    attendance_max_session_hours: float = 6
+    attendance_sweep_interval_seconds: float = 300
+    # Archive tier: history older than the retention window (whole months) is
+    # moved to compressed archive collections; reads reaching back include it
+    archive_enabled: bool = False
+    archive_attendance_months: int = 12
+    archive_subscriptions_months: int = 24
+    archive_batch_size: int = 1000
+    archive_interval_hours: float = 24
+    # The sweeper and the archive run in one worker at a time, under a lease
+    # renewed by heartbeat (app/leases.py)
+    scheduler_lease_seconds: int = 60
+    # Kiosk mode: a front desk instance serving member lookups, check-ins and
+    # check-outs from a local SQLite copy while the central database is
+    # unreachable, synced in batches when it is back (kiosk_branch defaults
+    # to default_branch)
+    kiosk_mode: bool = False
+    kiosk_branch: Optional[str] = None
+    kiosk_db_path: str = "kiosk.sqlite3"
+    kiosk_sync_interval_seconds: float = 30
+    kiosk_snapshot_interval_seconds: float = 300
+    kiosk_sync_batch_size: int = 500
+    # Connection pool, per worker process
+    mongodb_max_pool_size: int = 100
+    mongodb_min_pool_size: int = 0
+    mongodb_wait_queue_timeout_ms: int = 5000
+    mongodb_server_selection_timeout_ms: int = 5000
+    mongodb_connect_timeout_ms: int = 10000
+    # Background report jobs, per worker process
+    jobs_enabled: bool = True
+    jobs_max_concurrent: int = 2
+    jobs_result_ttl_seconds: int = 86400
+    jobs_lease_seconds: int = 60
+    jobs_poll_seconds: float = 1
+    # Rate limiting (per process unless a Redis URL is set, needs `redis`)
+    rate_limit_enabled: bool = True
+    rate_limit_redis_url: Optional[str] = None
+    rate_limit_trust_forwarded: bool = False
+    rate_limit_login_per_minute: int = 10
+    rate_limit_login_account_per_minute: int = 5
+    rate_limit_login_burst: int = 5
+    rate_limit_analytics_per_minute: int = 60
+    rate_limit_analytics_burst: int = 20
+    analytics_max_concurrent: int = 4
+    # Response compression (brotli needs `brotli-asgi`, gzip otherwise)
+    compression_minimum_size: int = 1024
+    compression_brotli_quality: int = 4
+    # Read/write splitting on a replica set: analytics and report jobs read
+    # from secondaries no more than this far behind (at least 90 seconds)
+    analytics_read_preference: str = "secondaryPreferred"
+    analytics_max_staleness_seconds: int = 90
+    # Query time budgets: one deadline per request shared by all its
+    # database calls (sent as maxTimeMS); overruns return 504
+    query_timeout_seconds: float = 10
+    analytics_query_timeout_seconds: float = 30
+    # Change stream consumer (needs a replica set, like transactions)
+    change_streams_enabled: bool = False
+    change_streams_lease_seconds: int = 30
+    # Branch for users and data without one (single-branch deployments)
+    default_branch: str = "main"
+    # In-memory plan catalog: version check interval and full reload age
+    plan_catalog_check_seconds: float = 5
+    plan_catalog_ttl_seconds: float = 300
+    # Profiling: admins can profile a request (X-Profile: 1), or sample a share
+    profiling_enabled: bool = False
+    profiling_sample_rate: float = 0
+    profiling_interval_ms: float = 1
+    profiling_dir: str = "profiles"
+    profiling_keep: int = 100
 
     class Config:
+        # Settings (and .env) are loaded once here; other modules import `settings`
         env_file = ".env"
 
 settings = Settings()
\ No newline at end of file
@@ -1,23 +1,484 @@
-from pymongo import MongoClient
-from dotenv import load_dotenv
-import os
+from pymongo import MongoClient, ASCENDING, InsertOne, ReplaceOne, monitoring
+from pymongo.collation import Collation
+from pymongo.errors import OperationFailure
+from pymongo.read_concern import ReadConcern
+from pymongo.read_preferences import Primary, PrimaryPreferred, Secondary, SecondaryPreferred, Nearest
+from pymongo.server_type import SERVER_TYPE
+from pymongo.write_concern import WriteConcern
+from app.config import settings
+from contextvars import ContextVar
+from contextlib import contextmanager
+import copy
+import logging
+import time
 
-load_dotenv()
+logger = logging.getLogger(__name__)
 
-MONGODB_URL = os.getenv("MONGODB_URL")
-DATABASE_NAME = os.getenv("DATABASE_NAME")
+# The client is created per process by connect() (called from the app
+# lifespan), so every gunicorn/uvicorn worker gets its own pool after forking
+# and importing this module never touches the network.
+client = None
+database = None
 
-client = MongoClient(MONGODB_URL)
-database = client[DATABASE_NAME]
+# Branch (gym location) of the current request, set by BranchMiddleware.
+# None means no scoping: startup, scripts, job and change stream threads.
+current_branch: ContextVar = ContextVar("current_branch", default=None)
+
+# Read preference of the current request's reads, set per router with
+# use_read_preference(). None means the client default (primary).
+current_read_preference: ContextVar = ContextVar("current_read_preference", default=None)
+
+# Servers the current request read from with a non-primary preference
+# (a set, installed by ReadStalenessMiddleware)
+servers_read: ContextVar = ContextVar("servers_read", default=None)
+
+# Set (a threading.Event) when the current request's client disconnected,
+# by deadlines.CancelOnDisconnectMiddleware
+request_cancelled: ContextVar = ContextVar("request_cancelled", default=None)
+
+class RequestCancelled(Exception):
+    """The client went away; raised by the request's next database call"""
+
+# Case-insensitive matching for names typed by staff (exercises, trainers).
+# Queries must pass the same collation to use indexes created with it.
+CASE_INSENSITIVE = Collation("en", strength=2)
+
+# Methods whose first argument is a filter
+FILTER_METHODS = {
+    "find", "find_one", "find_one_and_update", "find_one_and_replace", "find_one_and_delete",
+    "count_documents", "update_one", "update_many", "replace_one", "delete_one", "delete_many"
+}
+
+def scope_filter(filter, branch: str) -> dict:
+    if filter is None:
+        filter = {}
+    elif not isinstance(filter, dict):
+        filter = {"_id": filter}
+    # An explicit branch_id (cross-branch queries) is left alone
+    if "branch_id" in filter:
+        return filter
+    return {"branch_id": branch, **filter}
+
+def scope_pipeline(pipeline, branch: str) -> list:
+    """The pipeline confined to a branch, $unionWith sub-pipelines included"""
+    if pipeline and "$match" in pipeline[0]:
+        pipeline = [{"$match": scope_filter(pipeline[0]["$match"], branch)}] + list(pipeline[1:])
+    else:
+        pipeline = [{"$match": {"branch_id": branch}}] + list(pipeline)
+    scoped = []
+    for stage in pipeline:
+        if "$unionWith" in stage:
+            union = stage["$unionWith"]
+            if isinstance(union, str):
+                union = {"coll": union}
+            stage = {"$unionWith": {**union, "pipeline": scope_pipeline(union.get("pipeline", []), branch)}}
+        scoped.append(stage)
+    return scoped
+
+def scope_request(request, branch: str):
+    """Copy of a bulk_write request confined to a branch"""
+    request = copy.copy(request)
+    # pymongo has no public accessors for a request's filter and document
+    if isinstance(request, InsertOne):
+        request._doc.setdefault("branch_id", branch)
+        return request
+    request._filter = scope_filter(request._filter, branch)
+    if isinstance(request, ReplaceOne):
+        # Replacements keep their branch
+        request._doc.setdefault("branch_id", branch)
+    return request
+
+class LazyCollection:
+    """Collection handle that can be imported before the client exists.
+    
+    Branch-scoped collections add the current branch to every filter,
+    inserted document, bulk write request, distinct and aggregation
+    ($unionWith included), so handlers never see another branch's data and
+    queries can use the indexes leading on branch_id.
+    """
+    def __init__(self, name: str, branch_scoped: bool = False, primary_reads: bool = False):
+        self.name = name
+        self.branch_scoped = branch_scoped
+        # Ignore the request's read preference (auth must see the latest users)
+        self.primary_reads = primary_reads
+    
+    def __getattr__(self, attr):
+        cancelled = request_cancelled.get()
+        if cancelled is not None and cancelled.is_set():
+            raise RequestCancelled()
+        preference = None if self.primary_reads else current_read_preference.get()
+        if preference is None:
+            collection = get_database()[self.name]
+        else:
+            collection = get_database().get_collection(self.name, read_preference=preference)
+        target = getattr(collection, attr)
+        branch = current_branch.get() if self.branch_scoped else None
+        if branch is None:
+            return target
+        
+        if attr in FILTER_METHODS:
+            def scoped(*args, **kwargs):
+                if args:
+                    args = (scope_filter(args[0], branch),) + args[1:]
+                else:
+                    kwargs["filter"] = scope_filter(kwargs.get("filter"), branch)
+                # Replacements keep their branch
+                if attr in ("replace_one", "find_one_and_replace"):
+                    replacement = args[1] if len(args) > 1 else kwargs["replacement"]
+                    replacement.setdefault("branch_id", branch)
+                return target(*args, **kwargs)
+            return scoped
+        
+        if attr == "insert_one":
+            def insert_one(document, *args, **kwargs):
+                document.setdefault("branch_id", branch)
+                return target(document, *args, **kwargs)
+            return insert_one
+        
+        if attr == "insert_many":
+            def insert_many(documents, *args, **kwargs):
+                documents = list(documents)
+                for document in documents:
+                    document.setdefault("branch_id", branch)
+                return target(documents, *args, **kwargs)
+            return insert_many
+        
+        if attr == "aggregate":
+            def aggregate(pipeline, *args, **kwargs):
+                return target(scope_pipeline(pipeline, branch), *args, **kwargs)
+            return aggregate
+        
+        if attr == "bulk_write":
+            def bulk_write(requests, *args, **kwargs):
+                return target([scope_request(request, branch) for request in requests], *args, **kwargs)
+            return bulk_write
+        
+        if attr == "distinct":
+            def distinct(key, filter=None, *args, **kwargs):
+                return target(key, scope_filter(filter, branch), *args, **kwargs)
+            return distinct
+        
+        return target
 
 # Collections
-members_collection = database["members"]
-subscriptions_collection = database["subscriptions"]
-attendance_collection = database["attendance"]
-plans_collection = database["subscription_plans"]
-member_subscriptions_collection = database["member_subscriptions"]
-workout_plans_collection = database["workout_plans"]
-users_collection = database["users"]
+members_collection = LazyCollection("members", branch_scoped=True)
+subscriptions_collection = LazyCollection("subscriptions", branch_scoped=True)
+attendance_collection = LazyCollection("attendance", branch_scoped=True)
+attendance_buckets_collection = LazyCollection("attendance_buckets", branch_scoped=True)
+attendance_open_collection = LazyCollection("attendance_open", branch_scoped=True)
+member_attendance_stats_collection = LazyCollection("member_attendance_stats", branch_scoped=True)
+plans_collection = LazyCollection("subscription_plans", branch_scoped=True)
+member_subscriptions_collection = LazyCollection("member_subscriptions", branch_scoped=True)
+workout_plans_collection = LazyCollection("workout_plans", branch_scoped=True)
+workout_templates_collection = LazyCollection("workout_templates", branch_scoped=True)
+jobs_collection = LazyCollection("jobs", branch_scoped=True)
+# Archive tier (app/archive.py): history older than the retention window
+attendance_archive_collection = LazyCollection("attendance_archive", branch_scoped=True)
+attendance_buckets_archive_collection = LazyCollection("attendance_buckets_archive", branch_scoped=True)
+member_subscriptions_archive_collection = LazyCollection("member_subscriptions_archive", branch_scoped=True)
+archive_totals_collection = LazyCollection("archive_totals", branch_scoped=True)
+# Users log in before a branch is known; they carry their branch_id instead
+users_collection = LazyCollection("users", primary_reads=True)
+collection_versions_collection = LazyCollection("collection_versions")
+change_stream_state_collection = LazyCollection("change_stream_state")
+job_results_collection = LazyCollection("job_results")
+archive_state_collection = LazyCollection("archive_state")
+leases_collection = LazyCollection("leases")
+
+# ============ READ PREFERENCES ============
+# Reads go to the primary unless a router opts into another preference:
+#
+#     router = APIRouter(dependencies=[Depends(use_read_preference(ANALYTICS_READS))])
+#
+# Writes always go to the primary. On a standalone server every preference
+# reads from it.
+
+READ_MODES = {
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest
+}
+
+def read_preference(mode: str, max_staleness_seconds: int = -1):
+    """Read preference from its config name; maxStalenessSeconds must be at least 90"""
+    if mode == "primary":
+        return Primary()
+    return READ_MODES[mode](max_staleness=max_staleness_seconds)
+
+# Analytics routes and report jobs: secondaries, within the staleness bound
+ANALYTICS_READS = read_preference(settings.analytics_read_preference, settings.analytics_max_staleness_seconds)
+
+def use_read_preference(preference):
+    """Router dependency running the request's reads with `preference`"""
+    async def dependency():
+        # Async, so it is set in the request's own context
+        current_read_preference.set(None if isinstance(preference, Primary) else preference)
+    return dependency
+
+@contextmanager
+def read_preference_scope(preference):
+    """Run a block's reads with `preference` (jobs and scripts)"""
+    token = current_read_preference.set(None if isinstance(preference, Primary) else preference)
+    try:
+        yield
+    finally:
+        current_read_preference.reset(token)
+
+class ServerTracker(monitoring.CommandListener):
+    """Records the servers that serve a request's non-primary reads"""
+    def started(self, event):
+        servers = servers_read.get()
+        if servers is not None and current_read_preference.get() is not None:
+            servers.add(event.connection_id)
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+def replication_lag(servers) -> float:
+    """Seconds the most stale of `servers` is behind the primary (0 for the
+    primary itself or a standalone), from the driver's last heartbeats"""
+    descriptions = client.topology_description.server_descriptions()
+    secondaries = [
+        descriptions[address] for address in servers
+        if address in descriptions and descriptions[address].server_type == SERVER_TYPE.RSSecondary
+    ]
+    if not secondaries:
+        return 0.0
+
+    primary = next((server for server in descriptions.values() if server.server_type == SERVER_TYPE.RSPrimary), None)
+    if primary is not None and primary.last_write_date:
+        newest = primary.last_write_date
+    else:
+        # No primary: compare with the most recent secondary
+        newest = max(server.last_write_date for server in descriptions.values() if server.last_write_date)
+    return max(max((newest - server.last_write_date).total_seconds(), 0) for server in secondaries)
+
+class ReadStalenessMiddleware:
+    """Reports how stale a request's secondary reads may be (X-Read-Staleness, seconds)"""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        servers = set()
+        token = servers_read.set(servers)
+
+        async def send_with_staleness(message):
+            if message["type"] == "http.response.start" and servers:
+                headers = list(message.get("headers", []))
+                headers.append((b"x-read-staleness", f"{replication_lag(servers):.1f}".encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_staleness)
+        finally:
+            servers_read.reset(token)
+
+def connect() -> MongoClient:
+    """Create this process's MongoClient with the pool settings from config"""
+    global client, database
+    if client is None:
+        client = MongoClient(
+            settings.mongodb_url,
+            maxPoolSize=settings.mongodb_max_pool_size,
+            minPoolSize=settings.mongodb_min_pool_size,
+            waitQueueTimeoutMS=settings.mongodb_wait_queue_timeout_ms,
+            serverSelectionTimeoutMS=settings.mongodb_server_selection_timeout_ms,
+            connectTimeoutMS=settings.mongodb_connect_timeout_ms,
+            event_listeners=[ServerTracker()]
+        )
+        database = client[settings.database_name]
+    return client
+
+def close():
+    """Close this process's client and its pooled connections"""
+    global client, database
+    if client is not None:
+        client.close()
+        client = None
+        database = None
 
 def get_database():
-    return database
\ No newline at end of file
+    if database is None:
+        connect()
+    return database
+
+def run_in_transaction(callback):
+    """Run callback(session) in a transaction and return its result.
+
+    Transient errors and unknown commit results are retried by pymongo's
+    with_transaction. When transactions are disabled (standalone server) the
+    callback runs without a session.
+    """
+    if not settings.mongodb_transactions:
+        return callback(None)
+    
+    with connect().start_session() as session:
+        return session.with_transaction(
+            callback,
+            read_concern=ReadConcern("snapshot"),
+            write_concern=WriteConcern("majority")
+        )
+
+def create_attendance_indexes(layout: str):
+    """Create the indexes for an attendance layout ("documents" or "buckets")"""
+    if layout == "buckets":
+        # Open sessions are guarded by attendance_open's _id (the member id).
+        # Bucket _id is "<member_id>:<YYYY-MM>"; these back the range scans.
+        attendance_buckets_collection.create_index([("branch_id", ASCENDING), ("member_id", ASCENDING), ("month", ASCENDING)])
+        attendance_buckets_collection.create_index([("branch_id", ASCENDING), ("month", ASCENDING)])
+        attendance_buckets_collection.create_index([("visits._id", ASCENDING)])
+        return
+    
+    # Time-range scans (occupancy, reports) and per-member history (stats rebuilds)
+    attendance_collection.create_index([("branch_id", ASCENDING), ("check_in_time", ASCENDING)])
+    attendance_collection.create_index([("branch_id", ASCENDING), ("date", ASCENDING)])
+    attendance_collection.create_index([("branch_id", ASCENDING), ("member_id", ASCENDING), ("check_in_time", ASCENDING)])
+    
+    try:
+        # At most one open session (check_out_time is null) per member.
+        # Check-in relies on this index to reject concurrent duplicate scans.
+        attendance_collection.create_index(
+            [("member_id", ASCENDING)],
+            name="one_open_session_per_member",
+            unique=True,
+            partialFilterExpression={"check_out_time": {"$type": "null"}}
+        )
+    except OperationFailure as e:
+        # Usually caused by members that already have several open sessions
+        logger.warning("Could not create open attendance session index: %s", e)
+    
+    # Open sessions by check-in time, for the stale session sweeper
+    attendance_collection.create_index(
+        [("check_in_time", ASCENDING)],
+        name="open_sessions_by_check_in",
+        partialFilterExpression={"check_out_time": {"$type": "null"}}
+    )
+
+def create_indexes():
+    """Create the indexes the API relies on (safe to call on every startup).
+    
+    Branch-scoped queries always filter on branch_id, so their indexes lead
+    with it and one branch never scans another's documents.
+    """
+    create_attendance_indexes(settings.attendance_storage)
+    
+    # Member lists and lookups
+    members_collection.create_index([("branch_id", ASCENDING), ("status", ASCENDING)])
+    members_collection.create_index([("branch_id", ASCENDING), ("email", ASCENDING)])
+    member_subscriptions_collection.create_index([("branch_id", ASCENDING), ("member_id", ASCENDING)])
+    member_subscriptions_collection.create_index([("branch_id", ASCENDING), ("payment_date", ASCENDING)])
+    workout_plans_collection.create_index([("branch_id", ASCENDING), ("member_id", ASCENDING), ("created_date", ASCENDING)])
+    
+    # Workout plan search: multikey on exercise names, trainer load. Every
+    # branch of the exercise search's $or needs an index with the search's
+    # collation, including the template assignments
+    workout_plans_collection.create_index(
+        [("branch_id", ASCENDING), ("exercises.name", ASCENDING)],
+        collation=CASE_INSENSITIVE
+    )
+    workout_plans_collection.create_index(
+        [("branch_id", ASCENDING), ("template_id", ASCENDING)],
+        collation=CASE_INSENSITIVE
+    )
+    workout_plans_collection.create_index(
+        [("branch_id", ASCENDING), ("trainer_name", ASCENDING)],
+        collation=CASE_INSENSITIVE
+    )
+    workout_plans_collection.create_index(
+        [("branch_id", ASCENDING), ("overrides.added.name", ASCENDING)],
+        collation=CASE_INSENSITIVE
+    )
+    workout_templates_collection.create_index(
+        [("branch_id", ASCENDING), ("exercises.name", ASCENDING)],
+        collation=CASE_INSENSITIVE
+    )
+    workout_templates_collection.create_index([("branch_id", ASCENDING), ("name", ASCENDING)])
+    
+    
+    # Cohort and churn analytics
+    members_collection.create_index([("branch_id", ASCENDING), ("join_date", ASCENDING)])
+    member_subscriptions_collection.create_index([("branch_id", ASCENDING), ("status", ASCENDING), ("end_date", ASCENDING)])
+    member_attendance_stats_collection.create_index([("branch_id", ASCENDING), ("join_month", ASCENDING)])
+    
+    # Background jobs: claim order (all branches), listing, result chunks, TTL cleanup
+    jobs_collection.create_index([("status", ASCENDING), ("created_at", ASCENDING)])
+    jobs_collection.create_index([("branch_id", ASCENDING), ("created_at", ASCENDING)])
+    jobs_collection.create_index([("expires_at", ASCENDING)], expireAfterSeconds=0)
+    job_results_collection.create_index([("job_id", ASCENDING), ("seq", ASCENDING)])
+    job_results_collection.create_index([("expires_at", ASCENDING)], expireAfterSeconds=0)
+    
+    try:
+        # At most one active subscription per member, even without transactions
+        member_subscriptions_collection.create_index(
+            [("member_id", ASCENDING)],
+            name="one_active_subscription_per_member",
+            unique=True,
+            partialFilterExpression={"status": "active"}
+        )
+    except OperationFailure as e:
+        logger.warning("Could not create active subscription index: %s", e)
+    
+    try:
+        # Template assignments: one per member and template
+        workout_plans_collection.create_index(
+            [("branch_id", ASCENDING), ("template_id", ASCENDING), ("member_id", ASCENDING)],
+            name="one_assignment_per_member_and_template",
+            unique=True,
+            partialFilterExpression={"template_id": {"$exists": True}}
+        )
+    except OperationFailure as e:
+        logger.warning("Could not create template assignment index: %s", e)
+
+class UnmigratedDataError(RuntimeError):
+    """Documents from before multi-branch support are still unassigned"""
+
+def check_branches_assigned():
+    """Refuse to start while documents without a branch_id exist: no
+    branch-scoped request would ever see (or update) them"""
+    collections = [
+        members_collection,
+        member_subscriptions_collection,
+        plans_collection,
+        workout_plans_collection,
+        workout_templates_collection,
+        member_attendance_stats_collection,
+        attendance_buckets_collection if settings.attendance_storage == "buckets" else attendance_collection
+    ]
+    # Index lookups (branch_id: null also matches missing fields)
+    unassigned = [
+        collection.name for collection in collections
+        if get_database()[collection.name].find_one({"branch_id": None}, {"_id": 1})
+    ]
+    if unassigned:
+        raise UnmigratedDataError(
+            f"Documents without a branch_id in {', '.join(unassigned)}; "
+            "run `python -m scripts.assign_branch` before starting the API"
+        )
+
+def init_database() -> dict:
+    """Connect, warm up the pool with a ping and create indexes.
+
+    Returns the time spent in each step (ms) for startup reporting.
+    """
+    timings = {}
+    
+    started = time.perf_counter()
+    connect().admin.command("ping")
+    timings["connect_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    
+    started = time.perf_counter()
+    create_indexes()
+    timings["indexes_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    
+    check_branches_assigned()
+    
+    return timings
@@ -0,0 +1,111 @@
+"""Query deadlines and cancellation of abandoned requests.
+
+Routers declare a time budget with query_deadline(seconds)
+(QUERY_TIMEOUT_SECONDS, ANALYTICS_QUERY_TIMEOUT_SECONDS for analytics).
+It is one deadline for the whole request: pymongo sends each query the
+remaining time as maxTimeMS, so the server stops scanning when it runs
+out, and calls made after it has passed fail without being sent. An
+overrun returns 504 (503 if no server or connection could be had in time)
+and counts in query_deadline_exceeded_total.
+
+GET and HEAD requests are also cancelled when the client disconnects
+(closing the analytics page): the handler task is cancelled and every
+later database call of the request raises RequestCancelled, so work in
+the threadpool stops at its next query. Writes always run to completion.
+"""
+import asyncio
+import threading
+from contextlib import suppress
+import pymongo
+from fastapi import Request, status
+from fastapi.responses import JSONResponse, Response
+from pymongo.errors import PyMongoError, ServerSelectionTimeoutError, WaitQueueTimeoutError
+from app import metrics
+from app.database import request_cancelled, RequestCancelled
+
+# nginx's "client closed request"
+CLIENT_CLOSED_REQUEST = 499
+
+def query_deadline(seconds: float):
+    """Router dependency giving every database call of the request one
+    shared deadline, `seconds` from the start of the request"""
+    async def dependency():
+        # Async, so the deadline is set in the request's own context (and
+        # copied into the threadpool with it)
+        with pymongo.timeout(seconds):
+            yield
+    return dependency
+
+def _route_path(scope) -> str:
+    # The route template, so IDs don't become metric labels
+    route = scope.get("route")
+    return route.path if route is not None else scope["path"]
+
+async def query_timeout_handler(request: Request, exc: PyMongoError):
+    """Deadline overruns become 504/503 instead of 500"""
+    if not exc.timeout:
+        raise exc
+    metrics.inc("query_deadline_exceeded_total", route=_route_path(request.scope))
+    if isinstance(exc, (ServerSelectionTimeoutError, WaitQueueTimeoutError)):
+        # Never reached the database: no server or pooled connection in time
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"detail": "Database unavailable. Please try again shortly."},
+            headers={"Retry-After": "5"}
+        )
+    return JSONResponse(
+        status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+        content={"detail": "The request took too long and was stopped. Try a shorter date range."}
+    )
+
+async def request_cancelled_handler(request: Request, exc: RequestCancelled):
+    # Nobody is listening; this only keeps it out of the error log
+    return Response(status_code=CLIENT_CLOSED_REQUEST)
+
+class CancelOnDisconnectMiddleware:
+    """Cancels GET/HEAD requests whose client disconnected"""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("GET", "HEAD"):
+            await self.app(scope, receive, send)
+            return
+
+        cancelled = threading.Event()
+        token = request_cancelled.set(cancelled)
+        messages = asyncio.Queue()
+        finished = False
+
+        async def watch():
+            # The app reads its (empty) body from the queue meanwhile
+            while True:
+                message = await receive()
+                messages.put_nowait(message)
+                if message["type"] == "http.disconnect":
+                    return
+
+        async def send_tracked(message):
+            nonlocal finished
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                finished = True
+
+        # Started after the event is set, so the handler's context has it
+        handler = asyncio.create_task(self.app(scope, messages.get, send_tracked))
+        watcher = asyncio.create_task(watch())
+        try:
+            await asyncio.wait({handler, watcher}, return_when=asyncio.FIRST_COMPLETED)
+            # The server also reports a disconnect once the response is sent
+            if not handler.done() and not finished:
+                cancelled.set()
+                handler.cancel()
+                metrics.inc("requests_cancelled_total", route=_route_path(scope))
+                # Threadpool work can't be interrupted; it stops at its next query
+                with suppress(asyncio.CancelledError):
+                    await handler
+                return
+            await handler
+        finally:
+            watcher.cancel()
+            request_cancelled.reset(token)
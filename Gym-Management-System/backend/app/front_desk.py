@@ -0,0 +1,77 @@
+"""Front desk operations: member lookup, check-in and check-out.
+
+The check-in, check-out and member lookup routes go through `front_desk`,
+so the same handlers run against either backend:
+
+- MongoFrontDesk: the central database (through the write-behind buffer
+  when ATTENDANCE_WRITE_BEHIND=True), the default
+- KioskStore: the kiosk's local SQLite copy with KIOSK_MODE=True, synced
+  with the central database in the background (see app/kiosk.py)
+
+check_in() returns False when the member already has an open session, and
+check_out() returns None when the session is no longer open.
+"""
+from datetime import datetime
+from typing import Optional
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+from app.config import settings
+from app.database import members_collection, run_in_transaction
+from app.http_cache import bump
+from app.attendance_store import attendance_store
+from app.attendance_stats import record_check_in, record_check_out
+from app.attendance_buffer import attendance_buffer
+from app.kiosk import kiosk_store
+
+class MongoFrontDesk:
+    """The central database"""
+
+    def get_member(self, obj_id: ObjectId) -> Optional[dict]:
+        return members_collection.find_one({"_id": obj_id})
+
+    def get_visit(self, obj_id: ObjectId) -> Optional[dict]:
+        # Sessions opened in write-behind mode may not be written yet
+        return attendance_buffer.get(obj_id) or attendance_store.get(obj_id)
+
+    def check_in(self, visit: dict, join_date: Optional[datetime] = None) -> bool:
+        # Write-behind: validated against the open sessions in memory, written
+        # to the database in the next batch
+        if attendance_buffer.active:
+            return attendance_buffer.check_in(visit, join_date)
+
+        # The store enforces one open session per member with a unique key in
+        # the database, so concurrent scans cannot both create an open session
+        def record(session):
+            attendance_store.check_in(visit, session=session)
+            record_check_in(visit, join_date, session=session)
+
+        try:
+            run_in_transaction(record)
+        except DuplicateKeyError:
+            return False
+        bump("attendance")
+        return True
+
+    def check_out(self, obj_id: ObjectId, checkout_time: datetime) -> Optional[dict]:
+        if attendance_buffer.holds(obj_id):
+            return attendance_buffer.check_out(obj_id, checkout_time)
+
+        def record(session):
+            # Only close the session if it is still open (guards concurrent check-outs)
+            updated = attendance_store.check_out(obj_id, checkout_time, session=session)
+            if updated:
+                record_check_out(updated, session=session)
+            return updated
+
+        updated = run_in_transaction(record)
+        if updated:
+            bump("attendance")
+        return updated
+
+def create_front_desk(kiosk_mode: bool):
+    if kiosk_mode:
+        return kiosk_store
+    return MongoFrontDesk()
+
+# Backend for this instance, shared by the front desk routes
+front_desk = create_front_desk(settings.kiosk_mode)
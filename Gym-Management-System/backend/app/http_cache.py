@@ -0,0 +1,61 @@
+"""Conditional GET for list endpoints.
+
+Every write bumps a per-collection change counter in `collection_versions`
+({_id: collection name, version, updated_at}). List endpoints derive a weak
+ETag from the counters of the collections they read plus the request URL, so
+an unchanged list is answered with 304 after a single _id lookup instead of
+re-running the query and re-sending the payload:
+
+    @router.get("/", dependencies=[Depends(conditional("members"))])
+
+Bump after the write has committed (not inside the transaction): a client
+that sees the new ETag must also see the new data, and a shared counter
+document inside every transaction would make concurrent writes conflict.
+"""
+import hashlib
+from fastapi import HTTPException, Request, Response, status
+from app.database import collection_versions_collection, current_branch
+
+def bump(*collections: str):
+    """Mark collections as changed"""
+    for name in collections:
+        collection_versions_collection.update_one(
+            {"_id": name},
+            {"$inc": {"version": 1}, "$currentDate": {"updated_at": True}},
+            upsert=True
+        )
+
+def versions(collections) -> dict:
+    return {
+        doc["_id"]: doc
+        for doc in collection_versions_collection.find({"_id": {"$in": list(collections)}})
+    }
+
+def etag_for(request: Request, collections) -> str:
+    current = versions(collections)
+    # updated_at changes the tag if the counters are ever reset
+    parts = [
+        f"{name}:{current[name]['version']}:{current[name]['updated_at'].timestamp()}" if name in current else f"{name}:0"
+        for name in collections
+    ]
+    # Same URL, different branch: different data
+    parts.append(f"{current_branch.get()}:{request.url.path}?{request.url.query}")
+    digest = hashlib.sha1("|".join(parts).encode()).hexdigest()[:24]
+    return f'W/"{digest}"'
+
+def _matches(if_none_match: str, etag: str) -> bool:
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags or etag[2:] in tags
+
+def conditional(*collections: str):
+    """Dependency answering 304 when none of the collections changed"""
+    async def check(request: Request, response: Response):
+        etag = etag_for(request, collections)
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and _matches(if_none_match, etag):
+            raise HTTPException(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+        response.headers["ETag"] = etag
+        # Cache, but revalidate on every use
+        response.headers["Cache-Control"] = "no-cache"
+    return check
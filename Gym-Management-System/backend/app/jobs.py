@@ -0,0 +1,197 @@
+"""Background job runner for heavy reports.
+
+Jobs live in the `jobs` collection, so they survive restarts and can be
+picked up by any worker:
+
+    {_id, report, params, status: queued|running|done|failed, progress,
+     result, error, owner, heartbeat_at, created_at, started_at,
+     finished_at, expires_at}
+
+Each worker process runs one JobRunner (started from the app lifespan). It
+polls for queued jobs, claims them atomically with find_one_and_update and
+runs them on a small thread pool, so at most `jobs_max_concurrent` heavy jobs
+run per worker and check-ins keep their event loop and connections. Running
+jobs are kept alive with a heartbeat; a job whose owner died (no heartbeat
+for `jobs_lease_seconds`) is claimed again by another runner. Finished jobs
+and their results are removed by TTL indexes on `expires_at`.
+"""
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Optional
+from bson import ObjectId
+from pymongo import ReturnDocument
+from app.config import settings
+from app.database import jobs_collection, job_results_collection, read_preference_scope, ANALYTICS_READS
+from app import reports
+from app.branches import branch_scope
+
+logger = logging.getLogger(__name__)
+
+def _run_yearly_revenue(params: dict, progress) -> dict:
+    return reports.yearly_revenue(int(params.get("year", datetime.now().year)), progress)
+
+def _run_attendance_summary(params: dict, progress) -> dict:
+    return reports.attendance_summary(params.get("start_date"), params.get("end_date"), progress)
+
+def _run_attendance_export(params: dict, progress, job_id: ObjectId, expires_at: datetime) -> dict:
+    # Rows are stored in job_results chunks (a job document is capped at 16MB)
+    rows = 0
+    for seq, batch in enumerate(reports.attendance_export(params.get("start_date"), params.get("end_date"), progress)):
+        job_results_collection.insert_one({
+            "job_id": job_id,
+            "seq": seq,
+            "rows": batch,
+            "expires_at": expires_at
+        })
+        rows += len(batch)
+    return {"rows": rows, "chunked": True}
+
+# Report name -> runner(params, progress)
+REPORTS = {
+    "yearly_revenue": _run_yearly_revenue,
+    "attendance_summary": _run_attendance_summary,
+    "attendance_export": _run_attendance_export
+}
+
+def create_job(report: str, params: dict) -> dict:
+    now = datetime.now()
+    job = {
+        "report": report,
+        "params": params,
+        "status": "queued",
+        "progress": 0,
+        "result": None,
+        "error": None,
+        "owner": None,
+        "heartbeat_at": None,
+        "created_at": now,
+        "started_at": None,
+        "finished_at": None,
+        # Queued jobs that never run are cleaned up as well
+        "expires_at": now + timedelta(seconds=settings.jobs_result_ttl_seconds)
+    }
+    jobs_collection.insert_one(job)
+    return job
+
+def get_job(job_id: ObjectId) -> Optional[dict]:
+    return jobs_collection.find_one({"_id": job_id})
+
+def job_result_rows(job_id: ObjectId):
+    """Stored rows of a chunked result, in order"""
+    for chunk in job_results_collection.find({"job_id": job_id}).sort("seq", 1):
+        yield from chunk["rows"]
+
+class JobRunner:
+    def __init__(self):
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.max_concurrent = settings.jobs_max_concurrent
+        self.executor = ThreadPoolExecutor(max_workers=self.max_concurrent, thread_name_prefix="report-job")
+        self.running = set()
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        # Unfinished jobs are reclaimed by another runner once the lease expires
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await loop.run_in_executor(None, self._heartbeat)
+                while len(self.running) < self.max_concurrent:
+                    job = await loop.run_in_executor(None, self._claim)
+                    if not job:
+                        break
+                    self.running.add(job["_id"])
+                    future = loop.run_in_executor(self.executor, self._run, job)
+                    future.add_done_callback(lambda _, job_id=job["_id"]: self.running.discard(job_id))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Job runner poll failed")
+            await asyncio.sleep(settings.jobs_poll_seconds)
+
+    def _heartbeat(self):
+        if self.running:
+            jobs_collection.update_many(
+                {"_id": {"$in": list(self.running)}, "owner": self.owner},
+                {"$set": {"heartbeat_at": datetime.now()}}
+            )
+
+    def _claim(self) -> Optional[dict]:
+        """Atomically take the oldest queued job, or a running job whose owner died"""
+        now = datetime.now()
+        stale = now - timedelta(seconds=settings.jobs_lease_seconds)
+        return jobs_collection.find_one_and_update(
+            {"$or": [
+                {"status": "queued"},
+                {"status": "running", "heartbeat_at": {"$lt": stale}}
+            ]},
+            {"$set": {
+                "status": "running",
+                "owner": self.owner,
+                "heartbeat_at": now,
+                "started_at": now,
+                "progress": 0
+            }},
+            sort=[("created_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    def _run(self, job: dict):
+        job_id = job["_id"]
+
+        def progress(fraction: float):
+            jobs_collection.update_one(
+                {"_id": job_id, "owner": self.owner},
+                {"$set": {"progress": round(fraction, 3), "heartbeat_at": datetime.now()}}
+            )
+
+        expires_at = datetime.now() + timedelta(seconds=settings.jobs_result_ttl_seconds)
+        # Reports cover the branch the job was queued from and read from
+        # secondaries like the analytics routes
+        with branch_scope(job.get("branch_id")), read_preference_scope(ANALYTICS_READS):
+            try:
+                runner = REPORTS[job["report"]]
+                if job["report"] == "attendance_export":
+                    # A reclaimed job starts over
+                    job_results_collection.delete_many({"job_id": job_id})
+                    result = runner(job["params"], progress, job_id, expires_at)
+                else:
+                    result = runner(job["params"], progress)
+                update = {"status": "done", "progress": 1, "result": result}
+            except Exception as e:
+                logger.exception("Job %s (%s) failed", job_id, job["report"])
+                update = {"status": "failed", "error": str(e)}
+
+            update.update({"finished_at": datetime.now(), "expires_at": expires_at})
+            jobs_collection.update_one({"_id": job_id, "owner": self.owner}, {"$set": update})
+
+# One runner per worker process, started by the lifespan
+runner: Optional[JobRunner] = None
+
+def start_runner():
+    global runner
+    if settings.jobs_enabled and runner is None:
+        runner = JobRunner()
+        runner.start()
+
+async def stop_runner():
+    global runner
+    if runner is not None:
+        await runner.stop()
+        runner = None
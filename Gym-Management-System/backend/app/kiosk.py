@@ -0,0 +1,321 @@
+"""Kiosk mode: front desk check-ins that keep working offline.
+
+A kiosk runs its own API instance with KIOSK_MODE=True. Member lookups,
+check-ins and check-outs (app/front_desk.py) are then served from a local
+SQLite database (KIOSK_DB_PATH) instead of the central MongoDB, so the desk
+keeps working while the link is down:
+
+- members: a snapshot of the branch's members, replaced every
+  KIOSK_SNAPSHOT_INTERVAL_SECONDS, along with the branch's open sessions
+  (so members checked in at another desk can check out here)
+- visits: sessions checked in or out at the kiosk; changes are pending
+  until they reach MongoDB
+
+Every KIOSK_SYNC_INTERVAL_SECONDS pending visits are written to MongoDB in
+batches of KIOSK_SYNC_BATCH_SIZE with the write-behind buffer's bulk writer,
+in the order they were scanned, so a member who came back twice during an
+outage has both visits written.
+Events already in the database are skipped, so a batch interrupted by the
+link dropping again is simply retried. Conflicts resolve in favour of the
+central database:
+
+- a check-in for a member who was checked in elsewhere meanwhile is
+  rejected by the open-session index; the local visit is kept with
+  conflict=1 for staff to review (kiosk_sync_conflicts_total,
+  `python -m scripts.kiosk_sync --conflicts`)
+- a check-out of a session already closed centrally (by another desk or
+  the stale session sweeper) is skipped, and the next snapshot drops the
+  local copy
+
+Every other route still talks to MongoDB directly.
+"""
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import List, Optional
+from bson import ObjectId, json_util
+from pymongo.errors import PyMongoError
+from app.config import settings
+from app import metrics
+from app.database import members_collection
+from app.branches import branch_scope
+from app.attendance_store import attendance_store, check_out_fields
+from app.attendance_buffer import JSON_OPTIONS, write_events
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS members (
+    _id TEXT PRIMARY KEY,
+    document TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS visits (
+    _id TEXT PRIMARY KEY,
+    member_id TEXT NOT NULL,
+    document TEXT NOT NULL,
+    join_date TEXT,
+    open INTEGER NOT NULL,
+    -- Local changes not in MongoDB yet, counted by version
+    pending INTEGER NOT NULL DEFAULT 0,
+    version INTEGER NOT NULL DEFAULT 0,
+    -- The check-in is in MongoDB
+    in_central INTEGER NOT NULL DEFAULT 0,
+    conflict INTEGER NOT NULL DEFAULT 0
+);
+-- One open session per member, like the central open-session index
+CREATE UNIQUE INDEX IF NOT EXISTS one_open_visit ON visits (member_id) WHERE open = 1 AND conflict = 0;
+CREATE INDEX IF NOT EXISTS pending_visits ON visits (pending) WHERE pending = 1;
+CREATE TABLE IF NOT EXISTS sync_state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+def _dumps(value) -> str:
+    return json_util.dumps(value, json_options=JSON_OPTIONS)
+
+def _loads(text: Optional[str]):
+    return json_util.loads(text, json_options=JSON_OPTIONS) if text is not None else None
+
+def kiosk_branch() -> str:
+    return settings.kiosk_branch or settings.default_branch
+
+class KioskStore:
+    """Front desk backed by the kiosk's SQLite database"""
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = None
+
+    def open(self):
+        if self.connection is not None:
+            return
+        # Shared by the request threads and the sync thread, behind self.lock
+        self.connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        # A scan is durable once it is acknowledged
+        self.connection.execute("PRAGMA synchronous=FULL")
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    @contextmanager
+    def _transaction(self):
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.connection
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+
+    def _one(self, sql: str, params: tuple):
+        with self.lock:
+            return self.connection.execute(sql, params).fetchone()
+
+    # ============ FRONT DESK ============
+
+    def get_member(self, obj_id: ObjectId) -> Optional[dict]:
+        row = self._one("SELECT document FROM members WHERE _id = ?", (str(obj_id),))
+        return _loads(row[0]) if row else None
+
+    def get_visit(self, obj_id: ObjectId) -> Optional[dict]:
+        row = self._one("SELECT document FROM visits WHERE _id = ?", (str(obj_id),))
+        return _loads(row[0]) if row else None
+
+    def check_in(self, visit: dict, join_date: Optional[datetime] = None) -> bool:
+        """Record a check-in; False if the member already has an open session"""
+        # The request's branch is the default one for anonymous scans; the
+        # kiosk only serves (and syncs into) its own
+        visit["branch_id"] = kiosk_branch()
+        try:
+            with self._transaction() as connection:
+                connection.execute(
+                    "INSERT INTO visits (_id, member_id, document, join_date, open, pending) VALUES (?, ?, ?, ?, 1, 1)",
+                    (str(visit["_id"]), visit["member_id"], _dumps(visit), _dumps(join_date))
+                )
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def check_out(self, obj_id: ObjectId, checkout_time: datetime) -> Optional[dict]:
+        """Close the session if it is still open, return the updated visit"""
+        with self._transaction() as connection:
+            row = connection.execute(
+                "SELECT document FROM visits WHERE _id = ? AND open = 1 AND conflict = 0", (str(obj_id),)
+            ).fetchone()
+            if not row:
+                return None
+            visit = {**_loads(row[0]), **check_out_fields(checkout_time)}
+            connection.execute(
+                "UPDATE visits SET document = ?, open = 0, pending = 1, version = version + 1 WHERE _id = ?",
+                (_dumps(visit), str(obj_id))
+            )
+        return visit
+
+    # ============ SYNC ============
+
+    def replace_snapshot(self, members: List[dict], open_visits: List[dict]):
+        """Replace the member snapshot and adopt the branch's open sessions"""
+        central_open = {str(visit["_id"]) for visit in open_visits}
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM members")
+            connection.executemany(
+                "INSERT INTO members (_id, document) VALUES (?, ?)",
+                [(str(member["_id"]), _dumps(member)) for member in members]
+            )
+            # Synced sessions closed centrally, and synced closed ones, aren't needed here
+            synced = connection.execute(
+                "SELECT _id, open FROM visits WHERE pending = 0 AND in_central = 1 AND conflict = 0"
+            ).fetchall()
+            connection.executemany(
+                "DELETE FROM visits WHERE _id = ? AND pending = 0",
+                [(visit_id,) for visit_id, is_open in synced if not is_open or visit_id not in central_open]
+            )
+            # Skipped if the member has a local session (it syncs or conflicts)
+            connection.executemany(
+                "INSERT OR IGNORE INTO visits (_id, member_id, document, open, in_central) VALUES (?, ?, ?, 1, 1)",
+                [(str(visit["_id"]), visit["member_id"], _dumps(visit)) for visit in open_visits]
+            )
+            connection.execute(
+                "INSERT OR REPLACE INTO sync_state (key, value) VALUES ('snapshot_at', ?)",
+                (datetime.now().isoformat(timespec="seconds"),)
+            )
+
+    def pending(self, limit: int) -> List[dict]:
+        # In scan order: a member's next visit comes after the previous one's check-out
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT document, join_date, version, in_central FROM visits WHERE pending = 1 ORDER BY rowid LIMIT ?",
+                (limit,)
+            ).fetchall()
+        return [
+            {"visit": _loads(document), "join_date": _loads(join_date), "version": version, "in_central": in_central}
+            for document, join_date, version, in_central in rows
+        ]
+
+    def mark_synced(self, rows: List[dict], rejected: set):
+        with self._transaction() as connection:
+            for row in rows:
+                visit_id = str(row["visit"]["_id"])
+                if row["visit"]["_id"] in rejected:
+                    connection.execute("UPDATE visits SET conflict = 1, pending = 0 WHERE _id = ?", (visit_id,))
+                    continue
+                # A check-out made during the sync stays pending
+                connection.execute(
+                    "UPDATE visits SET in_central = 1, pending = CASE WHEN version = ? THEN 0 ELSE 1 END WHERE _id = ?",
+                    (row["version"], visit_id)
+                )
+
+    def conflicts(self) -> List[dict]:
+        with self.lock:
+            rows = self.connection.execute("SELECT document FROM visits WHERE conflict = 1").fetchall()
+        return [_loads(document) for document, in rows]
+
+    def status(self) -> dict:
+        with self.lock:
+            count = lambda sql: self.connection.execute(sql).fetchone()[0]
+            snapshot = self.connection.execute("SELECT value FROM sync_state WHERE key = 'snapshot_at'").fetchone()
+            return {
+                "members": count("SELECT COUNT(*) FROM members"),
+                "open_sessions": count("SELECT COUNT(*) FROM visits WHERE open = 1 AND conflict = 0"),
+                "pending": count("SELECT COUNT(*) FROM visits WHERE pending = 1"),
+                "conflicts": count("SELECT COUNT(*) FROM visits WHERE conflict = 1"),
+                "snapshot_at": snapshot[0] if snapshot else None
+            }
+
+def refresh_snapshot(store: KioskStore) -> int:
+    """Copy the branch's members and open sessions to the kiosk"""
+    members = list(members_collection.find({}))
+    store.replace_snapshot(members, attendance_store.find({"check_out_time": None}))
+    return len(members)
+
+def push(store: KioskStore) -> dict:
+    """Write pending visits to MongoDB; returns how many synced and conflicted"""
+    synced = conflicts = 0
+    while True:
+        rows = store.pending(settings.kiosk_sync_batch_size)
+        if not rows:
+            break
+        events = []
+        for row in rows:
+            visit = row["visit"]
+            if not row["in_central"]:
+                # Written open, then closed, like a live scan
+                events.append({"type": "check_in", "visit": {**visit, "check_out_time": None}, "join_date": row["join_date"]})
+            if visit.get("check_out_time"):
+                events.append({"type": "check_out", "visit": visit})
+        rejected = write_events(attendance_store, events, verify=True)
+        store.mark_synced(rows, rejected)
+        synced += len(rows) - len(rejected)
+        conflicts += len(rejected)
+        if len(rows) < settings.kiosk_sync_batch_size:
+            break
+
+    if synced:
+        metrics.inc("kiosk_visits_synced_total", synced)
+    if conflicts:
+        logger.warning("Kiosk sync: %d check-ins conflicted with sessions opened elsewhere", conflicts)
+        metrics.inc("kiosk_sync_conflicts_total", conflicts)
+    return {"synced": synced, "conflicts": conflicts}
+
+def sync(store: KioskStore, snapshot: bool = True) -> dict:
+    """Push pending visits, then refresh the snapshot"""
+    with branch_scope(kiosk_branch()):
+        result = push(store)
+        if snapshot:
+            result["members"] = refresh_snapshot(store)
+    return result
+
+class KioskSync:
+    def __init__(self, store: KioskStore):
+        self.store = store
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="kiosk-sync", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+    def _run(self):
+        snapshot_at = None
+        while not self.stop_event.is_set():
+            due = snapshot_at is None or time.monotonic() - snapshot_at >= settings.kiosk_snapshot_interval_seconds
+            try:
+                sync(self.store, snapshot=due)
+                if due:
+                    snapshot_at = time.monotonic()
+            except PyMongoError as e:
+                # Offline: scans keep going to SQLite and sync once the link is back
+                logger.warning("Kiosk sync failed, retrying: %s", e)
+                metrics.inc("kiosk_sync_errors_total")
+            self.stop_event.wait(settings.kiosk_sync_interval_seconds)
+
+# One store per kiosk instance (run it with a single worker), opened by the lifespan
+kiosk_store = KioskStore(settings.kiosk_db_path)
+syncer: Optional[KioskSync] = None
+
+def start_sync():
+    global syncer
+    kiosk_store.open()
+    if syncer is None:
+        syncer = KioskSync(kiosk_store)
+        syncer.start()
+
+def stop_sync():
+    global syncer
+    if syncer is not None:
+        syncer.stop()
+        syncer = None
+    kiosk_store.close()
@@ -0,0 +1,78 @@
+"""Leases for background tasks that must run in one worker at a time.
+
+Every worker process starts the stale session sweeper and the archive
+scheduler, but only the worker holding the task's lease runs it. Leases live
+in the `leases` collection:
+
+    {_id: name, owner, heartbeat_at}
+
+A Lease keeps a heartbeat thread that renews it every third of
+SCHEDULER_LEASE_SECONDS; a lease whose owner died (no heartbeat for that
+long) is taken over by the next worker that tries. Leases are released on
+shutdown so another worker takes over right away.
+"""
+import logging
+import os
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta
+from pymongo.errors import DuplicateKeyError, PyMongoError
+from app.config import settings
+from app import metrics
+from app.database import leases_collection
+
+logger = logging.getLogger(__name__)
+
+class Lease:
+    def __init__(self, name: str):
+        self.name = name
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.held = False
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    @property
+    def renew_seconds(self) -> float:
+        return settings.scheduler_lease_seconds / 3
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name=f"lease-{self.name}", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+        self.release()
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            try:
+                self.held = self.renew()
+            except PyMongoError:
+                logger.exception("Renewing the %s lease failed", self.name)
+                metrics.inc("lease_errors_total", lease=self.name)
+                self.held = False
+            self.stop_event.wait(self.renew_seconds)
+
+    def renew(self) -> bool:
+        """Take or extend the lease; False if another worker holds it"""
+        now = datetime.now()
+        stale = now - timedelta(seconds=settings.scheduler_lease_seconds)
+        try:
+            leases_collection.find_one_and_update(
+                {"_id": self.name, "$or": [{"owner": self.owner}, {"heartbeat_at": {"$lt": stale}}]},
+                {"$set": {"owner": self.owner, "heartbeat_at": now}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            return False
+        return True
+
+    def release(self):
+        self.held = False
+        try:
+            leases_collection.delete_one({"_id": self.name, "owner": self.owner})
+        except PyMongoError:
+            # Expires on its own
+            logger.exception("Releasing the %s lease failed", self.name)
@@ -1,14 +1,69 @@
-from app.routes import member_routes, subscription_routes, attendance_routes, analytics_routes
+import time
+
+_import_started = time.perf_counter()
+
+from contextlib import asynccontextmanager
+import logging
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from pymongo.errors import PyMongoError
 from app.config import settings
-from app.routes import member_routes, subscription_routes, attendance_routes, analytics_routes, auth_routes
+from app import database, deadlines, jobs, metrics, change_streams, attendance_buffer, session_sweeper, archive, kiosk
+from app.branches import BranchMiddleware
+from app.profiling import ProfilingMiddleware
+from app.plan_catalog import plan_catalog
+from app.routes import member_routes, subscription_routes, attendance_routes, analytics_routes, auth_routes, job_routes, profile_routes
+
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:
+    BrotliMiddleware = None
+
+logger = logging.getLogger(__name__)
+
+# Time spent importing the app and its routers
+_import_ms = round((time.perf_counter() - _import_started) * 1000, 1)
+
+# Startup and graceful shutdown, run once per worker process
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if settings.kiosk_mode:
+        # Starts without the central database; the front desk runs on SQLite
+        database.connect()
+        kiosk.start_sync()
+        yield
+        kiosk.stop_sync()
+        database.close()
+        return
+    
+    timings = database.init_database()
+    plan_catalog.load()
+    timings["import_ms"] = _import_ms
+    timings["cold_start_ms"] = round((time.perf_counter() - _import_started) * 1000, 1)
+    app.state.startup_timings = timings
+    logger.info("Startup complete: %s", timings)
+    attendance_buffer.start_buffer()
+    session_sweeper.start_sweeper()
+    archive.start_scheduler()
+    jobs.start_runner()
+    change_streams.start_consumer()
+    yield
+    change_streams.stop_consumer()
+    await jobs.stop_runner()
+    session_sweeper.stop_sweeper()
+    archive.stop_scheduler()
+    # Writes the last buffered scans
+    attendance_buffer.stop_buffer()
+    database.close()
 
 # Create FastAPI app
 app = FastAPI(
     title=settings.app_name,
     description="Gym Management System API",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # CORS Middleware (for frontend connection later)
@@ -20,12 +75,41 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Scope every request to its branch (gym location)
+app.add_middleware(BranchMiddleware)
+
+# Per-request profiles for admins (X-Profile: 1) and sampled requests
+app.add_middleware(ProfilingMiddleware)
+
+# X-Read-Staleness on responses read from secondaries (analytics)
+app.add_middleware(database.ReadStalenessMiddleware)
+
+# Stop reads whose client went away (e.g. a closed analytics page)
+app.add_middleware(deadlines.CancelOnDisconnectMiddleware)
+
+# Compress large responses (list endpoints), negotiated via Accept-Encoding
+if BrotliMiddleware is not None:
+    # Falls back to gzip for clients without brotli support
+    app.add_middleware(
+        BrotliMiddleware,
+        quality=settings.compression_brotli_quality,
+        minimum_size=settings.compression_minimum_size
+    )
+else:
+    app.add_middleware(GZipMiddleware, minimum_size=settings.compression_minimum_size)
+
+# Query deadline overruns: 504 (503 if the database couldn't be reached)
+app.add_exception_handler(PyMongoError, deadlines.query_timeout_handler)
+app.add_exception_handler(database.RequestCancelled, deadlines.request_cancelled_handler)
+
 # Include routers
 app.include_router(auth_routes.router)
 app.include_router(member_routes.router)
 app.include_router(subscription_routes.router)
 app.include_router(attendance_routes.router)
 app.include_router(analytics_routes.router)
+app.include_router(job_routes.router)
+app.include_router(profile_routes.router)
 
 # Root endpoint
 @app.get("/")
@@ -39,4 +123,21 @@ async def root():
 # Health check endpoint
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy"}
\ No newline at end of file
+    return {"status": "healthy"}
+
+# Cold start report for this worker
+@app.get("/health/startup")
+async def startup_report():
+    return getattr(app.state, "startup_timings", {})
+
+# Local store and sync state of a kiosk
+@app.get("/health/kiosk")
+async def kiosk_report():
+    if not settings.kiosk_mode:
+        return {"kiosk_mode": False}
+    return {"kiosk_mode": True, **kiosk.kiosk_store.status()}
+
+# Counters for this worker (rate limiter, bulkheads)
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return metrics.render()
\ No newline at end of file
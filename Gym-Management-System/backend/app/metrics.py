@@ -0,0 +1,54 @@
+"""In-process counters and gauges, exported at /metrics.
+
+Values are kept per worker process and rendered in the Prometheus text
+format, so a scraper (or a quick curl) can read them without extra
+dependencies:
+
+    metrics.inc("rate_limit_rejected_total", limiter="login_ip")
+    metrics.set_gauge("bulkhead_in_flight", 3, route="/analytics/dashboard")
+"""
+import threading
+from collections import defaultdict
+
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_gauges = {}
+
+def _key(name: str, labels: dict) -> tuple:
+    return (name, tuple(sorted(labels.items())))
+
+def inc(name: str, value: float = 1, **labels):
+    with _lock:
+        _counters[_key(name, labels)] += value
+
+def set_gauge(name: str, value: float, **labels):
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+def snapshot() -> dict:
+    """Current values as {"name{label=...}": value}"""
+    with _lock:
+        items = list(_counters.items()) + list(_gauges.items())
+    return {_format(name, labels): value for (name, labels), value in sorted(items)}
+
+def _format(name: str, labels: tuple) -> str:
+    if not labels:
+        return name
+    rendered = ",".join(f'{k}="{v}"' for k, v in labels)
+    return f"{name}{{{rendered}}}"
+
+def render() -> str:
+    """Prometheus text exposition of every metric"""
+    lines = []
+    with _lock:
+        counters = sorted(_counters.items())
+        gauges = sorted(_gauges.items())
+
+    seen = set()
+    for kind, items in (("counter", counters), ("gauge", gauges)):
+        for (name, labels), value in items:
+            if name not in seen:
+                lines.append(f"# TYPE {name} {kind}")
+                seen.add(name)
+            lines.append(f"{_format(name, labels)} {value:g}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,85 @@
+"""Gym occupancy from attendance intervals.
+
+Each visit is an interval [check_in_time, check_out_time). Occupancy per
+minute is computed with a sweep line over a difference array: +1 at each
+check-in minute, -1 at each check-out minute, then a running sum. The
+database groups visits into per-minute check-in and check-out counts (one
+aggregation each, returned as one small row per minute), so Python
+only touches O(distinct minutes) events and the running sum, which keeps a
+full year (525,600 minutes) in the millisecond range.
+"""
+from datetime import datetime, timedelta
+from itertools import accumulate
+from typing import List
+from app.attendance_store import attendance_store
+from app import archive
+
+# Sessions longer than this are not looked up before the range start
+MAX_SESSION = timedelta(hours=24)
+
+def minute_events(start: datetime, end: datetime) -> dict:
+    """Check-ins and check-outs per minute offset from `start` for visits
+    overlapping [start, end). Open sessions end now."""
+    lookback = start - MAX_SESSION
+    archived = archive.reaches("attendance", lookback)
+    # The same "now" for both passes
+    now = datetime.now()
+
+    def per_minute(field, rounding) -> list:
+        # One $group per side rather than a $facet: a $facet result is a
+        # single document, which a year of busy minutes would push past 16MB
+        rows = attendance_store.aggregate([
+            {"$match": {"check_in_time": {"$gte": lookback, "$lt": end}}},
+            {"$group": {
+                "_id": {rounding: {"$divide": [{"$subtract": [field, start]}, 60000]}},
+                "count": {"$sum": 1}
+            }}
+        ], archived=archived)
+        return [(int(row["_id"]), row["count"]) for row in rows]
+
+    return {
+        "check_ins": per_minute("$check_in_time", "$floor"),
+        "check_outs": per_minute({"$ifNull": ["$check_out_time", now]}, "$ceil")
+    }
+
+def occupancy_series(events: dict, start: datetime, end: datetime) -> List[int]:
+    """People in the gym for every minute in [start, end)"""
+    total = int((end - start).total_seconds() // 60)
+    diff = [0] * (total + 1)
+    # Clamp to the range: earlier events land on minute 0, later ones are dropped
+    for minute, count in events["check_ins"]:
+        diff[min(max(minute, 0), total)] += count
+    for minute, count in events["check_outs"]:
+        diff[min(max(minute, 0), total)] -= count
+    return list(accumulate(diff[:total]))
+
+def downsample(series: List[int], resolution: int) -> List[int]:
+    """Peak occupancy per `resolution`-minute bucket"""
+    if resolution == 1:
+        return series
+    return [max(series[i:i + resolution]) for i in range(0, len(series), resolution)]
+
+def weekly_heatmap(series: List[int], start: datetime) -> dict:
+    """Average and peak occupancy per day of week (Monday = 0) and hour.
+
+    `start` must be at midnight so that minute 0 is hour 0.
+    """
+    totals = [[0] * 24 for _ in range(7)]
+    peaks = [[0] * 24 for _ in range(7)]
+    hours_seen = [[0] * 24 for _ in range(7)]
+
+    first_weekday = start.weekday()
+    for hour_index in range(len(series) // 60):
+        minutes = series[hour_index * 60:(hour_index + 1) * 60]
+        day = (first_weekday + hour_index // 24) % 7
+        hour = hour_index % 24
+        totals[day][hour] += sum(minutes)
+        peaks[day][hour] = max(peaks[day][hour], max(minutes))
+        hours_seen[day][hour] += 1
+
+    average = [
+        [round(totals[day][hour] / (hours_seen[day][hour] * 60), 2) if hours_seen[day][hour] else 0
+         for hour in range(24)]
+        for day in range(7)
+    ]
+    return {"average": average, "peak": peaks}
@@ -0,0 +1,94 @@
+"""In-memory subscription plan catalog.
+
+Plans are read on every page load and every subscription create, renew and
+expiring-soon row, but there are only a handful and they rarely change. Each
+worker keeps all plans (every branch) in memory and serves lookups from it:
+
+    plan = plan_catalog.get_plan(plan_id)      # current branch only
+    plans = plan_catalog.all_plans()
+
+Plan writes go through refresh(), which bumps the `subscription_plans`
+version stamp in collection_versions and reloads this worker. Other workers
+compare their stamp at most every PLAN_CATALOG_CHECK_SECONDS, or reload as
+soon as the change stream delivers the write when CHANGE_STREAMS_ENABLED. A
+full reload every PLAN_CATALOG_TTL_SECONDS also catches writes made outside
+the API without change streams.
+"""
+import threading
+import time
+from typing import List, Optional
+from app.config import settings
+from app import change_streams, http_cache, metrics
+from app.database import plans_collection, collection_versions_collection, current_branch
+from app.branches import all_branches
+
+VERSION_KEY = "subscription_plans"
+
+class PlanCatalog:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # {plan_id: plan}, replaced as a whole on reload
+        self.plans = None
+        self.version = None
+        self.loaded_at = 0.0
+        self.checked_at = 0.0
+
+    def _stamp(self):
+        stamp = collection_versions_collection.find_one({"_id": VERSION_KEY})
+        return (stamp["version"], stamp["updated_at"]) if stamp else None
+
+    def load(self):
+        """Reload every branch's plans"""
+        with self.lock:
+            # Stamp first: a write racing the load leaves us one version behind
+            version = self._stamp()
+            with all_branches():
+                plans = {str(plan["_id"]): plan for plan in plans_collection.find().sort("price", 1)}
+            self.plans = plans
+            self.version = version
+            self.loaded_at = self.checked_at = time.monotonic()
+        metrics.inc("plan_catalog_loads_total")
+
+    def invalidate(self):
+        self.plans = None
+
+    def refresh(self):
+        """Call after writing plans: stamp a new version and reload"""
+        http_cache.bump(VERSION_KEY)
+        self.load()
+
+    def _current(self) -> dict:
+        now = time.monotonic()
+        if self.plans is None or now - self.loaded_at >= settings.plan_catalog_ttl_seconds:
+            self.load()
+        elif now - self.checked_at >= settings.plan_catalog_check_seconds:
+            self.checked_at = now
+            if self._stamp() != self.version:
+                self.load()
+        return self.plans
+
+    def get_plan(self, plan_id: str) -> Optional[dict]:
+        """Plan of the current branch (any branch outside a request), or None"""
+        plan = self._current().get(plan_id)
+        if plan is None:
+            return None
+        branch = current_branch.get()
+        if branch is not None and plan.get("branch_id") != branch:
+            return None
+        return dict(plan)
+
+    def all_plans(self) -> List[dict]:
+        """Plans of the current branch, cheapest first"""
+        branch = current_branch.get()
+        return [
+            dict(plan) for plan in self._current().values()
+            if branch is None or plan.get("branch_id") == branch
+        ]
+
+    def plan_names(self) -> dict:
+        return {str(plan["_id"]): plan["plan_name"] for plan in self.all_plans()}
+
+plan_catalog = PlanCatalog()
+
+# Writes from other workers or scripts, as soon as they happen
+change_streams.subscribe(VERSION_KEY, lambda changes: plan_catalog.invalidate())
@@ -0,0 +1,159 @@
+"""Per-request profiling.
+
+With PROFILING_ENABLED=True (off by default) a request is profiled when an
+admin asks for it (`X-Profile: 1` header or `?profile=1`, with an admin
+bearer token); independently, requests can be picked by
+PROFILING_SAMPLE_RATE. The response carries `X-Profile-Id` and the profile
+is written to PROFILING_DIR, newest PROFILING_KEEP kept:
+
+- with pyinstrument installed: speedscope JSON (open in speedscope.app)
+- otherwise: collapsed stacks from a built-in sampler of the event loop
+  thread (speedscope, flamegraph.pl), covering any request running
+  concurrently on the same worker as well
+
+When neither trigger is configured the middleware is a single attribute
+check per request.
+"""
+import os
+import random
+import re
+import sys
+import threading
+from collections import Counter
+from datetime import datetime
+from typing import List, Optional
+from starlette.datastructures import Headers
+from app.config import settings
+from app.auth import token_claims
+
+try:
+    from pyinstrument import Profiler
+    from pyinstrument.renderers import SpeedscopeRenderer
+except ImportError:
+    Profiler = None
+
+PROFILE_HEADER = "x-profile"
+PROFILE_NAME = re.compile(r"^[\w.-]+\.(speedscope\.json|collapsed)$")
+
+class StackSampler:
+    """Samples one thread's stack and counts collapsed stacks"""
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+def _requested(scope) -> bool:
+    headers = Headers(scope=scope)
+    asked = headers.get(PROFILE_HEADER) == "1" or b"profile=1" in scope.get("query_string", b"")
+    if not asked:
+        return False
+    claims = token_claims(headers.get("authorization"))
+    return bool(claims) and claims.get("role") == "admin"
+
+def _profile_name(scope, extension: str) -> str:
+    slug = re.sub(r"[^\w]+", "-", scope["path"]).strip("-") or "root"
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    return f"{stamp}-{scope['method']}-{slug[:80]}.{extension}"
+
+def _save(name: str, content: str):
+    os.makedirs(settings.profiling_dir, exist_ok=True)
+    with open(os.path.join(settings.profiling_dir, name), "w") as f:
+        f.write(content)
+
+    # Keep the newest profiles only
+    for old in list_profiles()[settings.profiling_keep:]:
+        os.remove(os.path.join(settings.profiling_dir, old["name"]))
+
+def list_profiles() -> List[dict]:
+    """Stored profiles, newest first"""
+    if not os.path.isdir(settings.profiling_dir):
+        return []
+    profiles = []
+    for name in os.listdir(settings.profiling_dir):
+        if not PROFILE_NAME.match(name):
+            continue
+        stat = os.stat(os.path.join(settings.profiling_dir, name))
+        profiles.append({
+            "name": name,
+            "size_bytes": stat.st_size,
+            "created_at": datetime.fromtimestamp(stat.st_mtime)
+        })
+    profiles.sort(key=lambda p: p["name"], reverse=True)
+    return profiles
+
+def profile_path(name: str) -> Optional[str]:
+    """Path of a stored profile, None for unknown (or unsafe) names"""
+    if not PROFILE_NAME.match(name):
+        return None
+    path = os.path.join(settings.profiling_dir, name)
+    return path if os.path.isfile(path) else None
+
+class ProfilingMiddleware:
+    def __init__(self, app):
+        self.app = app
+        self.active = settings.profiling_enabled or settings.profiling_sample_rate > 0
+
+    async def __call__(self, scope, receive, send):
+        if not self.active or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        sampled = settings.profiling_sample_rate > 0 and random.random() < settings.profiling_sample_rate
+        if not sampled and not (settings.profiling_enabled and _requested(scope)):
+            await self.app(scope, receive, send)
+            return
+
+        await self._profile(scope, receive, send)
+
+    async def _profile(self, scope, receive, send):
+        # Named up front so the response can point at it
+        name = _profile_name(scope, "speedscope.json" if Profiler else "collapsed")
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"x-profile-id", name.encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        if Profiler:
+            profiler = Profiler(interval=settings.profiling_interval_ms / 1000, async_mode="enabled")
+            profiler.start()
+            try:
+                await self.app(scope, receive, send_with_id)
+            finally:
+                profiler.stop()
+                content = profiler.output(SpeedscopeRenderer())
+        else:
+            sampler = StackSampler(threading.get_ident(), settings.profiling_interval_ms / 1000)
+            sampler.start()
+            try:
+                await self.app(scope, receive, send_with_id)
+            finally:
+                sampler.stop()
+                content = sampler.collapsed()
+
+        _save(name, content)
@@ -0,0 +1,245 @@
+"""Rate limiting and admission control.
+
+- RateLimit: token bucket per key (client IP, token subject or login
+  account). `rate_per_minute` tokens are refilled continuously up to `burst`;
+  a request that finds the bucket empty gets 429 with Retry-After.
+- Bulkhead: caps concurrent requests per route (analytics aggregations), so
+  a burst of slow reports can't take every worker and pooled connection.
+
+State lives in this process by default. Set RATE_LIMIT_REDIS_URL to share it
+between workers (and instances) through Redis; the `redis` package is only
+needed in that case.
+"""
+import logging
+import math
+import threading
+import time
+from typing import Callable, Optional, Tuple
+from fastapi import HTTPException, Request, status
+from app.config import settings
+from app.auth import token_claims
+from app import metrics
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+# ============ BACKENDS ============
+
+class MemoryBackend:
+    """Buckets and in-flight counters for this process"""
+    max_keys = 100_000
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.in_flight = {}
+
+    def take(self, key: str, rate: float, burst: int, cost: int = 1) -> Tuple[bool, float]:
+        """Take `cost` tokens (0 only checks). Returns (allowed, seconds until a token is available)"""
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                self.buckets[key] = (tokens - cost, now)
+                allowed, retry_after = True, 0.0
+            else:
+                self.buckets[key] = (tokens, now)
+                allowed, retry_after = False, (1 - tokens) / rate
+            if len(self.buckets) > self.max_keys:
+                self._prune(now, rate, burst)
+        return allowed, retry_after
+
+    def _prune(self, now: float, rate: float, burst: int):
+        # Buckets idle long enough to be full again carry no state
+        idle = burst / rate
+        self.buckets = {k: v for k, v in self.buckets.items() if now - v[1] < idle}
+
+    def acquire(self, key: str, limit: int) -> Optional[int]:
+        """Reserve a slot; returns the new in-flight count, or None when full"""
+        with self.lock:
+            current = self.in_flight.get(key, 0)
+            if current >= limit:
+                return None
+            self.in_flight[key] = current + 1
+            return current + 1
+
+    def release(self, key: str) -> int:
+        with self.lock:
+            current = max(self.in_flight.get(key, 0) - 1, 0)
+            self.in_flight[key] = current
+            return current
+
+# Refill, take and store the bucket in one round trip
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(now - ts, 0) * rate)
+local allowed = 0
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - cost
+    allowed = 1
+else
+    retry_after = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return {allowed, tostring(retry_after)}
+"""
+
+class RedisBackend:
+    """Buckets and in-flight counters shared through Redis"""
+    # Safety net for slots never released (worker killed mid-request)
+    slot_ttl_seconds = 300
+
+    def __init__(self, url: str):
+        self.client = redis.Redis.from_url(url)
+        self.token_bucket = self.client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def take(self, key: str, rate: float, burst: int, cost: int = 1) -> Tuple[bool, float]:
+        allowed, retry_after = self.token_bucket(keys=[f"rl:{key}"], args=[rate, burst, time.time(), cost])
+        return bool(allowed), float(retry_after)
+
+    def acquire(self, key: str, limit: int) -> Optional[int]:
+        pipe = self.client.pipeline()
+        pipe.incr(f"bh:{key}")
+        pipe.expire(f"bh:{key}", self.slot_ttl_seconds)
+        current = pipe.execute()[0]
+        if current > limit:
+            self.client.decr(f"bh:{key}")
+            return None
+        return current
+
+    def release(self, key: str) -> int:
+        return max(self.client.decr(f"bh:{key}"), 0)
+
+def create_backend():
+    if settings.rate_limit_redis_url:
+        if redis is None:
+            logger.warning("RATE_LIMIT_REDIS_URL is set but redis is not installed; limits are per process")
+        else:
+            return RedisBackend(settings.rate_limit_redis_url)
+    return MemoryBackend()
+
+backend = create_backend()
+
+# ============ KEYS ============
+
+def client_ip(request: Request) -> str:
+    if settings.rate_limit_trust_forwarded:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+def token_subject(request: Request) -> Optional[str]:
+    """Subject of the bearer token, if any (no database lookup)"""
+    claims = token_claims(request.headers.get("authorization"))
+    return claims.get("sub") if claims else None
+
+def user_or_ip(request: Request) -> str:
+    subject = token_subject(request)
+    return f"user:{subject}" if subject else f"ip:{client_ip(request)}"
+
+# ============ LIMITERS ============
+
+class RateLimit:
+    """Token bucket limiter, usable as a dependency or called with an explicit key"""
+    def __init__(self, name: str, rate_per_minute: int, burst: int,
+                 key: Callable[[Request], str] = client_ip):
+        self.name = name
+        self.rate = rate_per_minute / 60
+        self.burst = burst
+        self.key = key
+
+    def hit(self, key: str):
+        """Take a token for key or raise 429"""
+        if not settings.rate_limit_enabled:
+            return
+        allowed, retry_after = backend.take(f"{self.name}:{key}", self.rate, self.burst)
+        if allowed:
+            metrics.inc("rate_limit_allowed_total", limiter=self.name)
+            return
+        self._reject(retry_after)
+
+    def check(self, key: str):
+        """Raise 429 if key has no token left, without taking one"""
+        if not settings.rate_limit_enabled:
+            return
+        allowed, retry_after = backend.take(f"{self.name}:{key}", self.rate, self.burst, cost=0)
+        if not allowed:
+            self._reject(retry_after)
+
+    def _reject(self, retry_after: float):
+        metrics.inc("rate_limit_rejected_total", limiter=self.name)
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many requests. Please try again later.",
+            headers={"Retry-After": str(max(math.ceil(retry_after), 1))}
+        )
+
+    async def __call__(self, request: Request):
+        self.hit(self.key(request))
+
+class Bulkhead:
+    """Caps concurrent requests per route"""
+    def __init__(self, name: str, max_concurrent: int, retry_after: int = 1):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.retry_after = retry_after
+
+    async def __call__(self, request: Request):
+        if not settings.rate_limit_enabled:
+            yield
+            return
+
+        route = request.scope.get("route")
+        path = route.path if route else request.url.path
+        key = f"{self.name}:{path}"
+
+        in_flight = backend.acquire(key, self.max_concurrent)
+        if in_flight is None:
+            metrics.inc("bulkhead_rejected_total", route=path)
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many concurrent report requests. Please try again shortly.",
+                headers={"Retry-After": str(self.retry_after)}
+            )
+        metrics.set_gauge("bulkhead_in_flight", in_flight, route=path)
+        try:
+            yield
+        finally:
+            metrics.set_gauge("bulkhead_in_flight", backend.release(key), route=path)
+
+# Login runs Argon2 verification: limit per client, and failed attempts per
+# account (checked before verifying, charged only when it fails, so a
+# user's own successful logins never lock them out)
+login_ip_limit = RateLimit(
+    "login_ip",
+    settings.rate_limit_login_per_minute,
+    settings.rate_limit_login_burst
+)
+login_account_limit = RateLimit(
+    "login_account",
+    settings.rate_limit_login_account_per_minute,
+    settings.rate_limit_login_burst
+)
+
+# Analytics runs full-collection aggregations
+analytics_limit = RateLimit(
+    "analytics",
+    settings.rate_limit_analytics_per_minute,
+    settings.rate_limit_analytics_burst,
+    key=user_or_ip
+)
+analytics_bulkhead = Bulkhead("analytics", settings.analytics_max_concurrent)
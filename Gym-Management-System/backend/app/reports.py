@@ -0,0 +1,117 @@
+"""Heavy reports shared by the analytics routes and the background job runner.
+
+Each report is a plain (blocking) function taking its parameters and an
+optional `progress(fraction)` callback, so it can run inline in a request or
+off the request path as a job (see app/jobs.py).
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Callable, Iterator, Optional
+from app import archive
+
+def _noop(fraction: float):
+    pass
+
+def date_range_query(start_date: Optional[str], end_date: Optional[str]) -> dict:
+    """Filter on the attendance `date` string, last 30 days by default"""
+    if start_date and end_date:
+        return {"date": {"$gte": start_date, "$lte": end_date}}
+    if start_date:
+        return {"date": {"$gte": start_date}}
+    if end_date:
+        return {"date": {"$lte": end_date}}
+
+    # Default to last 30 days
+    thirty_days_ago = (datetime.now() - timedelta(days=30)).strftime("%Y-%m-%d")
+    return {"date": {"$gte": thirty_days_ago}}
+
+def yearly_revenue(year: int, progress: Callable[[float], None] = _noop) -> dict:
+    """Revenue breakdown by month for a year"""
+    monthly_data = []
+
+    for month in range(1, 13):
+        start_date = datetime(year, month, 1)
+        if month == 12:
+            end_date = datetime(year + 1, 1, 1)
+        else:
+            end_date = datetime(year, month + 1, 1)
+
+        subscriptions = archive.find_subscriptions(
+            {"payment_date": {"$gte": start_date, "$lt": end_date}},
+            start=start_date,
+            projection={"payment_amount": 1}
+        )
+
+        revenue = sum(sub["payment_amount"] for sub in subscriptions)
+
+        monthly_data.append({
+            "month": month,
+            "month_name": start_date.strftime("%B"),
+            "revenue": round(revenue, 2),
+            "subscriptions": len(subscriptions)
+        })
+        progress(month / 12)
+
+    total_yearly_revenue = sum(m["revenue"] for m in monthly_data)
+
+    return {
+        "year": year,
+        "total_revenue": round(total_yearly_revenue, 2),
+        "monthly_breakdown": monthly_data
+    }
+
+def attendance_summary(start_date: Optional[str] = None, end_date: Optional[str] = None,
+                       progress: Callable[[float], None] = _noop) -> dict:
+    """Attendance totals and daily breakdown for a date range"""
+    query = date_range_query(start_date, end_date)
+    attendance_records = archive.find_attendance(
+        query,
+        start=query["date"].get("$gte"),
+        projection={"member_id": 1, "date": 1}
+    )
+    progress(0.5)
+
+    total_attendance = len(attendance_records)
+    unique_members = len(set(record["member_id"] for record in attendance_records))
+
+    # Group by date
+    daily_attendance = defaultdict(int)
+    for record in attendance_records:
+        daily_attendance[record["date"]] += 1
+
+    average_daily = sum(daily_attendance.values()) / len(daily_attendance) if daily_attendance else 0
+    progress(1)
+
+    return {
+        "total_attendance": total_attendance,
+        "unique_members": unique_members,
+        "average_daily_attendance": round(average_daily, 2),
+        "daily_breakdown": dict(sorted(daily_attendance.items()))
+    }
+
+def attendance_export(start_date: Optional[str] = None, end_date: Optional[str] = None,
+                      progress: Callable[[float], None] = _noop,
+                      batch_size: int = 5000) -> Iterator[list]:
+    """Attendance rows for a date range, yielded in batches"""
+    query = date_range_query(start_date, end_date)
+    records = archive.find_attendance(query, start=query["date"].get("$gte"), sort=[("check_in_time", 1)])
+    total = len(records) or 1
+
+    batch = []
+    exported = 0
+    for record in records:
+        batch.append({
+            "attendance_id": str(record["_id"]),
+            "member_id": record["member_id"],
+            "date": record["date"],
+            "check_in_time": record["check_in_time"],
+            "check_out_time": record.get("check_out_time")
+        })
+        if len(batch) == batch_size:
+            exported += len(batch)
+            yield batch
+            batch = []
+            progress(exported / total)
+    if batch:
+        yield batch
+    progress(1)
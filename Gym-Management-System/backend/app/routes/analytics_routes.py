@@ -1,21 +1,45 @@
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, HTTPException, Query, Depends
+from fastapi.concurrency import run_in_threadpool
 from app.database import (
     members_collection, 
-    member_subscriptions_collection, 
-    attendance_collection,
-    plans_collection
+    member_subscriptions_collection,
+    use_read_preference,
+    ANALYTICS_READS
 )
+from app.plan_catalog import plan_catalog
+from app.attendance_store import attendance_store
+from app.attendance_stats import get_member_stats, average_per_week, current_month_visits
+from app import archive, cohorts, occupancy, reports
 from bson import ObjectId
 from typing import List, Optional
 from datetime import datetime, timedelta
 from collections import defaultdict
+from app.utils import check_member_exists
+from app.rate_limit import analytics_limit, analytics_bulkhead
+from app.deadlines import query_deadline
+from app.auth import get_current_admin
+from app.branches import all_branches
+from app.config import settings
 
-router = APIRouter(prefix="/analytics", tags=["Analytics & Reports"])
+router = APIRouter(
+    prefix="/analytics",
+    tags=["Analytics & Reports"],
+    # Reads go to secondaries (settings.analytics_read_preference)
+    dependencies=[
+        Depends(analytics_limit),
+        Depends(analytics_bulkhead),
+        Depends(use_read_preference(ANALYTICS_READS)),
+        Depends(query_deadline(settings.analytics_query_timeout_seconds))
+    ]
+)
+
+# Handlers are plain functions (or hand their work to the threadpool), so the
+# event loop stays free to notice a client leaving and cancel the request.
 
 # ============ DASHBOARD STATS ============
 
 @router.get("/dashboard")
-async def get_dashboard_stats():
+def get_dashboard_stats():
     """Get overall dashboard statistics"""
     
     # Member stats
@@ -24,38 +48,39 @@ async def get_dashboard_stats():
     inactive_members = members_collection.count_documents({"status": "inactive"})
     expired_members = members_collection.count_documents({"status": "expired"})
     
-    # Revenue stats
+    # Revenue stats (archived subscriptions are kept as totals)
+    archived = archive.archived_revenue()
     all_subscriptions = list(member_subscriptions_collection.find({}))
-    total_revenue = sum(sub["payment_amount"] for sub in all_subscriptions)
-    total_subscriptions = len(all_subscriptions)
+    total_revenue = sum(sub["payment_amount"] for sub in all_subscriptions) + archived["revenue"]
+    total_subscriptions = len(all_subscriptions) + archived["subscriptions"]
     active_subscriptions = member_subscriptions_collection.count_documents({"status": "active"})
     
     # Current month revenue
     now = datetime.now()
     month_start = datetime(now.year, now.month, 1)
-    monthly_subscriptions = list(member_subscriptions_collection.find({
+    monthly_subscriptions = archive.find_subscriptions({
         "payment_date": {"$gte": month_start}
-    }))
+    }, start=month_start)
     monthly_revenue = sum(sub["payment_amount"] for sub in monthly_subscriptions)
     
     # Current year revenue
     year_start = datetime(now.year, 1, 1)
-    yearly_subscriptions = list(member_subscriptions_collection.find({
+    yearly_subscriptions = archive.find_subscriptions({
         "payment_date": {"$gte": year_start}
-    }))
+    }, start=year_start)
     yearly_revenue = sum(sub["payment_amount"] for sub in yearly_subscriptions)
     
     # Attendance stats
     today = datetime.now().strftime("%Y-%m-%d")
-    today_attendance = attendance_collection.count_documents({"date": today})
-    currently_in_gym = attendance_collection.count_documents({
+    today_attendance = attendance_store.count({"date": today})
+    currently_in_gym = attendance_store.count({
         "date": today,
         "check_out_time": None
     })
     
     # This week attendance
     week_ago = (datetime.now() - timedelta(days=7)).strftime("%Y-%m-%d")
-    week_attendance = attendance_collection.count_documents({
+    week_attendance = attendance_store.count({
         "date": {"$gte": week_ago}
     })
     
@@ -83,7 +108,7 @@ async def get_dashboard_stats():
 # ============ REVENUE REPORTS ============
 
 @router.get("/revenue/monthly")
-async def get_monthly_revenue(year: int = Query(datetime.now().year), month: int = Query(datetime.now().month)):
+def get_monthly_revenue(year: int = Query(datetime.now().year), month: int = Query(datetime.now().month)):
     """Get revenue for a specific month"""
     
     if month < 1 or month > 12:
@@ -97,9 +122,9 @@ async def get_monthly_revenue(year: int = Query(datetime.now().year), month: int
         end_date = datetime(year, month + 1, 1)
     
     # Get subscriptions in this month
-    subscriptions = list(member_subscriptions_collection.find({
+    subscriptions = archive.find_subscriptions({
         "payment_date": {"$gte": start_date, "$lt": end_date}
-    }))
+    }, start=start_date)
     
     total_revenue = sum(sub["payment_amount"] for sub in subscriptions)
     total_subscriptions = len(subscriptions)
@@ -121,54 +146,27 @@ async def get_monthly_revenue(year: int = Query(datetime.now().year), month: int
 @router.get("/revenue/yearly")
 async def get_yearly_revenue(year: int = Query(datetime.now().year)):
     """Get revenue breakdown by month for a year"""
-    
-    monthly_data = []
-    
-    for month in range(1, 13):
-        start_date = datetime(year, month, 1)
-        if month == 12:
-            end_date = datetime(year + 1, 1, 1)
-        else:
-            end_date = datetime(year, month + 1, 1)
-        
-        subscriptions = list(member_subscriptions_collection.find({
-            "payment_date": {"$gte": start_date, "$lt": end_date}
-        }))
-        
-        revenue = sum(sub["payment_amount"] for sub in subscriptions)
-        
-        monthly_data.append({
-            "month": month,
-            "month_name": start_date.strftime("%B"),
-            "revenue": round(revenue, 2),
-            "subscriptions": len(subscriptions)
-        })
-    
-    total_yearly_revenue = sum(m["revenue"] for m in monthly_data)
-    
-    return {
-        "year": year,
-        "total_revenue": round(total_yearly_revenue, 2),
-        "monthly_breakdown": monthly_data
-    }
+    # Off the event loop, so it can be cancelled if the client leaves
+    return await run_in_threadpool(reports.yearly_revenue, year)
 
 @router.get("/revenue/by-plan")
-async def get_revenue_by_plan():
+def get_revenue_by_plan():
     """Get revenue breakdown by subscription plans"""
     
-    plans = list(plans_collection.find({}))
+    plans = plan_catalog.all_plans()
+    archived = archive.archived_revenue()["by_plan"]
     plan_revenue = []
     
     for plan in plans:
         plan_id = str(plan["_id"])
         subscriptions = list(member_subscriptions_collection.find({"plan_id": plan_id}))
         
-        revenue = sum(sub["payment_amount"] for sub in subscriptions)
+        revenue = sum(sub["payment_amount"] for sub in subscriptions) + archived[plan_id]["revenue"]
         
         plan_revenue.append({
             "plan_id": plan_id,
             "plan_name": plan["plan_name"],
-            "total_subscriptions": len(subscriptions),
+            "total_subscriptions": len(subscriptions) + archived[plan_id]["subscriptions"],
             "total_revenue": round(revenue, 2),
             "plan_price": plan["price"]
         })
@@ -186,93 +184,93 @@ async def get_attendance_summary(
     end_date: Optional[str] = None
 ):
     """Get attendance summary for a date range"""
+    return await run_in_threadpool(reports.attendance_summary, start_date, end_date)
+
+@router.get("/attendance/member/{member_id}")
+def get_member_attendance_stats(member_id: str):
+    """Get attendance statistics for a specific member"""
     
-    query = {}
-    
-    if start_date and end_date:
-        query["date"] = {"$gte": start_date, "$lte": end_date}
-    elif start_date:
-        query["date"] = {"$gte": start_date}
-    elif end_date:
-        query["date"] = {"$lte": end_date}
-    else:
-        # Default to last 30 days
-        thirty_days_ago = (datetime.now() - timedelta(days=30)).strftime("%Y-%m-%d")
-        query["date"] = {"$gte": thirty_days_ago}
-    
-    attendance_records = list(attendance_collection.find(query))
-    
-    total_attendance = len(attendance_records)
-    unique_members = len(set(record["member_id"] for record in attendance_records))
-    
-    # Group by date
-    daily_attendance = defaultdict(int)
-    for record in attendance_records:
-        daily_attendance[record["date"]] += 1
+    member = check_member_exists(member_id)
     
-    average_daily = sum(daily_attendance.values()) / len(daily_attendance) if daily_attendance else 0
+    # Running counters maintained on check-in/check-out (one point read)
+    stats = get_member_stats(member_id)
+    
+    if not stats:
+        return {
+            "member_id": member_id,
+            "member_name": member["name"],
+            "total_attendance": 0,
+            "monthly_attendance": 0,
+            "first_check_in": None,
+            "last_check_in": None,
+            "total_minutes": 0,
+            "average_per_week": 0
+        }
     
     return {
-        "total_attendance": total_attendance,
-        "unique_members": unique_members,
-        "average_daily_attendance": round(average_daily, 2),
-        "daily_breakdown": dict(sorted(daily_attendance.items()))
+        "member_id": member_id,
+        "member_name": member["name"],
+        "total_attendance": stats["total_visits"],
+        "monthly_attendance": current_month_visits(stats),
+        "first_check_in": stats["first_visit"],
+        "last_check_in": stats["last_visit"],
+        "total_minutes": stats["total_minutes"],
+        "average_per_week": round(average_per_week(stats), 2)
     }
 
-@router.get("/attendance/member/{member_id}")
-async def get_member_attendance_stats(member_id: str):
-    """Get attendance statistics for a specific member"""
+# ============ OCCUPANCY ============
+
+def parse_day(value: str, field_name: str) -> datetime:
+    try:
+        return datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{field_name} must be in YYYY-MM-DD format")
+
+@router.get("/occupancy/heatmap")
+def get_occupancy_heatmap(days: int = Query(90, ge=7, le=366)):
+    """Day-of-week x hour-of-day occupancy over the last N days"""
+    end = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    start = end - timedelta(days=days)
     
-    from app.utils import check_member_exists
-    member = check_member_exists(member_id)
+    series = occupancy.occupancy_series(occupancy.minute_events(start, end), start, end)
+    heatmap = occupancy.weekly_heatmap(series, start)
     
-    # Total attendance
-    total_attendance = attendance_collection.count_documents({"member_id": member_id})
+    return {
+        "start_date": start.strftime("%Y-%m-%d"),
+        "end_date": (end - timedelta(days=1)).strftime("%Y-%m-%d"),
+        "days": ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"],
+        "average_occupancy": heatmap["average"],
+        "peak_occupancy": heatmap["peak"]
+    }
+
+@router.get("/occupancy/timeseries")
+def get_occupancy_timeseries(
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    resolution: int = Query(1, ge=1, le=60)
+):
+    """People in the gym per minute (or peak per `resolution` minutes), today by default"""
+    start = parse_day(start_date, "start_date") if start_date else datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    end = parse_day(end_date, "end_date") + timedelta(days=1) if end_date else start + timedelta(days=1)
     
-    # Current month attendance
-    now = datetime.now()
-    month_start = datetime(now.year, now.month, 1).strftime("%Y-%m-%d")
-    monthly_attendance = attendance_collection.count_documents({
-        "member_id": member_id,
-        "date": {"$gte": month_start}
-    })
+    if end <= start:
+        raise HTTPException(status_code=400, detail="end_date must not be before start_date")
+    if (end - start).days > 31:
+        raise HTTPException(status_code=400, detail="Range cannot exceed 31 days")
     
-    # Last check-in
-    last_attendance = attendance_collection.find_one(
-        {"member_id": member_id},
-        sort=[("check_in_time", -1)]
-    )
-    
-    last_checkin = last_attendance["check_in_time"] if last_attendance else None
-    
-    # Get all attendance records for this member
-    all_records = list(attendance_collection.find(
-        {"member_id": member_id}
-    ).sort("date", 1))
-    
-    # Calculate average visits per week
-    if all_records:
-        first_date = datetime.strptime(all_records[0]["date"], "%Y-%m-%d")
-        last_date = datetime.strptime(all_records[-1]["date"], "%Y-%m-%d")
-        days_difference = (last_date - first_date).days
-        weeks = max(days_difference / 7, 1)
-        avg_per_week = total_attendance / weeks
-    else:
-        avg_per_week = 0
+    series = occupancy.occupancy_series(occupancy.minute_events(start, end), start, end)
     
     return {
-        "member_id": member_id,
-        "member_name": member["name"],
-        "total_attendance": total_attendance,
-        "monthly_attendance": monthly_attendance,
-        "last_check_in": last_checkin,
-        "average_per_week": round(avg_per_week, 2)
+        "start": start,
+        "resolution_minutes": resolution,
+        "values": occupancy.downsample(series, resolution),
+        "peak": max(series) if series else 0
     }
 
 # ============ MEMBER REPORTS ============
 
 @router.get("/members/growth")
-async def get_member_growth(year: int = Query(datetime.now().year)):
+def get_member_growth(year: int = Query(datetime.now().year)):
     """Get member growth by month for a year"""
     
     monthly_data = []
@@ -303,7 +301,7 @@ async def get_member_growth(year: int = Query(datetime.now().year)):
     }
 
 @router.get("/members/expiring-soon")
-async def get_expiring_members(days: int = Query(7, ge=1, le=30)):
+def get_expiring_members(days: int = Query(7, ge=1, le=30)):
     """Get members whose subscriptions are expiring soon"""
     
     end_date_threshold = datetime.now() + timedelta(days=days)
@@ -316,7 +314,7 @@ async def get_expiring_members(days: int = Query(7, ge=1, le=30)):
     result = []
     for sub in expiring_subs:
         member = members_collection.find_one({"_id": ObjectId(sub["member_id"])})
-        plan = plans_collection.find_one({"_id": ObjectId(sub["plan_id"])})
+        plan = plan_catalog.get_plan(sub["plan_id"])
         
         if member and plan:
             result.append({
@@ -334,13 +332,40 @@ async def get_expiring_members(days: int = Query(7, ge=1, le=30)):
         "members": result
     }
 
+# ============ COHORTS & CHURN ============
+
+@router.get("/cohorts/retention")
+def get_cohort_retention(
+    start_month: str = Query((datetime.now() - timedelta(days=365)).strftime("%Y-%m"), pattern=r"^\d{4}-\d{2}$"),
+    months: int = Query(12, ge=1, le=36)
+):
+    """Monthly cohort retention: share of each join-month cohort checking in N months later"""
+    return {
+        "start_month": start_month,
+        "months": months,
+        "cohorts": cohorts.retention(start_month, months)
+    }
+
+@router.get("/cohorts/renewal-rate")
+def get_renewal_rate_by_plan():
+    """Renewal rate per subscription plan"""
+    return cohorts.renewal_rates()
+
+@router.get("/cohorts/visit-decay")
+def get_visit_decay(
+    months_before: int = Query(6, ge=1, le=24),
+    since_months: int = Query(12, ge=1, le=60)
+):
+    """Average monthly visits leading up to subscription expiry"""
+    return cohorts.visit_decay(months_before, since_months)
+
 # ============ PLAN POPULARITY ============
 
 @router.get("/plans/popularity")
-async def get_plan_popularity():
+def get_plan_popularity():
     """Get popularity statistics for subscription plans"""
     
-    plans = list(plans_collection.find({}))
+    plans = plan_catalog.all_plans()
     plan_stats = []
     
     for plan in plans:
@@ -364,4 +389,74 @@ async def get_plan_popularity():
     # Sort by total subscriptions
     plan_stats.sort(key=lambda x: x["total_subscriptions"], reverse=True)
     
-    return plan_stats
\ No newline at end of file
+    return plan_stats
+# ============ BRANCHES ============
+
+@router.get("/branches")
+def get_branch_rollup(current_admin: dict = Depends(get_current_admin)):
+    """Key figures for every branch side by side (admin only)"""
+    
+    now = datetime.now()
+    month_start = datetime(now.year, now.month, 1)
+    today = now.strftime("%Y-%m-%d")
+    
+    # Group by branch across every branch; each scan uses an index leading on branch_id
+    with all_branches():
+        members = members_collection.aggregate([
+            {"$group": {
+                "_id": "$branch_id",
+                "total_members": {"$sum": 1},
+                "active_members": {"$sum": {"$cond": [{"$eq": ["$status", "active"]}, 1, 0]}}
+            }}
+        ])
+        revenue = member_subscriptions_collection.aggregate([
+            {"$group": {
+                "_id": "$branch_id",
+                "total_revenue": {"$sum": "$payment_amount"},
+                "monthly_revenue": {"$sum": {"$cond": [{"$gte": ["$payment_date", month_start]}, "$payment_amount", 0]}},
+                "active_subscriptions": {"$sum": {"$cond": [{"$eq": ["$status", "active"]}, 1, 0]}}
+            }}
+        ])
+        # Archived subscriptions as one row per branch
+        archived = [
+            {"_id": totals["branch_id"], "total_revenue": totals["revenue"]}
+            for totals in archive.revenue_totals()
+        ]
+        attendance = attendance_store.aggregate([
+            {"$match": {"date": today}},
+            {"$group": {
+                "_id": "$branch_id",
+                "today_check_ins": {"$sum": 1},
+                "currently_in_gym": {"$sum": {"$cond": [{"$eq": ["$check_out_time", None]}, 1, 0]}}
+            }}
+        ])
+        
+        branches = defaultdict(lambda: {
+            "total_members": 0,
+            "active_members": 0,
+            "total_revenue": 0,
+            "monthly_revenue": 0,
+            "active_subscriptions": 0,
+            "today_check_ins": 0,
+            "currently_in_gym": 0
+        })
+        for rows in (members, revenue, archived, attendance):
+            for row in rows:
+                # Documents from before branches count towards the default branch
+                branch = branches[row.pop("_id") or settings.default_branch]
+                for key, value in row.items():
+                    branch[key] += value
+    
+    result = []
+    for branch_id, figures in sorted(branches.items()):
+        figures["total_revenue"] = round(figures["total_revenue"], 2)
+        figures["monthly_revenue"] = round(figures["monthly_revenue"], 2)
+        result.append({"branch_id": branch_id, **figures})
+    
+    return {
+        "branches": result,
+        "totals": {
+            key: round(sum(branch[key] for branch in result), 2)
+            for key in ("total_members", "active_members", "total_revenue", "monthly_revenue", "today_check_ins")
+        }
+    }
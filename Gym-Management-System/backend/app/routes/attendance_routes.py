@@ -1,15 +1,31 @@
-from fastapi import APIRouter, HTTPException, status, Query
+from fastapi import APIRouter, HTTPException, status, Query, Depends
 from app.schemas.attendance_schema import (
     AttendanceCreate, AttendanceCheckout, AttendanceResponse,
-    WorkoutPlanCreate, WorkoutPlanUpdate, WorkoutPlanResponse
+    WorkoutPlanCreate, WorkoutPlanUpdate, WorkoutPlanResponse, TrainerLoadResponse,
+    WorkoutPlanListResponse, WorkoutTemplateCreate, WorkoutTemplateUpdate, WorkoutTemplateResponse,
+    TemplateAssign, TemplateAssignResponse, convert_legacy_plan
 )
-from app.database import database, attendance_collection, workout_plans_collection, members_collection
+from app.database import (
+    workout_plans_collection, workout_templates_collection, members_collection,
+    run_in_transaction, CASE_INSENSITIVE
+)
+from app.attendance_store import attendance_store, new_visit
+from app.attendance_buffer import attendance_buffer
+from app.front_desk import front_desk
+from app.attendance_stats import rebuild_member_stats
+from app.http_cache import bump, conditional
+from app import archive
+from app.workouts import apply_overrides, diff_exercises
 from bson import ObjectId
-from typing import List, Optional
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from typing import List, Optional, Union
 from datetime import datetime, timedelta
 from app.utils import validate_object_id, check_member_exists
+from app.deadlines import query_deadline
+from app.config import settings
 
-router = APIRouter(prefix="/attendance", tags=["Attendance & Workout"])
+router = APIRouter(prefix="/attendance", tags=["Attendance & Workout"], dependencies=[Depends(query_deadline(settings.query_timeout_seconds))])
 
 # Helper functions
 def attendance_helper(attendance) -> dict:
@@ -18,25 +34,80 @@ def attendance_helper(attendance) -> dict:
         "member_id": attendance["member_id"],
         "check_in_time": attendance["check_in_time"],
         "check_out_time": attendance.get("check_out_time"),
-        "date": attendance["date"]
+        "date": attendance["date"],
+        "auto_closed": attendance.get("auto_closed", False)
     }
 
-def workout_plan_helper(plan) -> dict:
+def workout_plan_helper(plan, template=None) -> dict:
+    # Plans not yet migrated (scripts/migrate_workout_plans.py) still hold a string
+    if isinstance(plan.get("exercises"), str):
+        plan = {**plan, **convert_legacy_plan(plan)}
+    
+    exercises = plan.get("exercises", [])
+    notes = plan.get("notes")
+    if plan.get("template_id"):
+        # Template body with this member's overrides
+        exercises = apply_overrides(template["exercises"], plan.get("overrides")) if template else []
+        notes = notes or (template or {}).get("notes")
+    
     return {
         "_id": str(plan["_id"]),
         "member_id": plan["member_id"],
         "plan_name": plan["plan_name"],
-        "exercises": plan["exercises"],
+        "template_id": plan.get("template_id"),
+        "exercises": exercises,
+        "notes": notes,
         "created_date": plan["created_date"],
         "trainer_name": plan.get("trainer_name")
     }
 
+def compact_plan_helper(plan) -> dict:
+    if isinstance(plan.get("exercises"), str):
+        plan = {**plan, **convert_legacy_plan(plan)}
+    return {
+        "_id": str(plan["_id"]),
+        "member_id": plan["member_id"],
+        "plan_name": plan["plan_name"],
+        "template_id": plan.get("template_id"),
+        "exercises": plan.get("exercises"),
+        "overrides": plan.get("overrides"),
+        "notes": plan.get("notes"),
+        "created_date": plan["created_date"],
+        "trainer_name": plan.get("trainer_name")
+    }
+
+def workout_template_helper(template) -> dict:
+    return {
+        "_id": str(template["_id"]),
+        "name": template["name"],
+        "exercises": template["exercises"],
+        "notes": template.get("notes"),
+        "trainer_name": template.get("trainer_name"),
+        "created_date": template["created_date"],
+        "updated_date": template.get("updated_date")
+    }
+
+def templates_for(plans) -> dict:
+    """Templates referenced by plans, by id (one query)"""
+    template_ids = {plan["template_id"] for plan in plans if plan.get("template_id")}
+    if not template_ids:
+        return {}
+    return {
+        str(template["_id"]): template
+        for template in workout_templates_collection.find({"_id": {"$in": [ObjectId(t) for t in template_ids]}})
+    }
+
+def resolve_plan(plan) -> dict:
+    return workout_plan_helper(plan, templates_for([plan]).get(plan.get("template_id")))
+
 # ============ ATTENDANCE ============
 
 @router.post("/check-in", response_model=AttendanceResponse, status_code=status.HTTP_201_CREATED)
 async def check_in(attendance: AttendanceCreate):
-    # Check if member exists
-    member = check_member_exists(attendance.member_id)
+    # Check if member exists (from the kiosk's snapshot in kiosk mode)
+    member = front_desk.get_member(validate_object_id(attendance.member_id, "Member ID"))
+    if not member:
+        raise HTTPException(status_code=404, detail="Member not found")
     
     # Check if member has active subscription
     if member.get("status") not in ["active"]:
@@ -45,36 +116,19 @@ async def check_in(attendance: AttendanceCreate):
             detail=f"Member status is '{member.get('status')}'. Only active members can check in."
         )
     
-    # Check if member already checked in today without checking out
-    today = datetime.now().strftime("%Y-%m-%d")
-    existing_attendance = attendance_collection.find_one({
-        "member_id": attendance.member_id,
-        "date": today,
-        "check_out_time": None
-    })
-    
-    if existing_attendance:
+    attendance_dict = new_visit(attendance.member_id, datetime.now())
+    if not front_desk.check_in(attendance_dict, member.get("join_date")):
         raise HTTPException(
             status_code=400,
             detail="Member is already checked in. Please check out first."
         )
     
-    attendance_dict = {
-        "member_id": attendance.member_id,
-        "check_in_time": datetime.now(),
-        "check_out_time": None,
-        "date": today
-    }
-    
-    result = attendance_collection.insert_one(attendance_dict)
-    created_attendance = attendance_collection.find_one({"_id": result.inserted_id})
-    return attendance_helper(created_attendance)
+    return attendance_helper(attendance_dict)
 
 @router.put("/check-out/{attendance_id}", response_model=AttendanceResponse)
 async def check_out(attendance_id: str):
     obj_id = validate_object_id(attendance_id, "Attendance ID")
-    
-    attendance = attendance_collection.find_one({"_id": obj_id})
+    attendance = front_desk.get_visit(obj_id)
     
     if not attendance:
         raise HTTPException(status_code=404, detail="Attendance record not found")
@@ -94,12 +148,9 @@ async def check_out(attendance_id: str):
             detail="Check-out time cannot be before check-in time"
         )
     
-    result = attendance_collection.update_one(
-        {"_id": obj_id},
-        {"$set": {"check_out_time": checkout_time}}
-    )
-    
-    updated_attendance = attendance_collection.find_one({"_id": obj_id})
+    updated_attendance = front_desk.check_out(obj_id, checkout_time)
+    if not updated_attendance:
+        raise HTTPException(status_code=400, detail="Already checked out")
     return attendance_helper(updated_attendance)
 
 @router.get("/stats/today")
@@ -107,12 +158,12 @@ async def get_today_stats():
     """Get attendance statistics for today"""
     today = datetime.now().strftime("%Y-%m-%d")
     
-    total_checkins = attendance_collection.count_documents({"date": today})
-    active_now = attendance_collection.count_documents({
+    total_checkins = attendance_store.count({"date": today})
+    active_now = attendance_store.count({
         "date": today,
         "check_out_time": None
     })
-    completed = attendance_collection.count_documents({
+    completed = attendance_store.count({
         "date": today,
         "check_out_time": {"$ne": None}
     })
@@ -134,11 +185,21 @@ async def create_workout_plan(plan: WorkoutPlanCreate):
     
     plan_dict = plan.model_dump()
     result = workout_plans_collection.insert_one(plan_dict)
+    bump("workout_plans")
     created_plan = workout_plans_collection.find_one({"_id": result.inserted_id})
     return workout_plan_helper(created_plan)
 
-@router.get("/workout-plans", response_model=List[WorkoutPlanResponse])
-async def get_workout_plans(member_id: Optional[str] = None):
+@router.get(
+    "/workout-plans",
+    response_model=Union[List[WorkoutPlanResponse], WorkoutPlanListResponse],
+    dependencies=[Depends(conditional("workout_plans", "workout_templates"))]
+)
+async def get_workout_plans(
+    member_id: Optional[str] = None,
+    exercise: Optional[str] = Query(None, description="Plans containing this exercise (case-insensitive)"),
+    trainer_name: Optional[str] = Query(None, description="Plans by this trainer (case-insensitive)"),
+    compact: bool = Query(False, description="Plans as stored, with each referenced template once")
+):
     query = {}
     
     if member_id:
@@ -146,11 +207,99 @@ async def get_workout_plans(member_id: Optional[str] = None):
         check_member_exists(member_id)
         query["member_id"] = member_id
     
+    # Served by the multikey exercises.name and trainer_name indexes, which
+    # are case-insensitive; other queries keep the default collation so the
+    # member_id index still applies
+    collation = None
+    if exercise:
+        exercise = " ".join(exercise.split())
+        template_ids = [
+            str(template["_id"])
+            for template in workout_templates_collection.find({"exercises.name": exercise}, {"_id": 1}, collation=CASE_INSENSITIVE)
+        ]
+        query["$or"] = [
+            {"exercises.name": exercise},
+            {"overrides.added.name": exercise},
+            {"template_id": {"$in": template_ids}}
+        ]
+        collation = CASE_INSENSITIVE
+    if trainer_name:
+        query["trainer_name"] = trainer_name.strip()
+        collation = CASE_INSENSITIVE
+    
+    stored = list(workout_plans_collection.find(query, collation=collation).sort("created_date", -1))
+    templates = templates_for(stored)
+    
     plans = []
-    for plan in workout_plans_collection.find(query).sort("created_date", -1):
-        plans.append(workout_plan_helper(plan))
+    for plan in stored:
+        resolved = workout_plan_helper(plan, templates.get(plan.get("template_id")))
+        # A member may have removed the exercise from their template plan
+        if exercise and not any(e["name"].lower() == exercise.lower() for e in resolved["exercises"]):
+            continue
+        plans.append(compact_plan_helper(plan) if compact else resolved)
+    
+    if compact:
+        referenced = {plan["template_id"] for plan in plans if plan["template_id"]}
+        return {
+            "plans": plans,
+            "templates": {
+                template_id: workout_template_helper(templates[template_id])
+                for template_id in referenced if template_id in templates
+            }
+        }
     return plans
 
+@router.get(
+    "/workout-plans/trainers",
+    response_model=List[TrainerLoadResponse],
+    dependencies=[Depends(conditional("workout_plans", "workout_templates"))]
+)
+async def get_trainer_load():
+    """Plans, members and prescribed sets per trainer"""
+    pipeline = [
+        {"$match": {"trainer_name": {"$type": "string"}}},
+        {"$project": {
+            "trainer_name": 1,
+            "member_id": 1,
+            "template_id": 1,
+            # Plans not yet migrated hold a string and count as no exercises
+            "exercises": {"$cond": [{"$isArray": "$exercises"}, "$exercises", []]},
+            "added": {"$ifNull": ["$overrides.added", []]},
+            "removed": {"$size": {"$ifNull": ["$overrides.removed", []]}}
+        }},
+        # Per trainer and template; template bodies are added below
+        {"$group": {
+            "_id": {"trainer_name": "$trainer_name", "template_id": "$template_id"},
+            "plans": {"$sum": 1},
+            "members": {"$addToSet": "$member_id"},
+            "exercises": {"$sum": {"$subtract": [{"$add": [{"$size": "$exercises"}, {"$size": "$added"}]}, "$removed"]}},
+            "total_sets": {"$sum": {"$add": [{"$sum": "$exercises.sets"}, {"$sum": "$added.sets"}]}}
+        }}
+    ]
+    rows = list(workout_plans_collection.aggregate(pipeline, collation=CASE_INSENSITIVE))
+    templates = templates_for([row["_id"] for row in rows])
+    
+    trainers = {}
+    for row in rows:
+        name = row["_id"]["trainer_name"]
+        trainer = trainers.setdefault(name.lower(), {
+            "trainer_name": name, "plans": 0, "members": set(), "exercises": 0, "total_sets": 0
+        })
+        trainer["plans"] += row["plans"]
+        trainer["members"].update(row["members"])
+        trainer["exercises"] += row["exercises"]
+        trainer["total_sets"] += row["total_sets"]
+        
+        # Overridden and removed sets are not reflected in total_sets
+        template = templates.get(row["_id"].get("template_id"))
+        if template:
+            trainer["exercises"] += row["plans"] * len(template["exercises"])
+            trainer["total_sets"] += row["plans"] * sum(e.get("sets") or 0 for e in template["exercises"])
+    
+    result = [{**trainer, "members": len(trainer["members"])} for trainer in trainers.values()]
+    result.sort(key=lambda t: (-t["plans"], t["trainer_name"]))
+    return result
+
 @router.get("/workout-plans/{plan_id}", response_model=WorkoutPlanResponse)
 async def get_workout_plan(plan_id: str):
     obj_id = validate_object_id(plan_id, "Workout Plan ID")
@@ -159,7 +308,7 @@ async def get_workout_plan(plan_id: str):
     if not plan:
         raise HTTPException(status_code=404, detail="Workout plan not found")
     
-    return workout_plan_helper(plan)
+    return resolve_plan(plan)
 
 @router.put("/workout-plans/{plan_id}", response_model=WorkoutPlanResponse)
 async def update_workout_plan(plan_id: str, plan_update: WorkoutPlanUpdate):
@@ -175,13 +324,20 @@ async def update_workout_plan(plan_id: str, plan_update: WorkoutPlanUpdate):
     if not update_data:
         raise HTTPException(status_code=400, detail="No fields to update")
     
+    # Template plans keep referencing the template and store only the changes
+    if "exercises" in update_data and existing_plan.get("template_id"):
+        template = templates_for([existing_plan]).get(existing_plan["template_id"])
+        if template:
+            update_data["overrides"] = diff_exercises(template["exercises"], update_data.pop("exercises"))
+    
     result = workout_plans_collection.update_one(
         {"_id": obj_id},
         {"$set": update_data}
     )
+    bump("workout_plans")
     
     updated_plan = workout_plans_collection.find_one({"_id": obj_id})
-    return workout_plan_helper(updated_plan)
+    return resolve_plan(updated_plan)
 
 @router.delete("/workout-plans/{plan_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_workout_plan(plan_id: str):
@@ -192,11 +348,140 @@ async def delete_workout_plan(plan_id: str):
         raise HTTPException(status_code=404, detail="Workout plan not found")
     
     result = workout_plans_collection.delete_one({"_id": obj_id})
+    bump("workout_plans")
+    return None
+
+# ============ WORKOUT TEMPLATES ============
+# A template is stored once and assigned to many members; their plans
+# reference it and keep only per-member overrides
+
+@router.post("/workout-templates", response_model=WorkoutTemplateResponse, status_code=status.HTTP_201_CREATED)
+async def create_workout_template(template: WorkoutTemplateCreate):
+    template_dict = template.model_dump()
+    template_dict["created_date"] = datetime.now()
+    result = workout_templates_collection.insert_one(template_dict)
+    bump("workout_templates")
+    created_template = workout_templates_collection.find_one({"_id": result.inserted_id})
+    return workout_template_helper(created_template)
+
+@router.get("/workout-templates", response_model=List[WorkoutTemplateResponse], dependencies=[Depends(conditional("workout_templates"))])
+async def get_workout_templates():
+    return [workout_template_helper(t) for t in workout_templates_collection.find().sort("name", 1)]
+
+@router.get("/workout-templates/{template_id}", response_model=WorkoutTemplateResponse)
+async def get_workout_template(template_id: str):
+    obj_id = validate_object_id(template_id, "Workout Template ID")
+    
+    template = workout_templates_collection.find_one({"_id": obj_id})
+    if not template:
+        raise HTTPException(status_code=404, detail="Workout template not found")
+    
+    return workout_template_helper(template)
+
+@router.put("/workout-templates/{template_id}", response_model=WorkoutTemplateResponse)
+async def update_workout_template(template_id: str, template_update: WorkoutTemplateUpdate):
+    obj_id = validate_object_id(template_id, "Workout Template ID")
+    
+    update_data = {k: v for k, v in template_update.model_dump().items() if v is not None}
+    if not update_data:
+        raise HTTPException(status_code=400, detail="No fields to update")
+    update_data["updated_date"] = datetime.now()
+    
+    result = workout_templates_collection.update_one({"_id": obj_id}, {"$set": update_data})
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Workout template not found")
+    # Every assigned plan changes with it
+    bump("workout_templates", "workout_plans")
+    
+    return workout_template_helper(workout_templates_collection.find_one({"_id": obj_id}))
+
+@router.delete("/workout-templates/{template_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_workout_template(template_id: str):
+    obj_id = validate_object_id(template_id, "Workout Template ID")
+    
+    template = workout_templates_collection.find_one({"_id": obj_id})
+    if not template:
+        raise HTTPException(status_code=404, detail="Workout template not found")
+    
+    def delete(session):
+        # Assigned plans get their own copy of the exercises first
+        updates = [
+            UpdateOne(
+                {"_id": plan["_id"]},
+                {
+                    "$set": {
+                        "exercises": apply_overrides(template["exercises"], plan.get("overrides")),
+                        "notes": plan.get("notes") or template.get("notes")
+                    },
+                    "$unset": {"template_id": "", "overrides": ""}
+                }
+            )
+            for plan in workout_plans_collection.find({"template_id": template_id}, session=session)
+        ]
+        if updates:
+            workout_plans_collection.bulk_write(updates, session=session)
+        workout_templates_collection.delete_one({"_id": obj_id}, session=session)
+    
+    run_in_transaction(delete)
+    bump("workout_templates", "workout_plans")
     return None
 
+@router.post("/workout-templates/{template_id}/assign", response_model=TemplateAssignResponse, status_code=status.HTTP_201_CREATED)
+async def assign_workout_template(template_id: str, assignment: TemplateAssign):
+    """Assign a template to many members with a single write"""
+    obj_id = validate_object_id(template_id, "Workout Template ID")
+    
+    template = workout_templates_collection.find_one({"_id": obj_id})
+    if not template:
+        raise HTTPException(status_code=404, detail="Workout template not found")
+    
+    # Validate every member with one query
+    member_ids = list(dict.fromkeys(assignment.member_ids))
+    member_obj_ids = [validate_object_id(member_id, "Member ID") for member_id in member_ids]
+    found = {str(m["_id"]) for m in members_collection.find({"_id": {"$in": member_obj_ids}}, {"_id": 1})}
+    missing = [member_id for member_id in member_ids if member_id not in found]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Members not found: {', '.join(missing)}")
+    
+    already_assigned = {
+        plan["member_id"]
+        for plan in workout_plans_collection.find(
+            {"template_id": template_id, "member_id": {"$in": member_ids}}, {"member_id": 1}
+        )
+    }
+    now = datetime.now()
+    plans = [
+        {
+            "member_id": member_id,
+            "plan_name": assignment.plan_name or template["name"],
+            "template_id": template_id,
+            "created_date": now,
+            "trainer_name": assignment.trainer_name or template.get("trainer_name")
+        }
+        for member_id in member_ids if member_id not in already_assigned
+    ]
+    
+    assigned = 0
+    if plans:
+        try:
+            assigned = len(workout_plans_collection.insert_many(plans, ordered=False).inserted_ids)
+        except BulkWriteError as e:
+            if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+                raise
+            # Assigned concurrently: the unique index rejects the duplicates
+            assigned = e.details["nInserted"]
+            already_assigned.update(plans[error["index"]]["member_id"] for error in e.details["writeErrors"])
+        bump("workout_plans")
+    
+    return {
+        "template_id": template_id,
+        "assigned": assigned,
+        "already_assigned": sorted(already_assigned)
+    }
+
 # ============ ATTENDANCE RECORDS (Generic routes at the end) ============
 
-@router.get("/", response_model=List[AttendanceResponse])
+@router.get("/", response_model=List[AttendanceResponse], dependencies=[Depends(conditional("attendance"))])
 async def get_attendance(
     member_id: Optional[str] = None,
     date: Optional[str] = None,
@@ -220,8 +505,9 @@ async def get_attendance(
     elif end_date:
         query["date"] = {"$lte": end_date}
     
+    # Older records are read from the archive when the range reaches back
     attendance_records = []
-    for record in attendance_collection.find(query).sort("check_in_time", -1):
+    for record in archive.find_attendance(query, start=date or start_date, sort=[("check_in_time", -1)]):
         attendance_records.append(attendance_helper(record))
     return attendance_records
 
@@ -229,7 +515,7 @@ async def get_attendance(
 async def get_attendance_by_id(attendance_id: str):
     obj_id = validate_object_id(attendance_id, "Attendance ID")
     
-    attendance = attendance_collection.find_one({"_id": obj_id})
+    attendance = attendance_store.get(obj_id)
     if not attendance:
         raise HTTPException(status_code=404, detail="Attendance record not found")
     
@@ -240,9 +526,14 @@ async def delete_attendance(attendance_id: str):
     """Delete an attendance record (admin only)"""
     obj_id = validate_object_id(attendance_id, "Attendance ID")
     
-    attendance = attendance_collection.find_one({"_id": obj_id})
+    # Queued scans are written first (write-behind mode)
+    attendance_buffer.forget_visit(obj_id)
+    
+    attendance = attendance_store.get(obj_id)
     if not attendance:
         raise HTTPException(status_code=404, detail="Attendance record not found")
     
-    attendance_collection.delete_one({"_id": obj_id})
+    attendance_store.delete(obj_id)
+    rebuild_member_stats(attendance["member_id"])
+    bump("attendance")
     return None
\ No newline at end of file
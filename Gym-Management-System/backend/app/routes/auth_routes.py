@@ -7,13 +7,17 @@ from app.auth import (
     authenticate_user, 
     create_access_token,
     get_current_user,
-    get_current_admin
+    get_current_admin,
+    verify_password
 )
 from datetime import timedelta, datetime
 from app.config import settings
+from app.rate_limit import login_ip_limit, login_account_limit
+from app.branches import get_branch
+from app.deadlines import query_deadline
 from bson import ObjectId
 
-router = APIRouter(prefix="/auth", tags=["Authentication"])
+router = APIRouter(prefix="/auth", tags=["Authentication"], dependencies=[Depends(query_deadline(settings.query_timeout_seconds))])
 
 @router.post("/register", status_code=status.HTTP_201_CREATED)
 async def register_user(user: UserRegister):
@@ -49,6 +53,7 @@ async def register_user(user: UserRegister):
         "name": user.name,
         "role": user.role,
         "member_id": member_id,
+        "branch_id": get_branch(),
         "created_at": datetime.now()
     }
     
@@ -60,13 +65,16 @@ async def register_user(user: UserRegister):
         "role": user.role
     }
 
-@router.post("/login", response_model=Token)
+@router.post("/login", response_model=Token, dependencies=[Depends(login_ip_limit)])
 async def login(form_data: OAuth2PasswordRequestForm = Depends()):
     """Login user and return JWT token"""
     
+    account = form_data.username.lower()
+    login_account_limit.check(account)
     user = authenticate_user(form_data.username, form_data.password)
     
     if not user:
+        login_account_limit.hit(account)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
@@ -76,7 +84,7 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
     # Create access token
     access_token_expires = timedelta(minutes=int(settings.access_token_expire_minutes))
     access_token = create_access_token(
-        data={"sub": user["email"], "role": user["role"]},
+        data={"sub": user["email"], "role": user["role"], "branch_id": user.get("branch_id", settings.default_branch)},
         expires_delta=access_token_expires
     )
     
@@ -88,13 +96,16 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
         "name": user["name"]
     }
 
-@router.post("/login-json")
+@router.post("/login-json", dependencies=[Depends(login_ip_limit)])
 async def login_json(credentials: UserLogin):
     """Login with JSON body (alternative to form-data)"""
     
+    account = credentials.email.lower()
+    login_account_limit.check(account)
     user = authenticate_user(credentials.email, credentials.password)
     
     if not user:
+        login_account_limit.hit(account)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password"
@@ -103,7 +114,7 @@ async def login_json(credentials: UserLogin):
     # Create access token
     access_token_expires = timedelta(minutes=int(settings.access_token_expire_minutes))
     access_token = create_access_token(
-        data={"sub": user["email"], "role": user["role"]},
+        data={"sub": user["email"], "role": user["role"], "branch_id": user.get("branch_id", settings.default_branch)},
         expires_delta=access_token_expires
     )
     
@@ -150,7 +161,6 @@ async def change_password(
     """Change user password"""
     
     # Verify old password
-    from app.auth import verify_password
     if not verify_password(old_password, current_user["password"]):
         raise HTTPException(
             status_code=400,
@@ -185,6 +195,7 @@ async def create_admin_user():
         "name": "Admin User",
         "role": "admin",
         "member_id": None,
+        "branch_id": get_branch(),
         "created_at": datetime.now()
     }
     
@@ -241,6 +252,7 @@ async def register_member_self(email: str, password: str, confirm_password: str)
         "name": member["name"],
         "role": "member",
         "member_id": str(member["_id"]),
+        "branch_id": get_branch(),
         "created_at": datetime.now()
     }
     
@@ -0,0 +1,93 @@
+from fastapi import APIRouter, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
+from app.schemas.job_schema import JobCreate, JobResponse
+from app.database import jobs_collection
+from app import jobs
+from app.utils import validate_object_id
+from typing import List
+import csv
+import io
+
+router = APIRouter(prefix="/jobs", tags=["Background Jobs"])
+
+EXPORT_FIELDS = ["attendance_id", "member_id", "date", "check_in_time", "check_out_time"]
+
+# Helper function
+def job_helper(job) -> dict:
+    return {
+        "job_id": str(job["_id"]),
+        "report": job["report"],
+        "status": job["status"],
+        "progress": job.get("progress", 0),
+        "error": job.get("error"),
+        "created_at": job["created_at"],
+        "started_at": job.get("started_at"),
+        "finished_at": job.get("finished_at")
+    }
+
+def get_job_or_404(job_id: str) -> dict:
+    job = jobs.get_job(validate_object_id(job_id, "Job ID"))
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found (it may have expired)")
+    return job
+
+# ============ REPORT JOBS ============
+
+@router.post("/reports", response_model=JobResponse, status_code=status.HTTP_202_ACCEPTED)
+async def create_report_job(job_request: JobCreate):
+    """Queue a heavy report; poll GET /jobs/{job_id} for progress"""
+    params = job_request.model_dump(exclude={"report"}, exclude_none=True)
+    job = jobs.create_job(job_request.report, params)
+    return job_helper(job)
+
+@router.get("/", response_model=List[JobResponse])
+async def get_jobs(
+    status: str = Query(None, description="queued, running, done or failed"),
+    limit: int = Query(50, ge=1, le=500)
+):
+    """Recent jobs, newest first"""
+    query = {"status": status} if status else {}
+    recent = jobs_collection.find(query).sort("created_at", -1).limit(limit)
+    return [job_helper(job) for job in recent]
+
+@router.get("/{job_id}", response_model=JobResponse)
+async def get_job(job_id: str):
+    """Job status and progress"""
+    return job_helper(get_job_or_404(job_id))
+
+@router.get("/{job_id}/result")
+async def get_job_result(job_id: str, format: str = Query("json", pattern="^(json|csv)$")):
+    """Result of a finished job (exports can be downloaded as CSV)"""
+    job = get_job_or_404(job_id)
+    
+    # Check if job is finished
+    if job["status"] == "failed":
+        raise HTTPException(status_code=409, detail=f"Job failed: {job.get('error')}")
+    if job["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+    
+    result = job["result"]
+    if not result.get("chunked"):
+        return result
+    
+    rows = jobs.job_result_rows(job["_id"])
+    if format == "json":
+        return {"rows": result["rows"], "data": list(rows)}
+    
+    def csv_lines():
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            if buffer.tell() > 64 * 1024:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+    
+    return StreamingResponse(
+        csv_lines(),
+        media_type="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="{job["report"]}-{job_id}.csv"'}
+    )
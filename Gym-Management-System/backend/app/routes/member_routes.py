@@ -1,12 +1,23 @@
-from fastapi import APIRouter, HTTPException, status, Query
+from fastapi import APIRouter, HTTPException, status, Query, Depends
 from app.schemas.member_schema import MemberCreate, MemberUpdate, MemberResponse
-from app.database import members_collection, member_subscriptions_collection, attendance_collection
+from app.database import (
+    members_collection, member_subscriptions_collection, member_subscriptions_archive_collection,
+    run_in_transaction
+)
+from app.attendance_store import attendance_store
+from app.attendance_buffer import attendance_buffer
+from app.front_desk import front_desk
+from app.attendance_stats import delete_member_stats
+from app.http_cache import bump, conditional
+from app import archive
 from bson import ObjectId
 from typing import List, Optional
 from datetime import datetime
 from app.utils import validate_object_id, validate_phone_number
+from app.deadlines import query_deadline
+from app.config import settings
 
-router = APIRouter(prefix="/members", tags=["Members"])
+router = APIRouter(prefix="/members", tags=["Members"], dependencies=[Depends(query_deadline(settings.query_timeout_seconds))])
 
 def member_helper(member) -> dict:
     return {
@@ -46,10 +57,11 @@ async def create_member(member: MemberCreate):
     
     member_dict = member.model_dump()
     result = members_collection.insert_one(member_dict)
+    bump("members")
     created_member = members_collection.find_one({"_id": result.inserted_id})
     return member_helper(created_member)
 
-@router.get("/", response_model=List[MemberResponse])
+@router.get("/", response_model=List[MemberResponse], dependencies=[Depends(conditional("members"))])
 async def get_all_members(
     status: Optional[str] = Query(None, pattern="^(active|inactive|expired)$"),
     gender: Optional[str] = Query(None, pattern="^(Male|Female|Other)$"),
@@ -81,7 +93,8 @@ async def get_all_members(
 @router.get("/{member_id}", response_model=MemberResponse)
 async def get_member(member_id: str):
     obj_id = validate_object_id(member_id, "Member ID")
-    member = members_collection.find_one({"_id": obj_id})
+    # From the kiosk's snapshot in kiosk mode
+    member = front_desk.get_member(obj_id)
     
     if not member:
         raise HTTPException(status_code=404, detail="Member not found")
@@ -136,6 +149,7 @@ async def update_member(member_id: str, member_update: MemberUpdate):
         {"_id": obj_id},
         {"$set": update_data}
     )
+    bump("members")
     
     updated_member = members_collection.find_one({"_id": obj_id})
     return member_helper(updated_member)
@@ -149,25 +163,33 @@ async def delete_member(member_id: str):
     if not member:
         raise HTTPException(status_code=404, detail="Member not found")
     
-    # Check for active subscriptions
-    active_subscription = member_subscriptions_collection.find_one({
-        "member_id": member_id,
-        "status": "active"
-    })
-    
-    if active_subscription:
-        raise HTTPException(
-            status_code=400,
-            detail="Cannot delete member with active subscription. Please expire the subscription first."
-        )
-    
-    # Delete member's data (cascade delete)
-    member_subscriptions_collection.delete_many({"member_id": member_id})
-    attendance_collection.delete_many({"member_id": member_id})
-    
-    # Delete member
-    members_collection.delete_one({"_id": obj_id})
-    
+    # Queued scans are written before the cascade (write-behind mode)
+    attendance_buffer.forget_member(member_id)
+    
+    def delete(session):
+        # Check for active subscriptions
+        active_subscription = member_subscriptions_collection.find_one({
+            "member_id": member_id,
+            "status": "active"
+        }, session=session)
+        
+        if active_subscription:
+            raise HTTPException(
+                status_code=400,
+                detail="Cannot delete member with active subscription. Please expire the subscription first."
+            )
+        
+        # Delete member's data (cascade delete)
+        member_subscriptions_collection.delete_many({"member_id": member_id}, session=session)
+        member_subscriptions_archive_collection.delete_many({"member_id": member_id}, session=session)
+        attendance_store.delete_member(member_id, session=session)
+        delete_member_stats(member_id, session=session)
+        
+        # Delete member
+        members_collection.delete_one({"_id": obj_id}, session=session)
+    
+    run_in_transaction(delete)
+    bump("members", "member_subscriptions", "attendance")
     return None
 
 @router.get("/{member_id}/subscriptions")
@@ -180,7 +202,7 @@ async def get_member_subscriptions(member_id: str):
     if not member:
         raise HTTPException(status_code=404, detail="Member not found")
     
-    subscriptions = list(member_subscriptions_collection.find({"member_id": member_id}))
+    subscriptions = archive.find_subscriptions({"member_id": member_id})
     
     # Convert ObjectId to string
     for sub in subscriptions:
@@ -188,7 +210,7 @@ async def get_member_subscriptions(member_id: str):
     
     return subscriptions
 
-@router.get("/{member_id}/attendance-history")
+@router.get("/{member_id}/attendance-history", dependencies=[Depends(conditional("attendance"))])
 async def get_member_attendance(member_id: str):
     """Get attendance history for a specific member"""
     obj_id = validate_object_id(member_id, "Member ID")
@@ -198,8 +220,8 @@ async def get_member_attendance(member_id: str):
     if not member:
         raise HTTPException(status_code=404, detail="Member not found")
     
-    attendance_records = list(
-        attendance_collection.find({"member_id": member_id}).sort("check_in_time", -1)
+    attendance_records = archive.find_attendance(
+        {"member_id": member_id}, sort=[("check_in_time", -1)]
     )
     
     # Convert ObjectId to string
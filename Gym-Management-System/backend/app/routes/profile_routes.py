@@ -0,0 +1,21 @@
+from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import FileResponse
+from app.auth import get_current_admin
+from app import profiling
+
+router = APIRouter(prefix="/profiles", tags=["Profiling"], dependencies=[Depends(get_current_admin)])
+
+@router.get("/")
+async def get_profiles():
+    """Recent request profiles, newest first (admin only)"""
+    return profiling.list_profiles()
+
+@router.get("/{name}")
+async def download_profile(name: str):
+    """Download a profile (speedscope JSON or collapsed stacks)"""
+    path = profiling.profile_path(name)
+    if not path:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    
+    media_type = "application/json" if name.endswith(".json") else "text/plain"
+    return FileResponse(path, media_type=media_type, filename=name)
@@ -1,15 +1,23 @@
-from fastapi import APIRouter, HTTPException, status, Query
+from fastapi import APIRouter, HTTPException, status, Query, Depends
 from app.schemas.subscription_schema import (
     SubscriptionPlanCreate, SubscriptionPlanUpdate, SubscriptionPlanResponse,
-    MemberSubscriptionCreate, MemberSubscriptionResponse
+    MemberSubscriptionCreate, MemberSubscriptionResponse,
+    BulkEnrollment, BulkRenewal, BulkSubscriptionResponse
 )
-from app.database import database, plans_collection, member_subscriptions_collection, members_collection
+from app.database import plans_collection, member_subscriptions_collection, members_collection, run_in_transaction
 from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from app.http_cache import bump
+from app import archive
+from app.plan_catalog import plan_catalog
 from typing import List, Optional
 from datetime import datetime, timedelta
 from app.utils import validate_object_id, check_member_exists, check_plan_exists, validate_date_range, calculate_subscription_end_date
+from app.deadlines import query_deadline
+from app.config import settings
 
-router = APIRouter(prefix="/subscriptions", tags=["Subscriptions"])
+router = APIRouter(prefix="/subscriptions", tags=["Subscriptions"], dependencies=[Depends(query_deadline(settings.query_timeout_seconds))])
 
 # Helper functions
 def plan_helper(plan) -> dict:
@@ -54,20 +62,21 @@ async def create_plan(plan: SubscriptionPlanCreate):
     
     plan_dict = plan.model_dump()
     result = plans_collection.insert_one(plan_dict)
-    created_plan = plans_collection.find_one({"_id": result.inserted_id})
+    plan_catalog.refresh()
+    created_plan = plan_catalog.get_plan(str(result.inserted_id))
     return plan_helper(created_plan)
 
 @router.get("/plans", response_model=List[SubscriptionPlanResponse])
 async def get_all_plans():
     plans = []
-    for plan in plans_collection.find().sort("price", 1):
+    for plan in plan_catalog.all_plans():
         plans.append(plan_helper(plan))
     return plans
 
 @router.get("/plans/{plan_id}", response_model=SubscriptionPlanResponse)
 async def get_plan(plan_id: str):
-    obj_id = validate_object_id(plan_id, "Plan ID")
-    plan = plans_collection.find_one({"_id": obj_id})
+    validate_object_id(plan_id, "Plan ID")
+    plan = plan_catalog.get_plan(plan_id)
     
     if not plan:
         raise HTTPException(status_code=404, detail="Plan not found")
@@ -112,8 +121,9 @@ async def update_plan(plan_id: str, plan_update: SubscriptionPlanUpdate):
         {"_id": obj_id},
         {"$set": update_data}
     )
+    plan_catalog.refresh()
     
-    updated_plan = plans_collection.find_one({"_id": obj_id})
+    updated_plan = plan_catalog.get_plan(plan_id)
     return plan_helper(updated_plan)
 
 @router.delete("/plans/{plan_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -138,6 +148,7 @@ async def delete_plan(plan_id: str):
         )
     
     plans_collection.delete_one({"_id": obj_id})
+    plan_catalog.refresh()
     return None
 
 # ============ MEMBER SUBSCRIPTIONS ============
@@ -160,29 +171,41 @@ async def create_member_subscription(subscription: MemberSubscriptionCreate):
             detail=f"Payment amount ({subscription.payment_amount}) doesn't match plan price ({plan['price']})"
         )
     
-    # Check if member already has an active subscription
-    existing_active = member_subscriptions_collection.find_one({
-        "member_id": subscription.member_id,
-        "status": "active"
-    })
+    subscription_dict = subscription.model_dump()
+    
+    def create(session):
+        # Check if member already has an active subscription
+        existing_active = member_subscriptions_collection.find_one({
+            "member_id": subscription.member_id,
+            "status": "active"
+        }, session=session)
+        
+        if existing_active:
+            raise HTTPException(
+                status_code=400,
+                detail="Member already has an active subscription. Please expire it first."
+            )
+        
+        member_subscriptions_collection.insert_one(subscription_dict, session=session)
+        
+        # Update member status to active
+        members_collection.update_one(
+            {"_id": ObjectId(subscription.member_id)},
+            {"$set": {"status": "active"}},
+            session=session
+        )
     
-    if existing_active:
+    try:
+        run_in_transaction(create)
+    except DuplicateKeyError:
+        # Lost a race against a concurrent create for the same member
         raise HTTPException(
             status_code=400,
             detail="Member already has an active subscription. Please expire it first."
         )
+    bump("members", "member_subscriptions")
     
-    subscription_dict = subscription.model_dump()
-    result = member_subscriptions_collection.insert_one(subscription_dict)
-    
-    # Update member status to active
-    members_collection.update_one(
-        {"_id": ObjectId(subscription.member_id)},
-        {"$set": {"status": "active"}}
-    )
-    
-    created_subscription = member_subscriptions_collection.find_one({"_id": result.inserted_id})
-    return member_subscription_helper(created_subscription)
+    return member_subscription_helper(subscription_dict)
 
 @router.get("/member-subscriptions", response_model=List[MemberSubscriptionResponse])
 async def get_all_member_subscriptions(
@@ -200,7 +223,7 @@ async def get_all_member_subscriptions(
         query["status"] = status
     
     subscriptions = []
-    for sub in member_subscriptions_collection.find(query).sort("start_date", -1):
+    for sub in archive.find_subscriptions(query, sort=[("start_date", -1)]):
         subscriptions.append(member_subscription_helper(sub))
     return subscriptions
 
@@ -236,24 +259,47 @@ async def renew_subscription(subscription_id: str):
     new_start_date = datetime.now()
     new_end_date = calculate_subscription_end_date(new_start_date, plan["duration_months"])
     
-    # Update subscription
-    member_subscriptions_collection.update_one(
-        {"_id": obj_id},
-        {"$set": {
-            "start_date": new_start_date,
-            "end_date": new_end_date,
-            "payment_date": new_start_date,
-            "status": "active"
-        }}
-    )
+    def renew(session):
+        # Only an expired subscription can be renewed, even under concurrent requests
+        updated_subscription = member_subscriptions_collection.find_one_and_update(
+            {"_id": obj_id, "status": "expired"},
+            {
+                "$set": {
+                    "start_date": new_start_date,
+                    "end_date": new_end_date,
+                    "payment_date": new_start_date,
+                    "status": "active"
+                },
+                # Counted by the renewal-rate analytics
+                "$inc": {"renewal_count": 1}
+            },
+            return_document=ReturnDocument.AFTER,
+            session=session
+        )
+        
+        if not updated_subscription:
+            raise HTTPException(
+                status_code=400,
+                detail="Only expired subscriptions can be renewed"
+            )
+        
+        # Update member status
+        members_collection.update_one(
+            {"_id": ObjectId(subscription["member_id"])},
+            {"$set": {"status": "active"}},
+            session=session
+        )
+        return updated_subscription
     
-    # Update member status
-    members_collection.update_one(
-        {"_id": ObjectId(subscription["member_id"])},
-        {"$set": {"status": "active"}}
-    )
+    try:
+        updated_subscription = run_in_transaction(renew)
+    except DuplicateKeyError:
+        raise HTTPException(
+            status_code=400,
+            detail="Member already has an active subscription. Please expire it first."
+        )
+    bump("members", "member_subscriptions")
     
-    updated_subscription = member_subscriptions_collection.find_one({"_id": obj_id})
     return member_subscription_helper(updated_subscription)
 
 @router.put("/member-subscriptions/{subscription_id}/expire", response_model=MemberSubscriptionResponse)
@@ -268,19 +314,28 @@ async def expire_subscription(subscription_id: str):
     if subscription["status"] == "expired":
         raise HTTPException(status_code=400, detail="Subscription is already expired")
     
-    # Expire subscription
-    member_subscriptions_collection.update_one(
-        {"_id": obj_id},
-        {"$set": {"status": "expired"}}
-    )
-    
-    # Update member status
-    members_collection.update_one(
-        {"_id": ObjectId(subscription["member_id"])},
-        {"$set": {"status": "expired"}}
-    )
+    def expire(session):
+        # Expire subscription
+        updated_subscription = member_subscriptions_collection.find_one_and_update(
+            {"_id": obj_id, "status": {"$ne": "expired"}},
+            {"$set": {"status": "expired"}},
+            return_document=ReturnDocument.AFTER,
+            session=session
+        )
+        
+        if not updated_subscription:
+            raise HTTPException(status_code=400, detail="Subscription is already expired")
+        
+        # Update member status
+        members_collection.update_one(
+            {"_id": ObjectId(subscription["member_id"])},
+            {"$set": {"status": "expired"}},
+            session=session
+        )
+        return updated_subscription
     
-    updated_subscription = member_subscriptions_collection.find_one({"_id": obj_id})
+    updated_subscription = run_in_transaction(expire)
+    bump("members", "member_subscriptions")
     return member_subscription_helper(updated_subscription)
 
 @router.delete("/member-subscriptions/{subscription_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -292,13 +347,12 @@ async def delete_member_subscription(subscription_id: str):
         raise HTTPException(status_code=404, detail="Subscription not found")
     
     result = member_subscriptions_collection.delete_one({"_id": obj_id})
+    bump("member_subscriptions")
     return None
 
 @router.get("/expiring-soon")
 async def get_expiring_subscriptions(days: int = Query(7, ge=1, le=30)):
     """Get subscriptions expiring within specified days"""
-    from datetime import timedelta
-    
     end_date_threshold = datetime.now() + timedelta(days=days)
     
     expiring_subs = list(member_subscriptions_collection.find({
@@ -310,7 +364,7 @@ async def get_expiring_subscriptions(days: int = Query(7, ge=1, le=30)):
     result = []
     for sub in expiring_subs:
         member = members_collection.find_one({"_id": ObjectId(sub["member_id"])})
-        plan = plans_collection.find_one({"_id": ObjectId(sub["plan_id"])})
+        plan = plan_catalog.get_plan(sub["plan_id"])
         
         result.append({
             "subscription_id": str(sub["_id"]),
@@ -321,4 +375,160 @@ async def get_expiring_subscriptions(days: int = Query(7, ge=1, le=30)):
             "days_remaining": (sub["end_date"] - datetime.now()).days
         })
     
-    return result
\ No newline at end of file
+    return result
+
+# ============ BULK OPERATIONS ============
+
+ALREADY_ACTIVE = "Member already has an active subscription. Please expire it first."
+
+def eligible_members(member_ids: List[str]) -> tuple:
+    """Validate a member list with set-based queries.
+    
+    Returns the de-duplicated members, those that exist and have no active
+    subscription, and the reason each other member is skipped.
+    """
+    member_ids = list(dict.fromkeys(member_ids))
+    skipped = {member_id: "Invalid Member ID" for member_id in member_ids if not ObjectId.is_valid(member_id)}
+    valid = [member_id for member_id in member_ids if member_id not in skipped]
+    
+    found = {str(m["_id"]) for m in members_collection.find({"_id": {"$in": [ObjectId(m) for m in valid]}}, {"_id": 1})}
+    active = {
+        sub["member_id"]
+        for sub in member_subscriptions_collection.find(
+            {"member_id": {"$in": list(found)}, "status": "active"}, {"member_id": 1}
+        )
+    }
+    for member_id in valid:
+        if member_id not in found:
+            skipped[member_id] = "Member not found"
+        elif member_id in active:
+            skipped[member_id] = ALREADY_ACTIVE
+    
+    return member_ids, [member_id for member_id in valid if member_id not in skipped], skipped
+
+def bulk_result(member_ids: List[str], done: dict, status_name: str, skipped: dict) -> dict:
+    results = []
+    for member_id in member_ids:
+        if member_id in done:
+            results.append({"member_id": member_id, "status": status_name, "subscription_id": str(done[member_id])})
+        else:
+            results.append({"member_id": member_id, "status": "skipped", "detail": skipped[member_id]})
+    return {"succeeded": len(done), "skipped": len(member_ids) - len(done), "results": results}
+
+def activate_members(member_ids):
+    members_collection.update_many(
+        {"_id": {"$in": [ObjectId(member_id) for member_id in member_ids]}},
+        {"$set": {"status": "active"}}
+    )
+    bump("members", "member_subscriptions")
+
+def raise_unless_duplicates(error: BulkWriteError):
+    # The active subscription index rejects members activated concurrently
+    if any(write_error["code"] != 11000 for write_error in error.details["writeErrors"]):
+        raise error
+
+@router.post("/member-subscriptions/bulk-enroll", response_model=BulkSubscriptionResponse)
+async def bulk_enroll(enrollment: BulkEnrollment):
+    """Enroll a group of members (e.g. a corporate account) in one plan"""
+    plan = check_plan_exists(enrollment.plan_id)
+    member_ids, eligible, skipped = eligible_members(enrollment.member_ids)
+    
+    now = datetime.now()
+    end_date = calculate_subscription_end_date(enrollment.start_date, plan["duration_months"])
+    subscriptions = [
+        {
+            "member_id": member_id,
+            "plan_id": enrollment.plan_id,
+            "start_date": enrollment.start_date,
+            "end_date": end_date,
+            "payment_amount": plan["price"],
+            "payment_mode": enrollment.payment_mode,
+            "payment_date": now,
+            "status": "active"
+        }
+        for member_id in eligible
+    ]
+    
+    # Unordered writes instead of a transaction, so a member enrolled
+    # concurrently is skipped rather than failing the whole group
+    enrolled = {}
+    if subscriptions:
+        failed = set()
+        try:
+            member_subscriptions_collection.insert_many(subscriptions, ordered=False)
+        except BulkWriteError as e:
+            raise_unless_duplicates(e)
+            failed = {error["index"] for error in e.details["writeErrors"]}
+        for index, subscription in enumerate(subscriptions):
+            if index in failed:
+                skipped[subscription["member_id"]] = ALREADY_ACTIVE
+            else:
+                enrolled[subscription["member_id"]] = subscription["_id"]
+    
+    if enrolled:
+        activate_members(enrolled)
+    return bulk_result(member_ids, enrolled, "enrolled", skipped)
+
+@router.post("/member-subscriptions/bulk-renew", response_model=BulkSubscriptionResponse)
+async def bulk_renew(renewal: BulkRenewal):
+    """Renew the latest expired subscription of each member (optionally on a new plan)"""
+    plan = check_plan_exists(renewal.plan_id) if renewal.plan_id else None
+    member_ids, eligible, skipped = eligible_members(renewal.member_ids)
+    
+    # Latest expired subscription of every member, in one query
+    latest = {}
+    for sub in member_subscriptions_collection.find(
+        {"member_id": {"$in": eligible}, "status": "expired"}
+    ).sort("end_date", -1):
+        latest.setdefault(sub["member_id"], sub)
+    
+    now = datetime.now()
+    # Stored with millisecond precision, so this run's renewals can be matched afterwards
+    now = now.replace(microsecond=now.microsecond // 1000 * 1000)
+    updates, renewing = [], []
+    for member_id in eligible:
+        sub = latest.get(member_id)
+        if not sub:
+            skipped[member_id] = "No expired subscription to renew"
+            continue
+        sub_plan = plan or plan_catalog.get_plan(sub["plan_id"])
+        if not sub_plan:
+            skipped[member_id] = "Subscription plan not found"
+            continue
+        
+        changes = {
+            "start_date": now,
+            "end_date": calculate_subscription_end_date(now, sub_plan["duration_months"]),
+            "payment_date": now,
+            "status": "active"
+        }
+        if plan:
+            changes.update({"plan_id": renewal.plan_id, "payment_amount": plan["price"]})
+        updates.append(UpdateOne(
+            {"_id": sub["_id"], "status": "expired"},
+            # Counted by the renewal-rate analytics
+            {"$set": changes, "$inc": {"renewal_count": 1}}
+        ))
+        renewing.append(sub["_id"])
+    
+    renewed = {}
+    if updates:
+        try:
+            member_subscriptions_collection.bulk_write(updates, ordered=False)
+        except BulkWriteError as e:
+            raise_unless_duplicates(e)
+        renewed = {
+            sub["member_id"]: sub["_id"]
+            for sub in member_subscriptions_collection.find(
+                {"_id": {"$in": renewing}, "status": "active", "payment_date": now},
+                {"member_id": 1}
+            )
+        }
+        # Renewed or given another active subscription meanwhile
+        for member_id in eligible:
+            if member_id not in renewed and member_id not in skipped:
+                skipped[member_id] = ALREADY_ACTIVE
+    
+    if renewed:
+        activate_members(renewed)
+    return bulk_result(member_ids, renewed, "renewed", skipped)
\ No newline at end of file
@@ -1,7 +1,8 @@
-from pydantic import BaseModel, Field
-from typing import Optional
+from pydantic import BaseModel, Field, AliasChoices, ValidationError, model_validator
+from typing import Dict, List, Optional
 from datetime import datetime
 from bson import ObjectId
+from app.workouts import from_legacy
 
 class AttendanceBase(BaseModel):
     member_id: str
@@ -17,30 +18,139 @@ class AttendanceCheckout(BaseModel):
 
 class AttendanceResponse(AttendanceBase):
     id: str = Field(alias="_id")
+    # Closed by the stale session sweeper (the member never checked out)
+    auto_closed: bool = False
     
     class Config:
         populate_by_name = True
         json_encoders = {ObjectId: str}
 
 # Workout Plan
-class WorkoutPlanBase(BaseModel):
+class Exercise(BaseModel):
+    name: str = Field(..., min_length=1, max_length=100, validation_alias=AliasChoices("name", "exercise"))
+    sets: Optional[int] = Field(None, ge=1, le=100)
+    reps: Optional[str] = Field(None, max_length=30)  # "12", "8-10", "30 seconds"
+    load_kg: Optional[float] = Field(None, ge=0, le=1000)
+    day: Optional[str] = Field(None, max_length=50)  # "Day 1", "Monday"
+
+def convert_legacy_plan(plan: dict) -> dict:
+    """Exercises and notes of a plan stored with an exercises string.
+    
+    Items that fail validation are dropped; they remain in the notes.
+    """
+    converted = from_legacy(plan)
+    exercises = []
+    for item in converted["exercises"]:
+        try:
+            exercises.append(Exercise.model_validate(item).model_dump())
+        except ValidationError:
+            continue
+    return {"exercises": exercises, "notes": converted.get("notes")}
+
+class LegacyExercises(BaseModel):
+    @model_validator(mode="before")
+    @classmethod
+    def legacy_exercises(cls, data):
+        # Older clients send exercises as one JSON or text string
+        return from_legacy(data) if isinstance(data, dict) else data
+
+class WorkoutPlanBase(LegacyExercises):
     member_id: str
     plan_name: str = Field(..., min_length=2, max_length=100)
-    exercises: str  # JSON string or text describing exercises
+    exercises: List[Exercise] = Field(..., max_length=200)
+    notes: Optional[str] = Field(None, max_length=10000)
     created_date: datetime = Field(default_factory=datetime.now)
     trainer_name: Optional[str] = None
 
 class WorkoutPlanCreate(WorkoutPlanBase):
     pass
 
-class WorkoutPlanUpdate(BaseModel):
+class WorkoutPlanUpdate(LegacyExercises):
     plan_name: Optional[str] = None
-    exercises: Optional[str] = None
+    exercises: Optional[List[Exercise]] = Field(None, max_length=200)
+    notes: Optional[str] = Field(None, max_length=10000)
     trainer_name: Optional[str] = None
 
 class WorkoutPlanResponse(WorkoutPlanBase):
     id: str = Field(alias="_id")
+    template_id: Optional[str] = None
     
     class Config:
         populate_by_name = True
-        json_encoders = {ObjectId: str}
\ No newline at end of file
+        json_encoders = {ObjectId: str}
+
+class TrainerLoadResponse(BaseModel):
+    trainer_name: str
+    plans: int
+    members: int
+    exercises: int
+    total_sets: int
+
+# Workout Templates
+class ExerciseRef(BaseModel):
+    name: str = Field(..., min_length=1, max_length=100)
+    day: Optional[str] = Field(None, max_length=50)
+
+class ExerciseChange(ExerciseRef):
+    sets: Optional[int] = Field(None, ge=1, le=100)
+    reps: Optional[str] = Field(None, max_length=30)
+    load_kg: Optional[float] = Field(None, ge=0, le=1000)
+
+class PlanOverrides(BaseModel):
+    changed: List[ExerciseChange] = []
+    removed: List[ExerciseRef] = []
+    added: List[Exercise] = []
+
+class WorkoutTemplateBase(LegacyExercises):
+    name: str = Field(..., min_length=2, max_length=100)
+    exercises: List[Exercise] = Field(..., max_length=200)
+    notes: Optional[str] = Field(None, max_length=10000)
+    trainer_name: Optional[str] = None
+
+class WorkoutTemplateCreate(WorkoutTemplateBase):
+    pass
+
+class WorkoutTemplateUpdate(LegacyExercises):
+    name: Optional[str] = None
+    exercises: Optional[List[Exercise]] = Field(None, max_length=200)
+    notes: Optional[str] = Field(None, max_length=10000)
+    trainer_name: Optional[str] = None
+
+class WorkoutTemplateResponse(WorkoutTemplateBase):
+    id: str = Field(alias="_id")
+    created_date: datetime
+    updated_date: Optional[datetime] = None
+    
+    class Config:
+        populate_by_name = True
+        json_encoders = {ObjectId: str}
+
+class TemplateAssign(BaseModel):
+    member_ids: List[str] = Field(..., min_length=1, max_length=500)
+    plan_name: Optional[str] = Field(None, min_length=2, max_length=100)  # defaults to the template name
+    trainer_name: Optional[str] = None  # defaults to the template trainer
+
+class TemplateAssignResponse(BaseModel):
+    template_id: str
+    assigned: int
+    already_assigned: List[str]
+
+class CompactWorkoutPlan(BaseModel):
+    """Plan as stored: template plans carry overrides instead of exercises"""
+    id: str = Field(alias="_id")
+    member_id: str
+    plan_name: str
+    template_id: Optional[str] = None
+    exercises: Optional[List[Exercise]] = None
+    overrides: Optional[PlanOverrides] = None
+    notes: Optional[str] = None
+    created_date: datetime
+    trainer_name: Optional[str] = None
+    
+    class Config:
+        populate_by_name = True
+
+class WorkoutPlanListResponse(BaseModel):
+    plans: List[CompactWorkoutPlan]
+    # Each referenced template once, by id
+    templates: Dict[str, WorkoutTemplateResponse]
@@ -0,0 +1,19 @@
+from pydantic import BaseModel, Field
+from typing import Literal, Optional
+from datetime import datetime
+
+class JobCreate(BaseModel):
+    report: Literal["yearly_revenue", "attendance_summary", "attendance_export"]
+    year: Optional[int] = Field(None, ge=2000, le=2100)
+    start_date: Optional[str] = None  # YYYY-MM-DD
+    end_date: Optional[str] = None  # YYYY-MM-DD
+
+class JobResponse(BaseModel):
+    job_id: str
+    report: str
+    status: str
+    progress: float
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
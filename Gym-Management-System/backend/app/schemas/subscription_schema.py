@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
 from bson import ObjectId
 
@@ -44,4 +44,26 @@ class MemberSubscriptionResponse(MemberSubscriptionBase):
     
     class Config:
         populate_by_name = True
-        json_encoders = {ObjectId: str}
\ No newline at end of file
+        json_encoders = {ObjectId: str}
+
+# Bulk operations (corporate enrollment, group renewals)
+class BulkEnrollment(BaseModel):
+    member_ids: List[str] = Field(..., min_length=1, max_length=1000)
+    plan_id: str
+    payment_mode: str = Field(..., pattern="^(Cash|Card|UPI|Net Banking)$")
+    start_date: datetime = Field(default_factory=datetime.now)
+
+class BulkRenewal(BaseModel):
+    member_ids: List[str] = Field(..., min_length=1, max_length=1000)
+    plan_id: Optional[str] = None  # defaults to each member's previous plan
+
+class BulkMemberResult(BaseModel):
+    member_id: str
+    status: str  # enrolled / renewed, or skipped
+    subscription_id: Optional[str] = None
+    detail: Optional[str] = None
+
+class BulkSubscriptionResponse(BaseModel):
+    succeeded: int
+    skipped: int
+    results: List[BulkMemberResult]
\ No newline at end of file
@@ -0,0 +1,142 @@
+"""Closes attendance sessions that were never checked out.
+
+Members who forget to scan out would otherwise stay "in the gym" forever.
+Every ATTENDANCE_SWEEP_INTERVAL_SECONDS the sweeper closes the open sessions
+that are older than ATTENDANCE_MAX_SESSION_HOURS or were checked in on a past
+day. A session is closed after the maximum duration, at the latest at the end
+of its check-in day, and marked with auto_closed / auto_closed_at.
+
+Every worker starts a sweeper, but only the one holding the
+"session-sweeper" lease (app/leases.py) sweeps; the others take over if it
+dies. Stale sessions are found through the open-session index (the partial
+open_sessions_by_check_in index, or attendance_open for buckets) and closed
+with one unordered bulk_write per collection. Each update only matches a
+session that is still open and stamps it with the run's sweep_id, and the
+member counters (total_minutes) are incremented only for the sessions
+carrying it, so a check-out (or a sweep after a lease handover) racing it
+wins cleanly. Occupancy and the rollups read the closed intervals like any
+other check-out.
+
+Sessions held by the write-behind buffer are closed through the buffer.
+"""
+import logging
+import threading
+import uuid
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from typing import Optional
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+from app.config import settings
+from app import database, http_cache, metrics
+from app.database import scope_filter
+from app.branches import all_branches
+from app.attendance_store import attendance_store
+from app.attendance_stats import check_out_update
+from app.attendance_buffer import attendance_buffer
+from app.leases import Lease
+
+logger = logging.getLogger(__name__)
+
+def closing_time(visit: dict, max_duration: timedelta) -> datetime:
+    """The check-out recorded for a stale session"""
+    end_of_day = datetime.combine(visit["check_in_time"].date(), time.max)
+    return min(visit["check_in_time"] + max_duration, end_of_day)
+
+def _stats_op(visit: dict) -> UpdateOne:
+    filter = {"_id": visit["member_id"]}
+    if visit.get("branch_id") is not None:
+        filter = scope_filter(filter, visit["branch_id"])
+    return UpdateOne(filter, check_out_update(visit))
+
+def sweep(now: Optional[datetime] = None) -> int:
+    """Close stale open sessions in every branch; returns how many were closed"""
+    now = now or datetime.now()
+    max_duration = timedelta(hours=settings.attendance_max_session_hours)
+    # Older than the maximum, or checked in before today
+    started_before = max(now - max_duration, datetime.combine(now.date(), time.min))
+    sweep_id = uuid.uuid4().hex
+
+    with all_branches():
+        stale = attendance_store.find_open(started_before)
+        if not stale:
+            return 0
+
+        closed = 0
+        ops = defaultdict(list)
+        for visit in stale:
+            checkout_time = closing_time(visit, max_duration)
+            if attendance_buffer.holds(visit["_id"]):
+                # Written (with its counters) by the next flush
+                if attendance_buffer.check_out(visit["_id"], checkout_time, now, sweep_id):
+                    closed += 1
+                continue
+            for name, op in attendance_store.check_out_ops(visit, checkout_time, now, sweep_id):
+                ops[name].append(op)
+
+        if ops:
+            db = database.get_database()
+            # In the order the store returns them (the session before its guard)
+            for name, requests in ops.items():
+                db[name].bulk_write(requests, ordered=False)
+
+            # Only the sessions this sweep closed; others were checked out meanwhile
+            swept = attendance_store.find({
+                "member_id": {"$in": list({visit["member_id"] for visit in stale})},
+                "_id": {"$in": [visit["_id"] for visit in stale]},
+                "sweep_id": sweep_id
+            })
+            if swept:
+                db["member_attendance_stats"].bulk_write([_stats_op(visit) for visit in swept], ordered=False)
+            closed += len(swept)
+
+    if closed:
+        http_cache.bump("attendance")
+        metrics.inc("attendance_sessions_auto_closed_total", closed)
+        logger.info("Closed %d stale attendance sessions", closed)
+    return closed
+
+class SessionSweeper:
+    def __init__(self):
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.lease = Lease("session-sweeper")
+
+    def start(self):
+        self.lease.start()
+        self.thread = threading.Thread(target=self._run, name="session-sweeper", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+        self.lease.stop()
+
+    def _run(self):
+        # First sweep as soon as the lease is taken, so sessions left over
+        # from downtime are closed
+        while not self.stop_event.is_set():
+            if not self.lease.held:
+                self.stop_event.wait(self.lease.renew_seconds)
+                continue
+            try:
+                sweep()
+            except PyMongoError:
+                logger.exception("Stale session sweep failed")
+                metrics.inc("attendance_sweep_errors_total")
+            self.stop_event.wait(settings.attendance_sweep_interval_seconds)
+
+# One sweeper per worker process, started by the lifespan; one of them sweeps
+sweeper: Optional[SessionSweeper] = None
+
+def start_sweeper():
+    global sweeper
+    if settings.attendance_sweep_enabled and sweeper is None:
+        sweeper = SessionSweeper()
+        sweeper.start()
+
+def stop_sweeper():
+    global sweeper
+    if sweeper is not None:
+        sweeper.stop()
+        sweeper = None
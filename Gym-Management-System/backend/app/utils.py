@@ -1,7 +1,9 @@
 from bson import ObjectId
 from fastapi import HTTPException
-from app.database import members_collection, plans_collection
+from app.database import members_collection
+from app.plan_catalog import plan_catalog
 from datetime import datetime
+from dateutil.relativedelta import relativedelta
 
 def validate_object_id(id: str, field_name: str = "ID") -> ObjectId:
     """Validate if string is a valid MongoDB ObjectId"""
@@ -19,8 +21,8 @@ def check_member_exists(member_id: str) -> dict:
 
 def check_plan_exists(plan_id: str) -> dict:
     """Check if subscription plan exists and return plan data"""
-    obj_id = validate_object_id(plan_id, "Plan ID")
-    plan = plans_collection.find_one({"_id": obj_id})
+    validate_object_id(plan_id, "Plan ID")
+    plan = plan_catalog.get_plan(plan_id)
     if not plan:
         raise HTTPException(status_code=404, detail="Subscription plan not found")
     return plan
@@ -48,5 +50,4 @@ def validate_phone_number(phone: str):
 
 def calculate_subscription_end_date(start_date: datetime, duration_months: int) -> datetime:
     """Calculate end date based on start date and duration"""
-    from dateutil.relativedelta import relativedelta
     return start_date + relativedelta(months=duration_months)
\ No newline at end of file
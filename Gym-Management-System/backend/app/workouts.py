@@ -0,0 +1,144 @@
+"""Workout plan exercises.
+
+Plans store exercises as sub-documents so they can be indexed and queried:
+
+    {"name": "Squats", "sets": 4, "reps": "8-10", "load_kg": 60, "day": "DAY 2 - LOWER BODY"}
+
+Older plans (and clients still sending the text form) have a single string,
+either a JSON list or free text in the format of the frontend templates.
+parse_exercises() turns either into sub-documents; free text lines that are
+not an exercise ("WARM-UP: 10 minutes", notes) are kept in the plan notes.
+"""
+import json
+import re
+from typing import List
+
+# "1. Squats: 3 sets x 12 reps", "- Bench Press: 4x8 @ 60kg", "Ab Work: 4 sets"
+EXERCISE_LINE = re.compile(
+    r"^(?:\d+[.)]|[-*•])?\s*(?P<name>[A-Za-z][^:]{0,99}?)\s*:\s*"
+    r"(?P<sets>\d+)\s*(?:sets?\b\s*(?:[x×]\s*(?P<reps>.+))?|[x×]\s*(?P<short_reps>.+))\s*$",
+    re.IGNORECASE
+)
+DAY_HEADER = re.compile(r"^(?:day\s+\d|(?:mon|tues|wednes|thurs|fri|satur|sun)day\b)", re.IGNORECASE)
+LOAD = re.compile(r"@?\s*(\d+(?:\.\d+)?)\s*kg\b", re.IGNORECASE)
+
+def _parse_line(line: str, day: str):
+    match = EXERCISE_LINE.match(line)
+    if not match:
+        return None
+
+    reps = match.group("reps") or match.group("short_reps") or ""
+    exercise = {"name": " ".join(match.group("name").split()), "sets": int(match.group("sets"))}
+
+    load = LOAD.search(reps)
+    if load:
+        exercise["load_kg"] = float(load.group(1))
+        reps = LOAD.sub("", reps)
+    reps = " ".join(re.sub(r"\breps?\b", "", reps, flags=re.IGNORECASE).split())
+    if reps:
+        exercise["reps"] = reps[:30]
+    if day:
+        exercise["day"] = day
+    return exercise
+
+def parse_exercise_text(text: str) -> List[dict]:
+    """Exercises found in template-style free text"""
+    exercises = []
+    day = None
+    for raw in text.splitlines():
+        line = raw.strip()
+        if not line:
+            continue
+        if DAY_HEADER.match(line):
+            day = line[:50]
+            continue
+        exercise = _parse_line(line, day)
+        if exercise:
+            exercises.append(exercise)
+    return exercises
+
+def parse_exercises(text: str) -> List[dict]:
+    """Exercises from the legacy string form (JSON list or free text)"""
+    try:
+        parsed = json.loads(text)
+    except ValueError:
+        return parse_exercise_text(text)
+
+    if not isinstance(parsed, list):
+        return parse_exercise_text(text)
+    exercises = []
+    for item in parsed:
+        if isinstance(item, str):
+            exercises.append({"name": item})
+        elif isinstance(item, dict):
+            exercises.append(item)
+    return exercises
+
+def from_legacy(data: dict) -> dict:
+    """Convert a plan (or update) whose exercises are still a string.
+
+    The original text is kept as the plan notes, so nothing the parser
+    skips is lost.
+    """
+    text = data.get("exercises")
+    if not isinstance(text, str):
+        return data
+    converted = {**data, "exercises": parse_exercises(text)}
+    if not data.get("notes"):
+        converted["notes"] = text
+    return converted
+
+# ============ TEMPLATES ============
+# A plan assigned from a template stores only its differences from the
+# template (overrides), so template edits reach every member and the
+# exercises are stored once:
+#
+#     {"changed": [{"name": "Squats", "day": "DAY 2", "load_kg": 80}],
+#      "removed": [{"name": "Leg Press", "day": "DAY 2"}],
+#      "added": [{"name": "Hip Thrust", "sets": 3, "reps": "10"}]}
+#
+# Template exercises are matched on name and day, case-insensitively.
+
+CHANGEABLE = ("sets", "reps", "load_kg")
+
+def exercise_key(exercise: dict) -> tuple:
+    return exercise["name"].lower(), (exercise.get("day") or "").lower()
+
+def apply_overrides(exercises: List[dict], overrides: dict) -> List[dict]:
+    """A member's exercises: the template's with the plan overrides applied"""
+    overrides = overrides or {}
+    changed = {exercise_key(change): change for change in overrides.get("changed", [])}
+    removed = {exercise_key(ref) for ref in overrides.get("removed", [])}
+
+    resolved = []
+    for exercise in exercises:
+        key = exercise_key(exercise)
+        if key in removed:
+            continue
+        change = changed.get(key)
+        if change:
+            exercise = {**exercise, **{field: change[field] for field in CHANGEABLE if change.get(field) is not None}}
+        resolved.append(exercise)
+    return resolved + list(overrides.get("added", []))
+
+def diff_exercises(template_exercises: List[dict], exercises: List[dict]) -> dict:
+    """Overrides turning the template's exercises into `exercises`"""
+    template = {exercise_key(exercise): exercise for exercise in template_exercises}
+    changed, added = [], []
+    kept = set()
+    for exercise in exercises:
+        key = exercise_key(exercise)
+        base = template.get(key)
+        if base is None or key in kept:
+            added.append(exercise)
+            continue
+        kept.add(key)
+        fields = {field: exercise.get(field) for field in CHANGEABLE if exercise.get(field) != base.get(field)}
+        if fields:
+            changed.append({"name": base["name"], "day": base.get("day"), **fields})
+
+    removed = [
+        {"name": exercise["name"], "day": exercise.get("day")}
+        for key, exercise in template.items() if key not in kept
+    ]
+    return {"changed": changed, "removed": removed, "added": added}
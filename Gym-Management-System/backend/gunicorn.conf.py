@@ -0,0 +1,24 @@
+# Production server profile: gunicorn managing uvicorn workers.
+# Run with: gunicorn app.main:app -c gunicorn.conf.py
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+
+# One worker per core by default. Each worker opens its own MongoDB pool
+# (MONGODB_MAX_POOL_SIZE connections at most), so size the server for
+# workers * MONGODB_MAX_POOL_SIZE connections.
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+# Workers inherit it, so the app knows it is one of several (write-behind refuses to start)
+os.environ["WEB_CONCURRENCY"] = str(workers)
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# The app is imported after fork so no MongoClient is shared between workers
+preload_app = False
+
+timeout = int(os.getenv("WORKER_TIMEOUT", "60"))
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+keepalive = 5
+
+accesslog = "-"
+errorlog = "-"
@@ -0,0 +1,31 @@
+"""Move old attendance and expired subscriptions to the archive tier now.
+
+Run from the backend folder (e.g. from cron instead of ARCHIVE_ENABLED):
+
+    python -m scripts.archive_history
+    python -m scripts.archive_history --no-wait   # no API workers running
+
+Retention windows come from ARCHIVE_ATTENDANCE_MONTHS and
+ARCHIVE_SUBSCRIPTIONS_MONTHS. When a boundary moves, the run waits for the
+API workers to pick it up before moving records (see app/archive.py).
+"""
+import argparse
+import time
+from app import database
+from app.archive import run_archive, BOUNDARY_TTL_SECONDS
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive old attendance and subscriptions")
+    parser.add_argument("--no-wait", action="store_true", help="don't wait for workers to see new boundaries")
+    args = parser.parse_args()
+
+    database.connect()
+    started = time.perf_counter()
+    moved = run_archive(settle_seconds=0 if args.no_wait else BOUNDARY_TTL_SECONDS)
+    for name, count in moved.items():
+        print(f"{name}: {count} records archived")
+    print(f"Done in {time.perf_counter() - started:.1f}s")
+    database.close()
+
+if __name__ == "__main__":
+    main()
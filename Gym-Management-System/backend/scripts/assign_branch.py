@@ -0,0 +1,48 @@
+"""Assign existing data to a branch.
+
+Documents created before multi-branch support have no branch_id, so
+branch-scoped requests don't see them. Run once from the backend folder
+after upgrading (the default branch is DEFAULT_BRANCH):
+
+    python -m scripts.assign_branch
+    python -m scripts.assign_branch --branch downtown
+
+Safe to re-run: only documents without a branch_id are updated.
+"""
+import argparse
+from app import database
+from app.config import settings
+
+COLLECTIONS = [
+    "members",
+    "subscriptions",
+    "subscription_plans",
+    "member_subscriptions",
+    "attendance",
+    "attendance_buckets",
+    "attendance_open",
+    "member_attendance_stats",
+    "workout_plans",
+    "jobs",
+    "users"
+]
+
+def main():
+    parser = argparse.ArgumentParser(description="Assign documents without a branch to a branch")
+    parser.add_argument("--branch", default=settings.default_branch)
+    args = parser.parse_args()
+
+    database.connect()
+    db = database.get_database()
+    for name in COLLECTIONS:
+        result = db[name].update_many(
+            {"branch_id": {"$exists": False}},
+            {"$set": {"branch_id": args.branch}}
+        )
+        print(f"{name:<25} {result.modified_count} documents assigned to '{args.branch}'")
+    # Indexes leading on branch_id
+    database.create_indexes()
+    database.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""Back up and restore the application's collections.
+
+Run from the backend folder:
+
+    python -m scripts.backup dump backups/2024-06-01
+    python -m scripts.backup dump backups/2024-06-01 --jobs 8 --collections attendance members
+    python -m scripts.backup restore backups/2024-06-01 --drop
+
+dump writes one gzip-compressed BSON file per collection (documents back to
+back, as mongodump writes them) plus manifest.json with the counts,
+collection options and index definitions. Collections are dumped in parallel
+and streamed straight from the cursor into the compressor.
+
+On a replica set every collection is read at the same majority-committed
+cluster time (snapshot read concern), so the backup is one consistent point
+in time even while the API keeps writing. The whole dump has to finish
+within the server's minSnapshotHistoryWindowInSeconds (300s by default;
+raise it for large databases). A standalone server has no snapshots: the
+dump is taken collection by collection and reported as not consistent.
+
+restore creates each collection with its original options (e.g. the zstd
+archive collections), loads it with unordered insert_many chunks, and only
+then builds the indexes, which is much faster than maintaining them during
+the load. Throughput is reported in documents per second.
+"""
+import argparse
+import gzip
+import io
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from bson import json_util, decode_file_iter
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from pymongo import IndexModel
+from app import database
+
+COLLECTIONS = [
+    "members", "users", "subscription_plans", "member_subscriptions",
+    "workout_plans", "workout_templates",
+    # Attendance in either layout, its counters and the archive tier
+    "attendance", "attendance_buckets", "attendance_open", "member_attendance_stats",
+    "attendance_archive", "attendance_buckets_archive", "member_subscriptions_archive",
+    "archive_totals", "archive_state"
+]
+# Documents are copied as raw BSON, never decoded
+RAW = CodecOptions(document_class=RawBSONDocument)
+BATCH_SIZE = 10000
+WRITE_BUFFER = 1 << 20
+
+def _rate(count: int, seconds: float) -> str:
+    return f"{count} docs in {seconds:.1f}s ({count / max(seconds, 1e-6):,.0f} docs/s)"
+
+# ============ DUMP ============
+
+def snapshot_time(db):
+    """Majority-committed cluster time to read every collection at (None on a standalone)"""
+    hello = db.command("hello")
+    return hello.get("lastWrite", {}).get("majorityOpTime", {}).get("ts")
+
+def dump_collection(db, name: str, folder: str, at, level: int) -> dict:
+    started = time.perf_counter()
+    if at is not None:
+        cursor = db.cursor_command({
+            "find": name,
+            "filter": {},
+            "batchSize": BATCH_SIZE,
+            "readConcern": {"level": "snapshot", "atClusterTime": at}
+        }, codec_options=RAW)
+    else:
+        cursor = db.get_collection(name, codec_options=RAW).find(batch_size=BATCH_SIZE)
+
+    count = 0
+    with gzip.open(os.path.join(folder, f"{name}.bson.gz"), "wb", compresslevel=level) as compressed:
+        out = io.BufferedWriter(compressed, WRITE_BUFFER)
+        for document in cursor:
+            out.write(document.raw)
+            count += 1
+        out.flush()
+
+    seconds = time.perf_counter() - started
+    # One write per line, so parallel collections don't interleave
+    sys.stdout.write(f"  {name:<30} {_rate(count, seconds)}\n")
+    return {"count": count, "seconds": round(seconds, 2)}
+
+def dump(folder: str, names: list, jobs: int, level: int):
+    db = database.get_database()
+    os.makedirs(folder, exist_ok=True)
+    existing = {info["name"]: info.get("options", {}) for info in db.list_collections()}
+    names = [name for name in names if name in existing]
+    at = snapshot_time(db)
+    print(f"Dumping {len(names)} collections to {folder} "
+          f"({'consistent at ' + str(at.as_datetime()) if at else 'standalone server, not a consistent snapshot'})")
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(jobs) as pool:
+        results = dict(zip(names, pool.map(lambda name: dump_collection(db, name, folder, at, level), names)))
+
+    manifest = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "cluster_time": at,
+        "collections": {
+            name: {
+                **results[name],
+                "options": existing[name],
+                "indexes": [index for index in db[name].list_indexes() if index["name"] != "_id_"]
+            }
+            for name in names
+        }
+    }
+    with open(os.path.join(folder, "manifest.json"), "w") as f:
+        f.write(json_util.dumps(manifest, indent=2))
+
+    total = sum(result["count"] for result in results.values())
+    print(f"Dumped {_rate(total, time.perf_counter() - started)}")
+
+# ============ RESTORE ============
+
+def index_model(spec: dict) -> IndexModel:
+    options = {key: value for key, value in spec.items() if key not in ("v", "key", "ns")}
+    return IndexModel(list(spec["key"].items()), **options)
+
+def restore_collection(db, name: str, folder: str, info: dict, chunk_size: int) -> int:
+    started = time.perf_counter()
+    if info["options"]:
+        db.create_collection(name, **info["options"])
+    collection = db[name]
+
+    count = 0
+    with gzip.open(os.path.join(folder, f"{name}.bson.gz"), "rb") as f:
+        chunk = []
+        for document in decode_file_iter(f, codec_options=RAW):
+            chunk.append(document)
+            if len(chunk) == chunk_size:
+                collection.insert_many(chunk, ordered=False, bypass_document_validation=True)
+                count += len(chunk)
+                chunk = []
+        if chunk:
+            collection.insert_many(chunk, ordered=False, bypass_document_validation=True)
+            count += len(chunk)
+    loaded = time.perf_counter() - started
+
+    # Built once over the loaded data
+    if info["indexes"]:
+        collection.create_indexes([index_model(spec) for spec in info["indexes"]])
+    seconds = time.perf_counter() - started
+    sys.stdout.write(f"  {name:<30} {_rate(count, loaded)}, indexes {seconds - loaded:.1f}s\n")
+    return count
+
+def restore(folder: str, names: list, jobs: int, chunk_size: int, drop: bool):
+    db = database.get_database()
+    with open(os.path.join(folder, "manifest.json")) as f:
+        manifest = json_util.loads(f.read())
+    collections = {name: info for name, info in manifest["collections"].items() if name in names}
+
+    existing = set(db.list_collection_names()) & set(collections)
+    occupied = [name for name in sorted(existing) if db[name].estimated_document_count()]
+    if occupied and not drop:
+        raise SystemExit(f"Not empty: {', '.join(occupied)}; pass --drop to replace them")
+    # Recreated with their original options and indexes
+    for name in existing:
+        db.drop_collection(name)
+
+    print(f"Restoring {len(collections)} collections from {folder} (backup of {manifest['created_at']})")
+    started = time.perf_counter()
+    # Largest first, so the longest load starts right away
+    order = sorted(collections, key=lambda name: collections[name]["count"], reverse=True)
+    with ThreadPoolExecutor(jobs) as pool:
+        counts = list(pool.map(lambda name: restore_collection(db, name, folder, collections[name], chunk_size), order))
+    print(f"Restored {_rate(sum(counts), time.perf_counter() - started)}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Back up and restore the database")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    dump_parser = commands.add_parser("dump", help="write a backup folder")
+    dump_parser.add_argument("folder")
+    dump_parser.add_argument("--level", type=int, default=6, help="gzip level (1 fastest, 9 smallest)")
+
+    restore_parser = commands.add_parser("restore", help="load a backup folder")
+    restore_parser.add_argument("folder")
+    restore_parser.add_argument("--chunk-size", type=int, default=1000, help="documents per insert_many")
+    restore_parser.add_argument("--drop", action="store_true", help="replace collections that have data")
+
+    for command in (dump_parser, restore_parser):
+        command.add_argument("--jobs", type=int, default=4, help="collections processed in parallel")
+        command.add_argument("--collections", nargs="+", default=COLLECTIONS, metavar="NAME")
+    args = parser.parse_args()
+
+    database.connect()
+    try:
+        if args.command == "dump":
+            dump(args.folder, args.collections, args.jobs, args.level)
+        else:
+            restore(args.folder, args.collections, args.jobs, args.chunk_size, args.drop)
+    finally:
+        database.close()
+
+if __name__ == "__main__":
+    main()
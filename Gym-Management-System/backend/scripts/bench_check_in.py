@@ -0,0 +1,111 @@
+"""Benchmark check-in/check-out throughput, direct writes vs write-behind.
+
+Run from the backend folder against the configured database (it writes to a
+throwaway branch and removes it afterwards):
+
+    python -m scripts.bench_check_in
+    python -m scripts.bench_check_in --scans 20000 --members 2000 --threads 16
+
+Each visit is a check-in followed by its check-out (two scans).
+"direct" writes each one in its own transaction like the API does by
+default; "write-behind" acknowledges from memory and flushes in batches.
+Reported: acknowledged scans per second and acknowledgement latency
+percentiles, plus the time until the last buffered scan reached the database.
+"""
+import argparse
+import os
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from app import database
+from app.database import run_in_transaction
+from app.branches import branch_scope
+from app.attendance_store import attendance_store, new_visit
+from app.attendance_stats import record_check_in, record_check_out
+from app.attendance_buffer import AttendanceBuffer
+
+COLLECTIONS = ["attendance", "attendance_buckets", "attendance_open", "member_attendance_stats"]
+
+def direct_check_in(member_id: str) -> dict:
+    visit = new_visit(member_id, datetime.now())
+    def record(session):
+        attendance_store.check_in(visit, session=session)
+        record_check_in(visit, session=session)
+    run_in_transaction(record)
+    return visit
+
+def direct_check_out(visit: dict):
+    def record(session):
+        updated = attendance_store.check_out(visit["_id"], datetime.now(), session=session)
+        record_check_out(updated, session=session)
+    run_in_transaction(record)
+
+def run(label: str, branch: str, members: list, scans: int, threads: int, check_in, check_out):
+    latencies = []
+
+    def scan(i: int):
+        with branch_scope(branch):
+            member_id = members[i % len(members)]
+            started = time.perf_counter()
+            visit = check_in(member_id)
+            latencies.append(time.perf_counter() - started)
+            started = time.perf_counter()
+            check_out(visit)
+            latencies.append(time.perf_counter() - started)
+
+    # Each thread owns a slice of the members, so a member is never checked in twice
+    def worker(offset: int):
+        for i in range(offset, scans // 2, threads):
+            scan(i)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(worker, range(threads)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+    print(f"{label:<13} {len(latencies) / elapsed:>9.0f} scans/s   p50 {p50:.2f}ms   p99 {p99:.2f}ms")
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark check-in throughput")
+    parser.add_argument("--scans", type=int, default=10000, help="check-ins plus check-outs")
+    parser.add_argument("--members", type=int, default=1000)
+    parser.add_argument("--threads", type=int, default=8, help="concurrent scans (request threads)")
+    args = parser.parse_args()
+    # A multiple of the thread count, so threads never share a member
+    args.members = max(args.members // args.threads, 1) * args.threads
+
+    database.connect()
+    database.create_indexes()
+    branch = f"bench-{uuid.uuid4().hex[:8]}"
+    members = [f"bench-member-{i}" for i in range(args.members)]
+    try:
+        run("direct", branch, members, args.scans, args.threads, direct_check_in, direct_check_out)
+
+        spill = os.path.join(tempfile.mkdtemp(), "bench_spill.jsonl")
+        buffer = AttendanceBuffer(attendance_store, spill)
+        buffer.start()
+
+        def buffered_check_in(member_id: str) -> dict:
+            visit = new_visit(member_id, datetime.now())
+            buffer.check_in(visit)
+            return visit
+
+        elapsed = run("write-behind", branch, members, args.scans, args.threads,
+                      buffered_check_in, lambda visit: buffer.check_out(visit["_id"], datetime.now()))
+        started = time.perf_counter()
+        buffer.stop()
+        print(f"{'':<13} last scan written {(elapsed + time.perf_counter() - started) * 1000:.0f}ms after the first")
+    finally:
+        db = database.get_database()
+        for name in COLLECTIONS:
+            db[name].delete_many({"branch_id": branch})
+        database.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Benchmark the cohort analytics at scale.
+
+Run from the backend folder against the configured database (it seeds a
+throwaway branch and removes it afterwards):
+
+    python -m scripts.bench_cohorts
+    python -m scripts.bench_cohorts --members 100000 --months 24 --repeat 5
+
+Seeds members who joined over the last --months months, their attendance
+counters (member_attendance_stats, as check-ins maintain them) and a
+subscription each, then times the three queries behind
+/analytics/cohorts/* in that branch. Reported per query: best and median of
+--repeat runs, and whether the median stays under the one second target.
+"""
+import argparse
+import random
+import time
+import uuid
+from datetime import datetime
+from dateutil.relativedelta import relativedelta
+from app import database, cohorts
+from app.branches import branch_scope
+from app.plan_catalog import plan_catalog
+
+COLLECTIONS = ["members", "member_subscriptions", "member_attendance_stats", "subscription_plans"]
+BATCH = 10000
+TARGET_SECONDS = 1.0
+# Plan lengths in months
+DURATIONS = (1, 3, 6, 12)
+
+def seed(db, branch: str, members: int, months: int, rng: random.Random):
+    """Insert `members` members with counters and subscriptions"""
+    now = datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    plan_ids = [str(plan_id) for plan_id in db.subscription_plans.insert_many([
+        {"plan_name": f"Bench {duration}m", "duration_months": duration, "price": 30.0 * duration, "branch_id": branch}
+        for duration in DURATIONS
+    ]).inserted_ids]
+
+    for start in range(0, members, BATCH):
+        member_docs, stats_docs, subscription_docs = [], [], []
+        for _ in range(start, min(start + BATCH, members)):
+            join_date = now - relativedelta(months=rng.randrange(months), days=-rng.randrange(28))
+            plan = rng.randrange(len(plan_ids))
+            end_date = join_date + relativedelta(months=DURATIONS[plan])
+            status = "active" if end_date > datetime.now() or rng.random() < 0.3 else "expired"
+            member = {
+                "name": "Bench", "email": f"{uuid.uuid4().hex}@example.com", "status": status,
+                "join_date": join_date, "branch_id": branch
+            }
+            member_docs.append(member)
+
+            # Visits taper off after joining, and some members never come back
+            monthly, visits = {}, rng.randint(4, 16)
+            month = join_date
+            while month <= now and visits > 0:
+                monthly[month.strftime("%Y-%m")] = visits
+                visits = int(visits * rng.uniform(0.5, 1.1))
+                month += relativedelta(months=1)
+            stats_docs.append((member, monthly))
+
+            subscription_docs.append((member, {
+                "plan_id": plan_ids[plan], "start_date": join_date, "end_date": end_date,
+                "payment_amount": 30.0 * DURATIONS[plan], "payment_mode": "Card", "payment_date": join_date,
+                "status": status, "renewal_count": rng.choice((0, 0, 1, 2)), "branch_id": branch
+            }))
+
+        db.members.insert_many(member_docs)
+        db.member_attendance_stats.insert_many([
+            {
+                "_id": str(member["_id"]), "branch_id": branch, "join_month": member["join_date"].strftime("%Y-%m"),
+                "total_visits": sum(monthly.values()), "total_minutes": 60.0 * sum(monthly.values()),
+                "first_visit": member["join_date"], "last_visit": member["join_date"], "monthly": monthly
+            }
+            for member, monthly in stats_docs if monthly
+        ])
+        db.member_subscriptions.insert_many([
+            {**subscription, "member_id": str(member["_id"])} for member, subscription in subscription_docs
+        ])
+
+def timed(call, repeat: int) -> list:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        call()
+        timings.append(time.perf_counter() - started)
+    return sorted(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark cohort analytics")
+    parser.add_argument("--members", type=int, default=100000)
+    parser.add_argument("--months", type=int, default=24, help="join months to spread members over")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    database.connect()
+    database.create_indexes()
+    db = database.get_database()
+    branch = f"bench-{uuid.uuid4().hex[:8]}"
+    start_month = (datetime.now() - relativedelta(months=args.months - 1)).strftime("%Y-%m")
+    queries = [
+        ("retention", lambda: cohorts.retention(start_month, 12)),
+        ("renewal-rate", cohorts.renewal_rates),
+        ("visit-decay", lambda: cohorts.visit_decay(6, 12))
+    ]
+    try:
+        started = time.perf_counter()
+        seed(db, branch, args.members, args.months, random.Random(args.seed))
+        plan_catalog.refresh()
+        print(f"Seeded {args.members} members over {args.months} months in {time.perf_counter() - started:.1f}s")
+
+        with branch_scope(branch):
+            for name, call in queries:
+                timings = timed(call, args.repeat)
+                median = timings[len(timings) // 2]
+                verdict = "ok" if median < TARGET_SECONDS else "SLOW"
+                print(f"{name:<13} best {timings[0] * 1000:>7.0f}ms   median {median * 1000:>7.0f}ms   {verdict}")
+    finally:
+        for name in COLLECTIONS:
+            db[name].delete_many({"branch_id": branch})
+        plan_catalog.refresh()
+        database.close()
+
+if __name__ == "__main__":
+    main()
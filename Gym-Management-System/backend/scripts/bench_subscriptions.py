@@ -0,0 +1,128 @@
+"""Benchmark the transactional subscription lifecycle.
+
+Run from the backend folder against the configured database (it writes to a
+throwaway branch and removes it afterwards):
+
+    python -m scripts.bench_subscriptions
+    python -m scripts.bench_subscriptions --cycles 5000 --members 200 --threads 16
+
+Each cycle runs the subscription route handlers for one member: create,
+expire, renew, expire (four member + subscription writes). Threads share
+the members, so some creates lose the race to a concurrent one and are
+rejected like they would be in the API.
+
+"transactions" runs every step in a multi-document transaction (needs a
+replica set, skipped otherwise); "single writes" runs the same steps with
+MONGODB_TRANSACTIONS=False. Reported: completed steps per second, step
+latency percentiles, rejected steps, and members whose status disagrees with
+their subscriptions afterwards (must be 0).
+"""
+import argparse
+import asyncio
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from bson import ObjectId
+from fastapi import HTTPException
+from pymongo.topology_description import TOPOLOGY_TYPE
+from app import database
+from app.config import settings
+from app.branches import branch_scope
+from app.plan_catalog import plan_catalog
+from app.schemas.subscription_schema import MemberSubscriptionCreate
+from app.routes.subscription_routes import create_member_subscription, renew_subscription, expire_subscription
+
+COLLECTIONS = ["members", "member_subscriptions", "subscription_plans"]
+PLAN_PRICE = 49.0
+
+def lifecycle(member_id: str, plan_id: str) -> list:
+    """One cycle's (step, latency) pairs; rejected steps have no latency"""
+    steps = []
+
+    def step(name: str, handler, *args):
+        started = time.perf_counter()
+        try:
+            result = asyncio.run(handler(*args))
+        except HTTPException:
+            steps.append((name, None))
+            return None
+        steps.append((name, time.perf_counter() - started))
+        return result
+
+    now = datetime.now()
+    created = step("create", create_member_subscription, MemberSubscriptionCreate(
+        member_id=member_id, plan_id=plan_id, start_date=now, end_date=now + timedelta(days=30),
+        payment_amount=PLAN_PRICE, payment_mode="Card"
+    ))
+    if created:
+        step("expire", expire_subscription, created["_id"])
+        step("renew", renew_subscription, created["_id"])
+        step("expire", expire_subscription, created["_id"])
+    return steps
+
+def divergent_members(member_ids: list) -> int:
+    """Members whose status disagrees with having an active subscription"""
+    active = set(database.member_subscriptions_collection.distinct("member_id", {"status": "active"}))
+    members = database.members_collection.find({"_id": {"$in": [ObjectId(m) for m in member_ids]}})
+    return sum((member["status"] == "active") != (str(member["_id"]) in active) for member in members)
+
+def run(label: str, branch: str, plan_id: str, member_ids: list, cycles: int, threads: int):
+    def cycle(i: int):
+        with branch_scope(branch):
+            return lifecycle(member_ids[i % len(member_ids)], plan_id)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        steps = [step for result in pool.map(cycle, range(cycles)) for step in result]
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for _, latency in steps if latency is not None)
+    rejected = len(steps) - len(latencies)
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+    with branch_scope(branch):
+        divergent = divergent_members(member_ids)
+    print(f"{label:<14} {len(latencies) / elapsed:>7.0f} steps/s   p50 {p50:.2f}ms   p99 {p99:.2f}ms   "
+          f"{rejected} rejected   {divergent} divergent members")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the subscription lifecycle")
+    parser.add_argument("--cycles", type=int, default=2000, help="create/expire/renew/expire cycles")
+    parser.add_argument("--members", type=int, default=100)
+    parser.add_argument("--threads", type=int, default=8, help="concurrent requests")
+    args = parser.parse_args()
+
+    client = database.connect()
+    database.create_indexes()
+    client.admin.command("ping")
+    replica_set = client.topology_description.topology_type == TOPOLOGY_TYPE.ReplicaSetWithPrimary
+    branch = f"bench-{uuid.uuid4().hex[:8]}"
+    db = database.get_database()
+    try:
+        plan_id = db.subscription_plans.insert_one({
+            "plan_name": "Bench", "duration_months": 1, "price": PLAN_PRICE, "branch_id": branch
+        }).inserted_id
+        plan_catalog.refresh()
+
+        modes = [("single writes", False)]
+        if replica_set:
+            modes.insert(0, ("transactions", True))
+        else:
+            print("transactions   skipped (not a replica set)")
+        for label, transactions in modes:
+            settings.mongodb_transactions = transactions
+            member_ids = [str(member_id) for member_id in db.members.insert_many([
+                {"name": f"Bench {i}", "email": f"bench{i}@example.com", "status": "inactive",
+                 "join_date": datetime.now(), "branch_id": branch}
+                for i in range(args.members)
+            ]).inserted_ids]
+            run(label, branch, str(plan_id), member_ids, args.cycles, args.threads)
+    finally:
+        for name in COLLECTIONS:
+            db[name].delete_many({"branch_id": branch})
+        plan_catalog.refresh()
+        database.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Benchmark how request throughput scales with the number of workers.
+
+Run from the backend folder against the configured database. It starts the
+production profile (gunicorn.conf.py) once per worker count on a spare
+port, loads it for a while, and stops it again:
+
+    python -m scripts.bench_workers
+    python -m scripts.bench_workers --workers 1 2 4 8 --clients 32 --seconds 20
+    python -m scripts.bench_workers --path "/members/?status=active"
+
+The default request is GET /members/{member_id} for members seeded into the
+default branch (removed afterwards), i.e. one indexed read per request.
+Clients are separate processes with one keep-alive connection each, so the
+load generator is not limited to one core; it shares the machine with the
+server though, so leave it some cores (or fewer workers) for clean numbers.
+
+Reported per worker count: requests per second, latency percentiles, errors
+and the speedup over the first worker count.
+"""
+import argparse
+import http.client
+import multiprocessing
+import os
+import signal
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime
+from app import database
+from app.config import settings
+
+def wait_until_up(port: int, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+            connection.request("GET", "/health")
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"server on port {port} did not start within {timeout:.0f}s")
+
+def client(job: tuple) -> tuple:
+    """One keep-alive connection requesting paths until the deadline"""
+    port, paths, offset, deadline = job
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    latencies, errors = [], 0
+    i = offset
+    while time.time() < deadline:
+        started = time.perf_counter()
+        try:
+            connection.request("GET", paths[i % len(paths)])
+            response = connection.getresponse()
+            response.read()
+            if response.status != 200:
+                errors += 1
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            connection.close()
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        latencies.append(time.perf_counter() - started)
+        i += 1
+    connection.close()
+    return latencies, errors
+
+def load(pool, port: int, paths: list, clients: int, seconds: float) -> tuple:
+    deadline = time.time() + seconds
+    results = pool.map(client, [(port, paths, i * 7919, deadline) for i in range(clients)])
+    latencies = sorted(latency for result in results for latency in result[0])
+    return latencies, sum(result[1] for result in results)
+
+def run(workers: int, port: int, paths: list, args, pool) -> float:
+    env = {**os.environ, "WEB_CONCURRENCY": str(workers), "PORT": str(port)}
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "app.main:app", "-c", "gunicorn.conf.py", "--access-logfile", "/dev/null"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        wait_until_up(port)
+        # Warm every worker's pool and caches before measuring
+        load(pool, port, paths, args.clients, args.warmup)
+        latencies, errors = load(pool, port, paths, args.clients, args.seconds)
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=60)
+
+    throughput = len(latencies) / args.seconds
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+    print(f"{workers:>3} workers {throughput:>9.0f} req/s   p50 {p50:.2f}ms   p99 {p99:.2f}ms   {errors} errors", end="")
+    return throughput
+
+def main():
+    cores = multiprocessing.cpu_count()
+    default_workers = sorted({1, *(2 ** i for i in range(1, cores.bit_length()) if 2 ** i < cores), cores})
+    parser = argparse.ArgumentParser(description="Benchmark throughput by worker count")
+    parser.add_argument("--workers", type=int, nargs="+", default=default_workers)
+    parser.add_argument("--clients", type=int, default=2 * cores, help="concurrent keep-alive connections")
+    parser.add_argument("--seconds", type=float, default=10, help="measured load per worker count")
+    parser.add_argument("--warmup", type=float, default=3)
+    parser.add_argument("--members", type=int, default=1000, help="members seeded for {member_id}")
+    parser.add_argument("--path", default="/members/{member_id}")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    database.connect()
+    run_id = f"bench-{uuid.uuid4().hex[:8]}"
+    members = database.get_database().members
+    paths = [args.path]
+    try:
+        if "{member_id}" in args.path:
+            member_ids = members.insert_many([
+                {"name": f"Bench {i}", "email": f"bench{i}@example.com", "phone": "5550000000", "age": 30,
+                 "gender": "Other", "address": "Bench", "emergency_contact": "5550000001", "status": "active",
+                 "join_date": datetime.now(), "branch_id": settings.default_branch, "bench_run": run_id}
+                for i in range(args.members)
+            ]).inserted_ids
+            paths = [args.path.format(member_id=member_id) for member_id in member_ids]
+
+        print(f"{cores} cores, {args.clients} clients, {args.seconds:.0f}s per run, GET {args.path}")
+        baseline = None
+        with multiprocessing.Pool(args.clients) as pool:
+            for workers in args.workers:
+                throughput = run(workers, args.port, paths, args, pool)
+                baseline = baseline or throughput
+                print(f"   x{throughput / baseline:.2f}")
+    finally:
+        members.delete_many({"bench_run": run_id})
+        database.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""Check that analytics reads are served by secondaries.
+
+Run from the backend folder against a replica set (see
+docker-compose.replica.yml in the repository root):
+
+    python -m scripts.check_read_routing
+
+Prints the replica set members with their replication lag, then runs a read
+with the analytics read preference (ANALYTICS_READ_PREFERENCE) and one with
+the default, and shows which member served each.
+"""
+import time
+from app import database
+from app.config import settings
+from app.database import (
+    members_collection,
+    read_preference_scope,
+    replication_lag,
+    servers_read,
+    ANALYTICS_READS
+)
+
+def served_by(preference) -> set:
+    servers = set()
+    token = servers_read.set(servers)
+    try:
+        with read_preference_scope(preference):
+            members_collection.count_documents({})
+    finally:
+        servers_read.reset(token)
+    return servers
+
+def main():
+    client = database.connect()
+    client.admin.command("ping")
+    # Let the driver discover every member
+    time.sleep(1)
+
+    print("Members:")
+    for address, server in sorted(client.topology_description.server_descriptions().items()):
+        lag = replication_lag({address})
+        print(f"  {address[0]}:{address[1]:<6} {server.server_type_name:<12} lag {lag:.1f}s")
+
+    print(f"\nAnalytics reads ({settings.analytics_read_preference}, "
+          f"maxStalenessSeconds {settings.analytics_max_staleness_seconds}):")
+    servers = served_by(ANALYTICS_READS)
+    for address in servers:
+        print(f"  served by {address[0]}:{address[1]}, X-Read-Staleness {replication_lag({address}):.1f}")
+    if not servers:
+        print("  served by the primary (ANALYTICS_READ_PREFERENCE=primary)")
+
+    # Default reads are not tracked: they always go to the primary
+    print(f"\nOther reads: primary {client.primary}")
+    database.close()
+
+if __name__ == "__main__":
+    main()
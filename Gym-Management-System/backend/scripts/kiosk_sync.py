@@ -0,0 +1,45 @@
+"""Sync a kiosk's local store with the central database now.
+
+Run from the backend folder on the kiosk (KIOSK_DB_PATH, KIOSK_BRANCH from
+.env), e.g. right after the link comes back instead of waiting for the next
+KIOSK_SYNC_INTERVAL_SECONDS:
+
+    python -m scripts.kiosk_sync
+    python -m scripts.kiosk_sync --no-snapshot   # only push pending visits
+    python -m scripts.kiosk_sync --conflicts     # list rejected check-ins
+
+Pending check-ins and check-outs are written to MongoDB, then the member
+snapshot is refreshed. Check-ins rejected because the member was checked in
+elsewhere meanwhile stay in the kiosk database for review (see app/kiosk.py).
+"""
+import argparse
+import time
+from app import database
+from app.kiosk import kiosk_store, sync
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync the kiosk's local store")
+    parser.add_argument("--no-snapshot", action="store_true", help="don't refresh the member snapshot")
+    parser.add_argument("--conflicts", action="store_true", help="list conflicting check-ins and exit")
+    args = parser.parse_args()
+
+    kiosk_store.open()
+    if args.conflicts:
+        for visit in kiosk_store.conflicts():
+            print(f"{visit['_id']}  member {visit['member_id']}  "
+                  f"{visit['check_in_time']:%Y-%m-%d %H:%M} - {visit['check_out_time'] or 'open'}")
+        kiosk_store.close()
+        return
+
+    database.connect()
+    started = time.perf_counter()
+    result = sync(kiosk_store, snapshot=not args.no_snapshot)
+    print(f"{result['synced']} visits synced, {result['conflicts']} conflicts")
+    if "members" in result:
+        print(f"{result['members']} members in the snapshot")
+    print(f"Done in {time.perf_counter() - started:.1f}s ({kiosk_store.status()['pending']} still pending)")
+    database.close()
+    kiosk_store.close()
+
+if __name__ == "__main__":
+    main()
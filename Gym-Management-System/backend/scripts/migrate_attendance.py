@@ -0,0 +1,124 @@
+"""Migrate attendance between the "documents" and "buckets" layouts.
+
+Run from the backend folder:
+
+    python -m scripts.migrate_attendance --to buckets
+    python -m scripts.migrate_attendance --to documents
+    python -m scripts.migrate_attendance --report
+
+The copy runs server-side ($merge) and is safe to re-run. The source layout
+is left untouched, so switch ATTENDANCE_STORAGE once the copy is verified and
+drop the old collection afterwards. --report prints storage size and times a
+range scan for each layout.
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+from app import database
+from app.attendance_store import DocumentAttendanceStore, BucketAttendanceStore
+
+# Copied visits are already in the member counters: mark them like the API
+# does, so the change stream consumer doesn't count them again
+MARK_COUNTED = {"$set": {
+    "counted": True,
+    "minutes_counted": {"$cond": [{"$ifNull": ["$check_out_time", False]}, True, "$$REMOVE"]}
+}}
+
+def to_buckets():
+    database.create_attendance_indexes("buckets")
+
+    # Group visits into member-month buckets
+    database.attendance_collection.aggregate([
+        {"$sort": {"check_in_time": 1}},
+        MARK_COUNTED,
+        {"$group": {
+            "_id": {"member_id": "$member_id", "month": {"$substrBytes": ["$date", 0, 7]}},
+            "branch_id": {"$first": "$branch_id"},
+            "visits": {"$push": "$$ROOT"},
+            "count": {"$sum": 1}
+        }},
+        {"$project": {
+            "_id": {"$concat": ["$_id.member_id", ":", "$_id.month"]},
+            "branch_id": 1,
+            "member_id": "$_id.member_id",
+            "month": "$_id.month",
+            "visits": 1,
+            "count": 1
+        }},
+        {"$unset": ["visits.member_id", "visits.branch_id"]},
+        {"$merge": {"into": "attendance_buckets", "whenMatched": "replace"}}
+    ], allowDiskUse=True)
+
+    # Rebuild the open-session guards
+    for visit in database.attendance_collection.find({"check_out_time": None}):
+        database.attendance_open_collection.replace_one(
+            {"_id": visit["member_id"]},
+            {"branch_id": visit.get("branch_id"), "attendance_id": visit["_id"], "month": visit["date"][:7]},
+            upsert=True
+        )
+
+def to_documents():
+    database.create_attendance_indexes("documents")
+
+    database.attendance_buckets_collection.aggregate([
+        {"$unwind": "$visits"},
+        {"$replaceRoot": {"newRoot": {
+            "$mergeObjects": ["$visits", {"member_id": "$member_id", "branch_id": "$branch_id"}]
+        }}},
+        MARK_COUNTED,
+        {"$merge": {"into": "attendance", "whenMatched": "keepExisting"}}
+    ], allowDiskUse=True)
+
+def collection_size(name: str) -> dict:
+    stats = database.get_database().command("collStats", name)
+    return {
+        "documents": stats.get("count", 0),
+        "data_mb": round(stats.get("size", 0) / 1024 / 1024, 2),
+        "storage_mb": round(stats.get("storageSize", 0) / 1024 / 1024, 2),
+        "index_mb": round(stats.get("totalIndexSize", 0) / 1024 / 1024, 2)
+    }
+
+def time_range_scan(store, days: int, repeat: int = 5) -> tuple:
+    """Best-of-N time (ms) and row count for a `days`-long date range scan"""
+    start = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
+    query = {"date": {"$gte": start}}
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        rows = len(store.find(query))
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best, 1), rows
+
+def report(days: int):
+    for name, store in (("attendance", DocumentAttendanceStore()),
+                        ("attendance_buckets", BucketAttendanceStore())):
+        size = collection_size(name)
+        elapsed, rows = time_range_scan(store, days)
+        print(f"{store.layout:<10} {name:<20} docs={size['documents']:<10} "
+              f"data={size['data_mb']}MB storage={size['storage_mb']}MB "
+              f"indexes={size['index_mb']}MB  last {days} days: {rows} visits in {elapsed}ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate attendance storage layout")
+    parser.add_argument("--to", choices=["buckets", "documents"])
+    parser.add_argument("--report", action="store_true", help="compare storage size and range scans")
+    parser.add_argument("--days", type=int, default=30, help="range scanned by --report")
+    args = parser.parse_args()
+
+    database.connect()
+    if args.to:
+        started = time.perf_counter()
+        if args.to == "buckets":
+            to_buckets()
+        else:
+            to_documents()
+        print(f"Copied attendance to '{args.to}' layout in {time.perf_counter() - started:.1f}s")
+    if args.report:
+        report(args.days)
+    if not args.to and not args.report:
+        parser.print_help()
+    database.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Convert workout plans whose exercises are a JSON or text string.
+
+Plans created before structured exercises store one string. Run once from
+the backend folder after upgrading:
+
+    python -m scripts.migrate_workout_plans --dry-run
+    python -m scripts.migrate_workout_plans
+
+Each plan gets exercise sub-documents parsed from the string; the original
+text moves to the plan notes. Items that fail validation are dropped (they
+remain in the notes). Safe to re-run: only plans still holding a string are
+updated.
+"""
+import argparse
+from pymongo import UpdateOne
+from app import database, http_cache
+from app.schemas.attendance_schema import convert_legacy_plan
+
+BATCH_SIZE = 500
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert string workout plans to exercise sub-documents")
+    parser.add_argument("--dry-run", action="store_true", help="print what would change")
+    args = parser.parse_args()
+
+    database.connect()
+    plans = database.workout_plans_collection
+    converted = empty = 0
+    batch = []
+    for plan in plans.find({"exercises": {"$type": "string"}}):
+        update = convert_legacy_plan(plan)
+        converted += 1
+        if not update["exercises"]:
+            empty += 1
+        if args.dry_run:
+            names = ", ".join(e["name"] for e in update["exercises"][:5])
+            print(f"{plan['_id']} {plan['plan_name']!r}: {len(update['exercises'])} exercises ({names})")
+            continue
+
+        # Matching the string type again skips plans edited meanwhile
+        batch.append(UpdateOne({"_id": plan["_id"], "exercises": {"$type": "string"}}, {"$set": update}))
+        if len(batch) >= BATCH_SIZE:
+            plans.bulk_write(batch, ordered=False)
+            batch = []
+    if batch:
+        plans.bulk_write(batch, ordered=False)
+
+    action = "Would convert" if args.dry_run else "Converted"
+    print(f"{action} {converted} plans ({empty} without recognised exercises, text kept in notes)")
+    if not args.dry_run:
+        # Multikey exercise and trainer indexes
+        database.create_indexes()
+        # Cached plan lists are stale now
+        http_cache.bump("workout_plans")
+    database.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+"""Rebuild per-member attendance counters from the attendance history.
+
+Run from the backend folder once after upgrading (backfill), or whenever the
+counters may have drifted (e.g. attendance edited outside the API):
+
+    python -m scripts.rebuild_attendance_stats
+    python -m scripts.rebuild_attendance_stats --member <member_id>
+"""
+import argparse
+import time
+from app import database
+from app.attendance_stats import rebuild_all_stats, rebuild_member_stats
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild member attendance counters")
+    parser.add_argument("--member", help="only rebuild this member")
+    args = parser.parse_args()
+
+    database.connect()
+    started = time.perf_counter()
+    if args.member:
+        rebuild_member_stats(args.member)
+        print(f"Rebuilt counters for member {args.member}")
+    else:
+        members = rebuild_all_stats()
+        print(f"Rebuilt counters for {members} members in {time.perf_counter() - started:.1f}s")
+    database.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Test database setup.
+
+Tests run against a throwaway database on TEST_MONGODB_URL, e.g. a local
+single-node replica set:
+
+    TEST_MONGODB_URL=mongodb://localhost:27017/?replicaSet=rs0 python -m pytest
+
+Without it they fall back to mongomock (in-process, so it checks the
+guards but not real interleaving). Tests that depend on how the server runs
+unordered bulk writes use the unordered_bulk_writes fixture.
+"""
+import os
+import sys
+import uuid
+import pytest
+from pymongo import DeleteMany, DeleteOne, InsertOne
+from pymongo.errors import BulkWriteError
+
+# The backend folder, so `app` imports like it does under uvicorn
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ["DATABASE_NAME"] = f"gym_test_{uuid.uuid4().hex[:8]}"
+os.environ.setdefault("SECRET_KEY", "test-secret-key")
+# Scans go straight to the database
+os.environ["ATTENDANCE_WRITE_BEHIND"] = "False"
+os.environ["KIOSK_MODE"] = "False"
+if os.environ.get("TEST_MONGODB_URL"):
+    os.environ["MONGODB_URL"] = os.environ["TEST_MONGODB_URL"]
+else:
+    import mongomock
+    import mongomock.filtering
+    import pymongo
+    os.environ["MONGODB_URL"] = "mongodb://localhost:27017"
+    os.environ["MONGODB_TRANSACTIONS"] = "False"
+    # Must be patched before app.database imports it
+    pymongo.MongoClient = mongomock.MongoClient
+    # mongomock 4.3 lacks the "null" alias used by the open-session indexes
+    mongomock.filtering.TYPE_MAP["null"] = lambda value: value is None
+
+from app import database
+
+@pytest.fixture(scope="session")
+def db():
+    database.connect()
+    database.create_indexes()
+    yield database.get_database()
+    database.client.drop_database(database.database.name)
+    database.close()
+
+@pytest.fixture
+def unordered_bulk_writes(monkeypatch):
+    """Run unordered bulk writes like pymongo and the server do: every insert
+    first, then updates, then deletes (mongomock runs them as given)"""
+    if os.environ.get("TEST_MONGODB_URL"):
+        return
+    bulk_write = mongomock.Collection.bulk_write
+
+    def kind(request) -> int:
+        if isinstance(request, InsertOne):
+            return 0
+        return 2 if isinstance(request, (DeleteOne, DeleteMany)) else 1
+
+    def reordered(self, requests, ordered=True, **kwargs):
+        if ordered:
+            return bulk_write(self, requests, ordered=ordered, **kwargs)
+        order = sorted(range(len(requests)), key=lambda i: kind(requests[i]))
+        try:
+            return bulk_write(self, [requests[i] for i in order], ordered=False, **kwargs)
+        except BulkWriteError as e:
+            # Error indexes refer to the requests as given
+            for error in e.details["writeErrors"]:
+                error["index"] = order[error["index"]]
+            raise
+
+    monkeypatch.setattr(mongomock.Collection, "bulk_write", reordered)
@@ -0,0 +1,67 @@
+"""A member checking in, out and in again within one write-behind batch.
+
+Unordered bulk writes run every insert before any update or delete, so the
+second check-in must not share a bulk_write with the check-out before it:
+its insert would hit the still-open first session and be dropped as a
+conflict although the scan was acknowledged.
+"""
+from datetime import datetime, timedelta
+import pytest
+from bson import json_util
+from app.attendance_buffer import JSON_OPTIONS, AttendanceBuffer
+from app.attendance_store import check_out_fields, create_store, new_visit
+from app.attendance_stats import get_member_stats
+from app.database import create_attendance_indexes
+
+@pytest.fixture(params=["documents", "buckets"])
+def store(request, db, unordered_bulk_writes):
+    create_attendance_indexes(request.param)
+    return create_store(request.param)
+
+@pytest.fixture
+def buffer(store, tmp_path):
+    # Not started: the test flushes by hand
+    buffer = AttendanceBuffer(store, str(tmp_path / "spill.jsonl"))
+    buffer.spill = open(buffer.spill_path, "a")
+    yield buffer
+    buffer.spill.close()
+
+def return_visit(member_id: str, day: datetime) -> tuple:
+    """Events for a visit, its check-out and a second visit the same day"""
+    first = new_visit(member_id, day.replace(hour=7))
+    closed = {**first, **check_out_fields(day.replace(hour=8))}
+    second = new_visit(member_id, day.replace(hour=18))
+    events = [
+        {"type": "check_in", "visit": first, "join_date": None},
+        {"type": "check_out", "visit": closed},
+        {"type": "check_in", "visit": second, "join_date": None}
+    ]
+    return events, first, second
+
+def assert_both_visits(store, member_id: str, first: dict, second: dict):
+    assert store.get(first["_id"])["check_out_time"] == first["check_in_time"] + timedelta(hours=1)
+    assert store.get(second["_id"])["check_out_time"] is None
+    assert get_member_stats(member_id)["total_visits"] == 2
+
+def test_return_visit_in_one_flush(store, buffer):
+    member_id = f"flush-{store.bulk_order[0]}"
+    events, first, second = return_visit(member_id, datetime(2024, 6, 3))
+
+    assert buffer.check_in(events[0]["visit"])
+    assert buffer.check_out(first["_id"], events[1]["visit"]["check_out_time"])
+    assert buffer.check_in(second)
+    buffer.flush()
+
+    assert_both_visits(store, member_id, first, second)
+    assert buffer.open_by_member[member_id]["_id"] == second["_id"]
+
+def test_return_visit_in_replay(store, buffer):
+    member_id = f"replay-{store.bulk_order[0]}"
+    events, first, second = return_visit(member_id, datetime(2024, 7, 3))
+    with open(buffer.spill_path, "w") as f:
+        for event in events:
+            f.write(json_util.dumps(event, json_options=JSON_OPTIONS) + "\n")
+
+    buffer._replay()
+
+    assert_both_visits(store, member_id, first, second)
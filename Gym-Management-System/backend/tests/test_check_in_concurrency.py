@@ -0,0 +1,71 @@
+"""Concurrent scans for one member must leave exactly one open session.
+
+Several threads check the same member in (double scans at the desk, retries
+from a flaky kiosk), then several check the session out; the open-session
+key and the conditional check-out must let exactly one of each through and
+the counters must match the visits that were recorded.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import pytest
+from app import front_desk as front_desk_module
+from app.attendance_store import create_store, new_visit
+from app.attendance_stats import get_member_stats, visit_minutes
+from app.database import create_attendance_indexes, members_collection
+
+THREADS = 8
+ROUNDS = 5
+
+@pytest.fixture(params=["documents", "buckets"])
+def store(request, db, monkeypatch):
+    create_attendance_indexes(request.param)
+    store = create_store(request.param)
+    monkeypatch.setattr(front_desk_module, "attendance_store", store)
+    return store
+
+@pytest.fixture
+def member(db):
+    join_date = datetime(2024, 1, 15)
+    result = members_collection.insert_one({
+        "name": "Concurrency Test", "email": "concurrency@example.com",
+        "status": "active", "join_date": join_date
+    })
+    return str(result.inserted_id), join_date
+
+def run_concurrently(call, count: int) -> list:
+    with ThreadPoolExecutor(max_workers=count) as pool:
+        return list(pool.map(lambda _: call(), range(count)))
+
+def recorded(store, visits: list) -> list:
+    """The visits that made it into the store, as stored"""
+    return [stored for stored in (store.get(visit["_id"]) for visit in visits) if stored]
+
+def test_concurrent_check_ins_and_check_outs(store, member):
+    member_id, join_date = member
+    desk = front_desk_module.MongoFrontDesk()
+    visits = []
+
+    for round in range(ROUNDS):
+        # A month per round: mongomock resolves visits.$ to the bucket's first
+        # visit, so each round gets its own bucket
+        check_in_time = datetime(2024, 3 + round, 1, 7)
+        candidates = [new_visit(member_id, check_in_time) for _ in range(THREADS)]
+        pending = iter(candidates)
+        accepted = run_concurrently(lambda: desk.check_in(next(pending), join_date), THREADS)
+        assert accepted.count(True) == 1
+        stored = recorded(store, candidates)
+        assert len(stored) == 1
+        assert stored[0]["check_out_time"] is None
+
+        checkout_time = check_in_time + timedelta(minutes=45 + round)
+        closed = run_concurrently(lambda: desk.check_out(stored[0]["_id"], checkout_time), THREADS)
+        closed = [visit for visit in closed if visit is not None]
+        assert len(closed) == 1
+        assert recorded(store, candidates)[0]["check_out_time"] == checkout_time
+        visits.append(closed[0])
+
+    stats = get_member_stats(member_id)
+    assert stats["total_visits"] == ROUNDS
+    assert stats["monthly"] == {f"2024-{3 + round:02d}": 1 for round in range(ROUNDS)}
+    assert stats["total_minutes"] == pytest.approx(sum(visit_minutes(visit) for visit in visits))
+    assert stats["join_month"] == "2024-01"
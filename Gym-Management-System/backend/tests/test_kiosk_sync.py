@@ -0,0 +1,54 @@
+"""A member who visits the kiosk twice while the central database is down.
+
+Both visits are pending when the link comes back and are pushed in one
+batch: each as a check-in followed by its check-out. The second check-in
+must reach MongoDB rather than conflict with the first visit. Kiosk
+check-ins belong to the kiosk's branch whatever branch the request had.
+"""
+from datetime import datetime
+import pytest
+from app import kiosk
+from app.attendance_store import create_store, new_visit
+from app.attendance_stats import get_member_stats
+from app.branches import branch_scope
+from app.database import create_attendance_indexes
+
+@pytest.fixture(params=["documents", "buckets"])
+def store(request, db, unordered_bulk_writes, monkeypatch):
+    create_attendance_indexes(request.param)
+    store = create_store(request.param)
+    monkeypatch.setattr(kiosk, "attendance_store", store)
+    return store
+
+@pytest.fixture
+def kiosk_store(tmp_path):
+    kiosk_store = kiosk.KioskStore(str(tmp_path / "kiosk.sqlite3"))
+    kiosk_store.open()
+    yield kiosk_store
+    kiosk_store.close()
+
+def test_two_offline_visits_sync(store, kiosk_store):
+    member_id = f"kiosk-{store.bulk_order[0]}"
+    day = datetime(2024, 8, 5)
+    visits = []
+    for hour in (7, 18):
+        visit = new_visit(member_id, day.replace(hour=hour))
+        assert kiosk_store.check_in(visit)
+        visits.append(kiosk_store.check_out(visit["_id"], day.replace(hour=hour + 1)))
+
+    assert kiosk.sync(kiosk_store, snapshot=False) == {"synced": 2, "conflicts": 0}
+
+    assert kiosk_store.status()["pending"] == 0
+    assert kiosk_store.conflicts() == []
+    for visit in visits:
+        assert store.get(visit["_id"])["check_out_time"] == visit["check_out_time"]
+    assert get_member_stats(member_id)["total_visits"] == 2
+
+def test_check_in_tagged_with_kiosk_branch(kiosk_store, monkeypatch):
+    monkeypatch.setattr(kiosk.settings, "kiosk_branch", "north")
+    visit = new_visit("kiosk-branch", datetime(2024, 8, 6, 7))
+    # Anonymous scans carry the default branch
+    with branch_scope(kiosk.settings.default_branch):
+        assert kiosk_store.check_in(visit)
+
+    assert kiosk_store.get_visit(visit["_id"])["branch_id"] == "north"
@@ -61,6 +61,28 @@ function formatDateTime(dateString) {
     });
 }
 
+// Workout plan as text: the plan text as entered (kept in the notes when a
+// text plan is converted), otherwise the exercises grouped by day
+function formatExercises(plan) {
+    if (plan.notes) {
+        return plan.notes;
+    }
+    let text = '';
+    let day = null;
+    (plan.exercises || []).forEach(exercise => {
+        if (exercise.day && exercise.day !== day) {
+            day = exercise.day;
+            text += `${text ? '\n' : ''}${day}\n`;
+        }
+        let line = `- ${exercise.name}`;
+        if (exercise.sets) line += `: ${exercise.sets} sets`;
+        if (exercise.reps) line += ` x ${exercise.reps}`;
+        if (exercise.load_kg) line += ` @ ${exercise.load_kg}kg`;
+        text += line + '\n';
+    });
+    return text;
+}
+
 // API Call Function WITH AUTHENTICATION
 async function apiCall(endpoint, method = 'GET', data = null) {
     const token = localStorage.getItem('access_token');
@@ -367,7 +367,7 @@ function displayWorkoutPlans(plans) {
                     </p>
                     <hr>
                     <strong>Exercises:</strong>
-                    <pre class="mt-2" style="white-space: pre-wrap; font-size: 0.9rem; max-height: 300px; overflow-y: auto;">${plan.exercises}</pre>
+                    <pre class="mt-2" style="white-space: pre-wrap; font-size: 0.9rem; max-height: 300px; overflow-y: auto;">${formatExercises(plan)}</pre>
                 </div>
                 <div class="card-footer bg-transparent">
                     <button class="btn btn-sm btn-warning" onclick="editWorkoutPlan('${plan._id}')">
@@ -210,7 +210,7 @@ async function loadWorkoutPlans() {
                     ${plan.trainer_name ? `<small class="text-muted"> | Trainer: ${plan.trainer_name}</small>` : ''}
                 </div>
                 <div class="card-body">
-                    <pre style="white-space: pre-wrap; font-family: inherit;">${plan.exercises}</pre>
+                    <pre style="white-space: pre-wrap; font-family: inherit;">${formatExercises(plan)}</pre>
                 </div>
             </div>
         `).join('');